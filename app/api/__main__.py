@@ -0,0 +1,27 @@
+import argparse
+import asyncio
+import logging
+
+import tornado.netutil
+import tornado.process
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the chat HTTP API.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1, help="worker processes sharing the listening socket")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    sockets = tornado.netutil.bind_sockets(args.port, args.host)
+    task_id = 0
+    if args.workers > 1:
+        # fork before the services are imported: db pools and the runtime loop must not cross a fork
+        task_id = tornado.process.fork_processes(args.workers)
+
+    from api.server import serve
+    from core.metrics import METRICS_PORT
+    asyncio.run(serve(sockets, metrics_port=METRICS_PORT + task_id, workers=args.workers))
+
+if __name__ == "__main__":
+    main()
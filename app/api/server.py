@@ -0,0 +1,338 @@
+"""Headless HTTP API for the chat services.
+
+Exposes session creation, listing, search and deletion, paginated history,
+token-by-token replies and session change events streamed as Server-Sent
+Events, and a readiness probe. The Streamlit UI is a thin client of this
+service (see services/api_client.py), so the API can run as several worker
+processes behind a load balancer.
+
+Run from the app/ directory: python -m api --port 8000 --workers 4
+"""
+import asyncio
+from datetime import datetime
+import json
+import logging
+import signal
+import uuid
+
+import tornado.httpserver
+import tornado.iostream
+import tornado.web
+
+from services.chat import (
+    aget_response_stream, aget_message_page, alist_session_catalog, catalog_cursor, adelete_chat,
+    asearch_chats, search_cursor, handle_session_event, HISTORY_WRITER, HISTORY_PAGE_SIZE,
+)
+from services.chat_sessions import get_session_title
+from services.title_worker import TITLE_WORKER, DEFAULT_TITLE
+from services.startup import STARTUP
+from services.generations import GENERATIONS, USER, DISCONNECT, DELETED
+from services.session_events import SESSION_EVENTS, start_session_events
+from db.write_behind import MESSAGE_WRITER, WRITE_BEHIND_REPLY_TIMEOUT
+from core.scheduler import SchedulerOverloaded, SchedulerTimeout
+from core.metrics import start_metrics_server, METRICS_PORT
+from core.streaming import ChunkCoalescer
+
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+API_MAX_PAGE_SIZE = int(os.getenv("API_MAX_PAGE_SIZE", "200"))
+BUSY_RETRY_AFTER = 5  # seconds suggested to clients when the model is saturated
+SESSION_EVENTS_KEEPALIVE = float(os.getenv("SESSION_EVENTS_KEEPALIVE", "15"))  # seconds between keepalive comments
+
+def _json_default(value):
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+class BaseHandler(tornado.web.RequestHandler):
+    def set_default_headers(self):
+        self.set_header("Content-Type", "application/json")
+
+    def write_json(self, payload, status=200):
+        self.set_status(status)
+        self.finish(json.dumps(payload, default=_json_default))
+
+    def write_error(self, status_code, **kwargs):
+        self.finish(json.dumps({"error": self._reason}))
+
+    def write_event(self, event, payload):
+        self.write(f"event: {event}\ndata: {json.dumps(payload)}\n\n")
+
+    def session_id_arg(self, session_id):
+        try:
+            return str(uuid.UUID(session_id))
+        except ValueError:
+            raise tornado.web.HTTPError(400, reason="Invalid session id")
+
+    def message_id_arg(self, name):
+        value = self.get_query_argument(name, None)
+        try:
+            return int(value) if value else None
+        except ValueError:
+            raise tornado.web.HTTPError(400, reason=f"{name} must be a message id")
+
+    def limit_arg(self, default):
+        try:
+            limit = int(self.get_query_argument("limit", default))
+        except ValueError:
+            raise tornado.web.HTTPError(400, reason="limit must be an integer")
+        return max(1, min(limit, API_MAX_PAGE_SIZE))
+
+class ReadyHandler(BaseHandler):
+    async def get(self):
+        """Readiness probe: 200 once the DB answers and the model is loaded, 503 until then."""
+        readiness = await STARTUP.readiness()
+        self.write_json(readiness, status=200 if readiness["ready"] else 503)
+
+class SessionsHandler(BaseHandler):
+    async def get(self):
+        """List sessions, most recent first. Follow `next` to page back in time."""
+        limit = self.limit_arg(20)
+        before_ts = self.get_query_argument("before_ts", None)
+        before_id = self.get_query_argument("before_id", None)
+        before = None
+        if before_ts and before_id:
+            try:
+                before = (datetime.fromisoformat(before_ts), self.session_id_arg(before_id))
+            except ValueError:
+                raise tornado.web.HTTPError(400, reason="Invalid cursor")
+        page = await alist_session_catalog(limit=limit, before=before)
+        cursor = catalog_cursor(page, limit)
+        self.write_json({
+            "sessions": page,
+            "next": {"before_ts": cursor[0], "before_id": cursor[1]} if cursor else None,
+        })
+
+    def post(self):
+        """Allocate a session id. The session is stored with its first message."""
+        self.write_json({"session_id": str(uuid.uuid4())}, status=201)
+
+class SessionEventsHandler(BaseHandler):
+    _unsubscribe = None
+
+    async def get(self):
+        """Stream session created, title and deleted events as Server-Sent Events.
+
+        Every worker listens to Postgres, so a client sees changes made
+        through any of them. After an event of type "resync" the client
+        should reload what it caches, as events may have been missed.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        self._unsubscribe = SESSION_EVENTS.subscribe(lambda event: loop.call_soon_threadsafe(queue.put_nowait, event))
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+        try:
+            self.write(": connected\n\n")
+            await self.flush()
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), SESSION_EVENTS_KEEPALIVE)
+                    self.write_event(event["event"], event)
+                except asyncio.TimeoutError:
+                    self.write(": keepalive\n\n")
+                await self.flush()
+        except tornado.iostream.StreamClosedError:
+            pass
+        finally:
+            self._unsubscribe()
+
+    def on_connection_close(self):
+        if self._unsubscribe is not None:
+            self._unsubscribe()
+
+class SearchHandler(BaseHandler):
+    async def get(self):
+        """Search messages and titles with `q`, best matching session first. Follow `next` for more."""
+        query = self.get_query_argument("q", "")
+        limit = self.limit_arg(20)
+        before_rank = self.get_query_argument("before_rank", None)
+        before_id = self.get_query_argument("before_id", None)
+        before = None
+        if before_rank and before_id:
+            try:
+                before = (float(before_rank), self.session_id_arg(before_id))
+            except ValueError:
+                raise tornado.web.HTTPError(400, reason="Invalid cursor")
+        results = await asearch_chats(query, limit=limit, before=before)
+        cursor = search_cursor(results, limit)
+        self.write_json({
+            "results": results,
+            "next": {"before_rank": cursor[0], "before_id": cursor[1]} if cursor else None,
+        })
+
+class SessionHandler(BaseHandler):
+    async def get(self, session_id):
+        session_id = self.session_id_arg(session_id)
+        title = await get_session_title(session_id)
+        self.write_json({"session_id": session_id, "title": title})
+
+    async def delete(self, session_id):
+        session_id = self.session_id_arg(session_id)
+        GENERATIONS.cancel(session_id, DELETED)
+        TITLE_WORKER.cancel(session_id)
+        await adelete_chat(session_id)  # also removes the sessions row, title included
+        self.set_status(204)
+        self.finish()
+
+class CancelHandler(BaseHandler):
+    def post(self, session_id):
+        """Stop the session's replies streaming from this process; each keeps what it generated so far.
+
+        Clients that close the stream instead are detected by whichever
+        process serves it.
+        """
+        session_id = self.session_id_arg(session_id)
+        self.write_json({"cancelled": GENERATIONS.cancel(session_id, USER)})
+
+class MessagesHandler(BaseHandler):
+    _stream_task = None
+    _client_gone = False
+
+    def on_connection_close(self):
+        # an abandoned stream stops generating at once instead of on its next write
+        self._client_gone = True
+        if self._stream_task is not None:
+            GENERATIONS.cancel_task(self._stream_task, DISCONNECT)
+
+    async def get(self, session_id):
+        """One page of history, oldest first. Pass `next_before` back as `before` for older
+        messages, or the last id seen as `after` for everything newer."""
+        session_id = self.session_id_arg(session_id)
+        limit = self.limit_arg(HISTORY_PAGE_SIZE)
+        before = self.message_id_arg("before")
+        after = self.message_id_arg("after")
+        messages, next_before = await aget_message_page(session_id, before, limit, after)
+        self.write_json({"messages": messages, "next_before": next_before})
+
+    async def post(self, session_id):
+        """Send a user message and stream the reply as Server-Sent Events.
+
+        Events: `token` ({"content"}) per batch of chunks (see STREAM_FLUSH_*), then `done` ({"usage"}),
+        `cancelled` ({}) if the reply was stopped, or `error` ({"error"}) if
+        generation fails midway. A saturated model is reported up front as 503
+        with Retry-After.
+        """
+        STARTUP.request_started()
+        session_id = self.session_id_arg(session_id)
+        try:
+            content = json.loads(self.request.body or b"{}").get("content", "")
+        except (ValueError, AttributeError):
+            raise tornado.web.HTTPError(400, reason="Body must be a JSON object")
+        if not isinstance(content, str) or not content.strip():
+            raise tornado.web.HTTPError(400, reason="content is required")
+
+        title = await get_session_title(session_id)
+
+        self._stream_task = asyncio.current_task()
+        stream = aget_response_stream(session_id, content)
+        coalescer = ChunkCoalescer()  # one event per flush window instead of per token
+        try:
+            # the stream waits for a scheduler slot on its first step, so busy is known before any byte is sent
+            chunk = await anext(stream, None)
+        except (SchedulerOverloaded, SchedulerTimeout):
+            self.set_header("Retry-After", str(BUSY_RETRY_AFTER))
+            self.write_json({"error": "The assistant is busy, try again shortly"}, status=503)
+            return
+        except asyncio.CancelledError:
+            await self._stream_cancelled(session_id, stream, coalescer)
+            return
+
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+        self.set_header("X-Accel-Buffering", "no")  # keep reverse proxies from buffering the stream
+        usage = None
+        try:
+            while chunk is not None:
+                if getattr(chunk, "usage_metadata", None):
+                    usage = chunk.usage_metadata
+                batch = coalescer.add(chunk.content)
+                if batch:
+                    self.write_event("token", {"content": batch})
+                    await self.flush()
+                chunk = await anext(stream, None)
+        except tornado.iostream.StreamClosedError:
+            logger.info("Client disconnected from stream of session %s", session_id)
+            await stream.aclose()
+            return
+        except asyncio.CancelledError:
+            await self._stream_cancelled(session_id, stream, coalescer)
+            return
+        except Exception:
+            logger.exception("Reply stream failed for session %s", session_id)
+            self.write_event("error", {"error": "Generation failed"})
+            self.finish()
+            return
+
+        batch = coalescer.flush()
+        if batch:
+            self.write_event("token", {"content": batch})
+        await self._commit_turn(session_id)
+        self.write_event("done", {"usage": usage})
+        self.finish()
+
+        if title is None:  # first turn of the session, now stored: title it in the background
+            TITLE_WORKER.submit(session_id, content)
+        elif title == DEFAULT_TITLE:  # rename once the conversation has more to go on
+            history, _ = await aget_message_page(session_id, limit=4)
+            messages = "\n".join(f"{msg['type']}: {msg['content']}" for msg in history)
+            TITLE_WORKER.submit(session_id, messages, rename=True)
+
+    async def _commit_turn(self, session_id):
+        # queued messages are only read back by this process: with several workers, the UI's
+        # next GET may land on another one, so the turn is committed before the stream ends
+        if not self.settings.get("commit_replies") or HISTORY_WRITER is None:
+            return
+        if not await HISTORY_WRITER.aflush(WRITE_BEHIND_REPLY_TIMEOUT):
+            logger.warning("Messages of session %s not committed before the end of its reply", session_id)
+
+    async def _stream_cancelled(self, session_id, stream, coalescer):
+        # GENERATIONS cancelled this task; the cancellation is handled here, not propagated to tornado
+        asyncio.current_task().uncancel()
+        await stream.aclose()
+        if self._client_gone:
+            logger.info("Client disconnected from stream of session %s", session_id)
+            return
+        self.set_header("Content-Type", "text/event-stream")
+        batch = coalescer.flush()
+        if batch:  # the partial reply stored in history includes it
+            self.write_event("token", {"content": batch})
+        await self._commit_turn(session_id)
+        self.write_event("cancelled", {})
+        self.finish()
+
+def make_app(commit_replies=False) -> tornado.web.Application:
+    return tornado.web.Application([
+        (r"/api/ready", ReadyHandler),
+        (r"/api/sessions", SessionsHandler),
+        (r"/api/search", SearchHandler),
+        (r"/api/sessions/events", SessionEventsHandler),
+        (r"/api/sessions/([^/]+)", SessionHandler),
+        (r"/api/sessions/([^/]+)/messages", MessagesHandler),
+        (r"/api/sessions/([^/]+)/cancel", CancelHandler),
+    ], commit_replies=commit_replies)
+
+async def serve(sockets, metrics_port=METRICS_PORT, workers=1):
+    """Serve the API on already bound sockets until SIGTERM or Ctrl-C, then flush queued messages."""
+    start_metrics_server(port=metrics_port)
+    # another worker serves the UI's next read of a session, so it must find the turn committed
+    server = tornado.httpserver.HTTPServer(make_app(commit_replies=workers > 1), idle_connection_timeout=3600)
+    server.add_sockets(sockets)
+    logger.info("Chat API listening on %s", ", ".join(str(sock.getsockname()[:2]) for sock in sockets))
+    # one Postgres listener per worker keeps its caches and event streams current
+    start_session_events().subscribe(handle_session_event)
+    # warm up while already accepting requests, /api/ready reports when it is done
+    warm_up = asyncio.create_task(STARTUP.run())
+    stopped = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stopped.set)
+    try:
+        await stopped.wait()
+    finally:
+        warm_up.cancel()
+        STARTUP.stop()
+        server.stop()
+        # replies already sent must not lose their messages: commit what is still queued
+        await asyncio.to_thread(MESSAGE_WRITER.close)
@@ -0,0 +1,239 @@
+"""Local stand-in for the Ollama HTTP API, for load tests and benchmarks.
+
+Implements enough of /api/chat, /api/generate and /api/tags for ChatOllama:
+replies stream as NDJSON with a configurable time-to-first-token, token
+rate and error injection, and the final chunk carries Ollama-style
+prompt/eval counts and durations.
+
+Run from the app/ directory: python -m bench.fake_ollama --port 11435
+"""
+import argparse
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import threading
+import time
+
+DEFAULT_REPLY = (
+    "Sure! Here is a short answer to your question, written by a fake model so that "
+    "load tests have something realistic to stream back token by token."
+)
+
+class FakeOllamaConfig:
+    def __init__(self, ttft=0.05, tokens_per_second=200.0, reply=DEFAULT_REPLY, error_rate=0.0,
+                 max_tokens=None, seed=None):
+        self.ttft = ttft  # seconds before the first token
+        self.tokens_per_second = tokens_per_second
+        self.reply = reply
+        self.error_rate = error_rate  # fraction of requests answered with HTTP 500
+        self.max_tokens = max_tokens
+        self.random = random.Random(seed)
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+def _count_tokens(text):
+    return max(1, len(text.split()))
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    server_version = "FakeOllama/0.1"
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def config(self) -> FakeOllamaConfig:
+        return self.server.config
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json(200, {"models": [{"name": model, "model": model} for model in self.server.models]})
+        elif self.path == "/api/ps":
+            self._send_json(200, {"models": [{"name": model, "model": model} for model in sorted(self.server.loaded)]})
+        else:
+            body = b"Ollama is running"
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path not in ("/api/chat", "/api/generate"):
+            self._send_json(404, {"error": "not found"})
+            return
+        request = self._read_json()
+        self.server.record(self.path, request)
+        try:
+            if self.server.strict_models and request.get("model") not in self.server.models:
+                self._send_json(404, {"error": f"model \"{request.get('model')}\" not found, try pulling it first"})
+                return
+            if self.config.random.random() < self.config.error_rate:
+                self._send_json(500, {"error": "injected failure"})
+                return
+            self._reply(request)
+        finally:
+            self.server.finish()
+
+    def _reply(self, request):
+        chat = self.path == "/api/chat"
+        model = request.get("model", "")
+        self.server.loaded.add(model)
+        prompt_text = (
+            " ".join(str(m.get("content", "")) for m in request.get("messages", []))
+            if chat else request.get("prompt", "")
+        )
+        options = request.get("options") or {}
+        tokens = self.config.reply.split(" ")
+        limit = options.get("num_predict") or self.config.max_tokens
+        if limit and limit > 0:
+            tokens = tokens[:limit]
+        if chat and not request.get("messages"):
+            tokens = []  # empty chat request is a model load, like the real server
+
+        start = time.monotonic()
+        prompt_eval_count = _count_tokens(prompt_text)
+        final = {
+            "model": model,
+            "created_at": _now(),
+            "done": True,
+            "done_reason": "stop" if tokens else "load",
+            "load_duration": 0,
+            "prompt_eval_count": prompt_eval_count,
+            "eval_count": len(tokens),
+        }
+        if chat:
+            final["message"] = {"role": "assistant", "content": ""}
+        else:
+            final["response"] = ""
+
+        def timings(first_token_at):
+            end = time.monotonic()
+            final["total_duration"] = int((end - start) * 1e9)
+            final["prompt_eval_duration"] = int((first_token_at - start) * 1e9)
+            final["eval_duration"] = int((end - first_token_at) * 1e9)
+            return final
+
+        if tokens:
+            time.sleep(self.config.ttft)
+        first_token_at = time.monotonic()
+
+        if not request.get("stream", True):
+            time.sleep(len(tokens) / self.config.tokens_per_second)
+            text = " ".join(tokens)
+            payload = timings(first_token_at)
+            if chat:
+                payload["message"] = {"role": "assistant", "content": text}
+            else:
+                payload["response"] = text
+            self._send_json(200, payload)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        interval = 1.0 / self.config.tokens_per_second
+        for index, token in enumerate(tokens):
+            piece = token if index == 0 else " " + token
+            chunk = {"model": model, "created_at": _now(), "done": False}
+            if chat:
+                chunk["message"] = {"role": "assistant", "content": piece}
+            else:
+                chunk["response"] = piece
+            if not self._write_chunk(chunk):
+                return  # client went away
+            time.sleep(interval)
+        self._write_chunk(timings(first_token_at))
+        self._write_raw(b"0\r\n\r\n")
+
+    def _write_raw(self, data):
+        try:
+            self.wfile.write(data)
+            self.wfile.flush()
+            return True
+        except (BrokenPipeError, ConnectionResetError):
+            self.server.disconnects += 1
+            return False
+
+    def _write_chunk(self, payload):
+        line = json.dumps(payload).encode() + b"\n"
+        return self._write_raw(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+
+class FakeOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, config=None, models=("llama3.2",), strict_models=False):
+        super().__init__((host, port), _Handler)
+        self.config = config or FakeOllamaConfig()
+        self.models = list(models)
+        self.strict_models = strict_models  # answer 404 for models not in `models`, like a missing pull
+        self.loaded = set()
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.disconnects = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def record(self, path, request):
+        with self._lock:
+            self.requests.append((path, request))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def finish(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-ollama", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--ttft", type=float, default=0.05, help="seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail with HTTP 500")
+    parser.add_argument("--max-tokens", type=int, default=None)
+    parser.add_argument("--models", default="llama3.2", help="comma separated models to list as pulled")
+    parser.add_argument("--strict-models", action="store_true", help="reject models not in --models with 404")
+    args = parser.parse_args()
+
+    config = FakeOllamaConfig(ttft=args.ttft, tokens_per_second=args.tokens_per_second,
+                              error_rate=args.error_rate, max_tokens=args.max_tokens)
+    server = FakeOllamaServer(args.host, args.port, config, models=args.models.split(","), strict_models=args.strict_models)
+    print(f"Fake Ollama listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
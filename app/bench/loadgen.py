@@ -0,0 +1,239 @@
+"""Load test of the chat API against a local Postgres and a fake Ollama.
+
+The API runs in this process on a free local port, and each simulated user
+talks to it over HTTP the way the UI does. A user creates a session and runs
+several turns. A turn streams a reply, fetches the messages after the last
+one shown, and re-reads the session and the first page of the session list.
+The API titles the session in the background after the first message. The
+report has p50/p95/p99 latency per operation, throughput and the number of
+DB queries. It can be saved as a JSON baseline and compared against an
+earlier one.
+
+Run from the app/ directory, with the DB_* variables pointing at a local Postgres:
+
+    python -m bench.loadgen --users 20 --turns 5 --output bench/baselines/main.json
+    python -m bench.loadgen --users 20 --turns 5 --compare bench/baselines/main.json
+"""
+import argparse
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import platform
+import statistics
+import sys
+import threading
+import time
+
+from bench.fake_ollama import FakeOllamaConfig, FakeOllamaServer
+
+QUESTIONS = [
+    "How do I reverse a list in Python?",
+    "What is the difference between TCP and UDP?",
+    "Explain database indexes in two sentences.",
+    "Give me a tip for writing better commit messages.",
+    "What does the GIL do in CPython?",
+]
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of `samples` (0 < pct <= 100)."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = max(1, int(round(pct / 100 * len(ordered))))
+    return ordered[min(rank, len(ordered)) - 1]
+
+def summarize(samples):
+    return {
+        "count": len(samples),
+        "p50_ms": percentile(samples, 50),
+        "p95_ms": percentile(samples, 95),
+        "p99_ms": percentile(samples, 99),
+        "mean_ms": statistics.fmean(samples) if samples else None,
+    }
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def time(self, name, func, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            with self._lock:
+                self.errors[name] += 1
+            return None
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            with self._lock:
+                self.samples[name].append(elapsed)
+
+    def add(self, name, elapsed_ms):
+        with self._lock:
+            self.samples[name].append(elapsed_ms)
+
+def compare(report, baseline, tolerance):
+    """Return human readable regressions of `report` against `baseline`."""
+    regressions = []
+    for name, base in baseline["operations"].items():
+        current = report["operations"].get(name)
+        if not current or base["p95_ms"] is None or current["p95_ms"] is None:
+            continue
+        if current["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {base['p95_ms']:.1f} ms -> {current['p95_ms']:.1f} ms")
+    if report["throughput_turns_per_s"] < baseline["throughput_turns_per_s"] * (1 - tolerance):
+        regressions.append(
+            f"throughput: {baseline['throughput_turns_per_s']:.2f} -> {report['throughput_turns_per_s']:.2f} turns/s"
+        )
+    base_queries = baseline.get("db_queries_per_turn")
+    if base_queries and report["db_queries_per_turn"] > base_queries * (1 + tolerance):
+        regressions.append(f"db queries per turn: {base_queries:.1f} -> {report['db_queries_per_turn']:.1f}")
+    return regressions
+
+def start_api():
+    """Serve the chat API from a background thread of this process. Returns its URL."""
+    import asyncio
+    import tornado.httpserver
+    import tornado.netutil
+    from api.server import make_app
+
+    sockets = tornado.netutil.bind_sockets(0, "127.0.0.1")  # listening already: early requests wait in the backlog
+
+    async def serve():
+        tornado.httpserver.HTTPServer(make_app()).add_sockets(sockets)
+        await asyncio.Event().wait()
+
+    threading.Thread(target=asyncio.run, args=(serve(),), name="loadgen-api", daemon=True).start()
+    return f"http://127.0.0.1:{sockets[0].getsockname()[1]}"
+
+def run(args):
+    # the app reads its configuration at import time, so point it at the fake server first
+    server = None
+    if not args.ollama_url:
+        server = FakeOllamaServer(config=FakeOllamaConfig(
+            ttft=args.ttft, tokens_per_second=args.tokens_per_second, error_rate=args.error_rate, seed=args.seed
+        )).start()
+    os.environ["OLLAMA_URL"] = server.url if server else args.ollama_url
+    os.environ["OLLAMA_URLS"] = os.environ["OLLAMA_URL"]  # a multi-server OLLAMA_URLS in .env would bypass it
+
+    from services import chat
+    from services.api_client import ChatApiClient
+    from db.connection import get_query_count, get_pool_stats
+    from db.schema import ensure_schema
+
+    ensure_schema()
+    api_url = start_api()
+
+    recorder = Recorder()
+    sessions = []
+
+    def chat_turn(client, session_id, question):
+        start = time.perf_counter()
+        first = None
+        for _ in client.stream_reply(session_id, question):
+            if first is None:
+                first = time.perf_counter()
+        if first is not None:
+            recorder.add("time_to_first_token", (first - start) * 1000)
+
+    def simulated_user(index):
+        client = ChatApiClient(api_url)
+        session_id = recorder.time("create_session", client.create_session)
+        if session_id is None:
+            return
+        sessions.append(session_id)
+        history = []
+        for turn in range(args.turns):
+            question = QUESTIONS[(index + turn) % len(QUESTIONS)]
+            recorder.time("chat_turn", chat_turn, client, session_id, question)
+            # as main.py: drop uncommitted messages, then fetch the newest page or what follows the last one shown
+            history = [message for message in history if message["id"] is not None]
+            after = history[-1]["id"] if history else None
+            page = recorder.time("get_messages", client.get_messages, session_id, after=after)
+            history += page["messages"] if page else []
+            recorder.time("get_session", client.get_session, session_id)
+            recorder.time("list_sessions", client.list_sessions)
+        client.close()
+
+    queries_before = get_query_count()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        list(pool.map(simulated_user, range(args.users)))
+    wall = time.perf_counter() - started
+    queries = get_query_count() - queries_before
+
+    turns = len(recorder.samples["chat_turn"])
+    report = {
+        "config": {
+            "users": args.users,
+            "turns": args.turns,
+            "ttft": args.ttft,
+            "tokens_per_second": args.tokens_per_second,
+            "error_rate": args.error_rate,
+            "ollama": args.ollama_url or "fake",
+            "python": platform.python_version(),
+        },
+        "wall_seconds": wall,
+        "throughput_turns_per_s": turns / wall if wall else 0.0,
+        "db_queries": queries,
+        "db_queries_per_turn": queries / turns if turns else 0.0,
+        "operations": {name: summarize(samples) for name, samples in sorted(recorder.samples.items())},
+        "errors": dict(recorder.errors),
+        "pool": get_pool_stats(),
+        "scheduler": chat.SCHEDULER.stats(),
+    }
+    if server is not None:
+        report["ollama_max_in_flight"] = server.max_in_flight
+
+    if not args.keep:
+        client = ChatApiClient(api_url)
+        for session_id in sessions:
+            client.delete_session(session_id)
+        client.close()
+    if server is not None:
+        server.stop()
+    return report
+
+def print_report(report):
+    print(f"{report['config']['users']} users x {report['config']['turns']} turns in {report['wall_seconds']:.2f}s, "
+          f"{report['throughput_turns_per_s']:.2f} turns/s, {report['db_queries_per_turn']:.1f} db queries/turn")
+    print(f"{'operation':<24}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for name, stats in report["operations"].items():
+        print(f"{name:<24}{stats['count']:>7}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}"
+              f"{report['errors'].get(name, 0):>8}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test of the chat API.")
+    parser.add_argument("--users", type=int, default=10, help="concurrent simulated users")
+    parser.add_argument("--turns", type=int, default=3, help="turns per user")
+    parser.add_argument("--ttft", type=float, default=0.05, help="fake ollama time to first token (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--ollama-url", help="use a real Ollama server instead of the fake one")
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--compare", help="baseline JSON report to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    parser.add_argument("--keep", action="store_true", help="keep the generated sessions")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    print_report(report)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+"""Storage size and read cost of the legacy JSONB message format vs the compact one.
+
+Builds a synthetic history of user questions and streamed assistant replies
+(AIMessageChunk with Ollama's response metadata and usage, a share of them
+very long) and compares the two formats. For each it reports the bytes
+stored per message and how many messages per second are decoded back into
+LangChain messages. With --db it also stores both in temporary tables of the
+Postgres configured in .env and reports bytes on disk (TOAST compression
+included) and the read throughput of whole-session SELECTs.
+
+Run from the app/ directory:
+
+    python -m bench.message_storage --messages 5000
+    python -m bench.message_storage --messages 5000 --db
+"""
+import argparse
+import json
+import random
+import time
+import uuid
+
+from langchain_core.messages import AIMessageChunk, HumanMessage, message_to_dict, messages_from_dict
+
+from db.messages import message_to_row, row_to_message, MESSAGE_COMPRESSION
+
+WORDS = "the a model query index table session reply token stream cache latency python postgres vector".split()
+
+def _text(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+def make_messages(count, long_fraction=0.05, long_words=3000, seed=1):
+    """Alternating questions and streamed replies; `long_fraction` of the replies are `long_words` long."""
+    rng = random.Random(seed)
+    messages = []
+    for index in range(count):
+        if index % 2 == 0:
+            messages.append(HumanMessage(content=_text(rng, rng.randint(5, 40))))
+            continue
+        words = long_words if rng.random() < long_fraction else rng.randint(40, 400)
+        messages.append(AIMessageChunk(
+            content=_text(rng, words),
+            id=f"run-{uuid.UUID(int=rng.getrandbits(128))}",
+            response_metadata={
+                "model": "llama3.2", "created_at": "2025-01-01T12:00:00.000000Z", "done": True, "done_reason": "stop",
+                "total_duration": rng.randint(10**9, 10**10), "load_duration": rng.randint(10**6, 10**7),
+                "prompt_eval_count": rng.randint(50, 4000), "prompt_eval_duration": rng.randint(10**7, 10**9),
+                "eval_count": words, "eval_duration": rng.randint(10**9, 10**10), "model_name": "llama3.2",
+            },
+            usage_metadata={"input_tokens": 100, "output_tokens": words, "total_tokens": 100 + words},
+        ))
+    return messages
+
+def legacy_rows(messages):
+    return [json.dumps(message_to_dict(message)) for message in messages]
+
+def compact_rows(messages):
+    return [message_to_row(message) for message in messages]
+
+def _rate(decode, runs):
+    best = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        count = decode()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return count / best
+
+def measure_encoding(messages, runs=3):
+    """Bytes per message and decode rate of both formats, as psycopg hands rows to the app."""
+    legacy = legacy_rows(messages)
+    compact = compact_rows(messages)
+    # psycopg parses jsonb with json.loads before the app sees it
+    compact_bytes = sum(len(role) + len(content.encode()) + len(metadata or "") for role, content, metadata in compact)
+
+    def decode_legacy():
+        return len(messages_from_dict([json.loads(row) for row in legacy]))
+
+    def decode_compact():
+        return len([row_to_message(role, content, json.loads(metadata) if metadata else None) for role, content, metadata in compact])
+
+    return {
+        "legacy": {
+            "bytes_per_message": sum(len(row.encode()) for row in legacy) / len(legacy),
+            "decoded_per_s": _rate(decode_legacy, runs),
+        },
+        "compact": {
+            "bytes_per_message": compact_bytes / len(compact),
+            "decoded_per_s": _rate(decode_compact, runs),
+        },
+    }
+
+def measure_postgres(messages, sessions=50, runs=3):
+    """Store both formats in temporary tables and measure bytes on disk and session read throughput."""
+    from db.connection import get_connection
+    from db.messages import storage_stats
+
+    session_ids = [str(uuid.uuid4()) for _ in range(sessions)]
+    per_session = -(-len(messages) // sessions)
+    owners = [session_ids[index // per_session] for index in range(len(messages))]
+    report = {}
+    with get_connection() as conn:
+        conn.execute("CREATE TEMP TABLE bench_legacy (id BIGSERIAL PRIMARY KEY, session_id UUID NOT NULL, message JSONB NOT NULL)")
+        conn.execute("""
+            CREATE TEMP TABLE bench_compact (id BIGSERIAL PRIMARY KEY, session_id UUID NOT NULL, role TEXT NOT NULL,
+                                             content TEXT NOT NULL, metadata JSONB)
+        """)
+        if MESSAGE_COMPRESSION:
+            conn.execute(f"ALTER TABLE bench_compact ALTER COLUMN content SET COMPRESSION {MESSAGE_COMPRESSION}")
+        for table in ("bench_legacy", "bench_compact"):
+            conn.execute(f"CREATE INDEX ON {table} (session_id, id)")
+        with conn.cursor() as cursor:
+            cursor.executemany("INSERT INTO bench_legacy (session_id, message) VALUES (%s, %s)",
+                               list(zip(owners, legacy_rows(messages))))
+            cursor.executemany("INSERT INTO bench_compact (session_id, role, content, metadata) VALUES (%s, %s, %s, %s)",
+                               [(owner, *row) for owner, row in zip(owners, compact_rows(messages))])
+        conn.execute("ANALYZE bench_legacy")
+        conn.execute("ANALYZE bench_compact")
+
+        def read_legacy():
+            count = 0
+            for session_id in session_ids:
+                rows = conn.execute("SELECT message FROM bench_legacy WHERE session_id = %s ORDER BY id", (session_id,)).fetchall()
+                count += len(messages_from_dict([row[0] for row in rows]))
+            return count
+
+        def read_compact():
+            count = 0
+            for session_id in session_ids:
+                rows = conn.execute("SELECT role, content, metadata FROM bench_compact WHERE session_id = %s ORDER BY id",
+                                    (session_id,)).fetchall()
+                count += len([row_to_message(*row) for row in rows])
+            return count
+
+        for name, table, read in (("legacy", "bench_legacy", read_legacy), ("compact", "bench_compact", read_compact)):
+            stats = storage_stats(conn, table)
+            report[name] = {
+                "bytes_per_message": stats["bytes_per_message"],
+                "avg_row_bytes": stats["avg_row_bytes"],
+                "read_per_s": _rate(read, runs),
+            }
+        conn.rollback()
+    return report
+
+def print_report(report):
+    for section, results in report.items():
+        if section == "config":
+            continue
+        print(section)
+        for name, stats in results.items():
+            print(f"  {name:<10}" + "".join(f"{key} {value:>12.1f}  " for key, value in stats.items()))
+        legacy, compact = results["legacy"], results["compact"]
+        print(f"  compact stores {compact['bytes_per_message'] / legacy['bytes_per_message']:.0%} of the legacy bytes")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--long-fraction", type=float, default=0.05, help="share of replies that are very long")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--db", action="store_true", help="also measure on the configured Postgres")
+    parser.add_argument("--output", help="write the JSON report here")
+    args = parser.parse_args(argv)
+
+    messages = make_messages(args.messages, args.long_fraction)
+    report = {"config": vars(args), "encoding": measure_encoding(messages, args.runs)}
+    if args.db:
+        report["postgres"] = measure_postgres(messages, runs=args.runs)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
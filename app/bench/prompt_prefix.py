@@ -0,0 +1,107 @@
+"""How much of each chat prompt repeats the previous turn's, with a sliding vs a stable context window.
+
+Plays a synthetic conversation through the context strategy and the chat
+prompt, turn by turn. For every turn it compares the rendered messages
+with the previous turn's. Ollama can reuse its evaluated KV cache only
+for the leading messages that are identical, and must evaluate the rest.
+"sliding" moves the window by one turn every turn, as the context
+strategies used to. "stable" keeps the window start until the window
+overflows (see CONTEXT_PREFIX_SLACK). With --ollama the stable prompts
+are also sent to that server, and the tokens and seconds Ollama reports
+for prompt evaluation are printed per turn.
+
+Run from the app/ directory:
+
+    python -m bench.prompt_prefix --turns 60
+    python -m bench.prompt_prefix --turns 20 --ollama http://localhost:11434
+"""
+import argparse
+import json
+import random
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from core.context import select_context, record_prompt, forget_session
+from core.prompts import chat_prompt
+
+WORDS = "the a model query index table session reply token stream cache latency python postgres vector".split()
+
+def _text(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+def make_conversation(turns, seed=1):
+    """(question, answer) pairs of varied length."""
+    rng = random.Random(seed)
+    return [(_text(rng, rng.randint(5, 40)), _text(rng, rng.randint(40, 250))) for _ in range(turns)]
+
+def prompts(conversation, strategy, stable):
+    """The messages sent to the model on each turn."""
+    session_id = "bench-stable" if stable else None
+    history = []
+    for question, answer in conversation:
+        window = select_context(session_id, history, strategy)
+        yield chat_prompt().invoke({"history": window, "user_input": question}).to_messages()
+        history += [HumanMessage(content=question), AIMessage(content=answer)]
+    forget_session(session_id)
+
+def measure_reuse(conversation, strategy="token_budget"):
+    """Per mode: share of prompt tokens in a prefix shared with the previous prompt, and of turns keeping all of it."""
+    report = {}
+    for mode in ("sliding", "stable"):
+        key = f"bench-{mode}"
+        prefix_total = prompt_total = kept = 0
+        previous = 0
+        for messages in prompts(conversation, strategy, stable=mode == "stable"):
+            prefix_tokens, prompt_tokens = record_prompt(key, messages)
+            prefix_total += prefix_tokens
+            prompt_total += prompt_tokens
+            # the previous prompt is still the start of this one: everything but the new turn is reusable
+            kept += previous > 0 and prefix_tokens >= previous
+            previous = prompt_tokens
+        forget_session(key)
+        turns = len(conversation)
+        report[mode] = {
+            "reused_token_share": prefix_total / prompt_total if prompt_total else 0.0,
+            "prefix_kept_turns": kept / max(turns - 1, 1),
+            "evaluated_tokens_per_turn": (prompt_total - prefix_total) / turns,
+        }
+    return report
+
+def measure_ollama(conversation, url, strategy="token_budget", model=None):
+    """Send the stable prompts to Ollama and collect its prompt evaluation counts and seconds per turn."""
+    from core.runtime import get_llm
+
+    llm = get_llm(model, base_url=url, num_predict=1)
+    turns = []
+    for messages in prompts(conversation, strategy, stable=True):
+        metadata = llm.invoke(messages).response_metadata
+        turns.append({
+            "prompt_eval_count": metadata.get("prompt_eval_count"),
+            "prompt_eval_s": (metadata.get("prompt_eval_duration") or 0) / 1e9,
+        })
+    return turns
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=60)
+    parser.add_argument("--strategy", default="token_budget", choices=["last_n", "token_budget"])
+    parser.add_argument("--ollama", help="also send the prompts to this Ollama server")
+    parser.add_argument("--model")
+    parser.add_argument("--output", help="write the JSON report here")
+    args = parser.parse_args(argv)
+
+    conversation = make_conversation(args.turns)
+    report = {"config": vars(args), "reuse": measure_reuse(conversation, args.strategy)}
+    for mode, stats in report["reuse"].items():
+        print(f"{mode:<8} reused tokens {stats['reused_token_share']:6.1%}  prefix kept on {stats['prefix_kept_turns']:6.1%} "
+              f"of turns  evaluated/turn {stats['evaluated_tokens_per_turn']:8.1f}")
+    if args.ollama:
+        report["ollama"] = measure_ollama(conversation, args.ollama, args.strategy, args.model)
+        for index, turn in enumerate(report["ollama"], 1):
+            print(f"turn {index:>3}: prompt_eval_count {turn['prompt_eval_count']:>6}  prompt_eval {turn['prompt_eval_s'] * 1000:8.1f} ms")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Render cost per chat turn of the Streamlit UI.
+
+Runs the UI's rendering code headlessly with Streamlit's AppTest. A turn is
+one rerun that draws the history and streams a reply. The bench compares
+full vs windowed history and per-token vs coalesced streaming, and reports
+the CPU time per turn, the number of stream updates and the text re-rendered
+by them. The reply is redrawn on every update, so that cost grows with the
+square of the update count.
+
+Run from the app/ directory:
+
+    python -m bench.render_cost --messages 200 --tokens 400
+"""
+import argparse
+import json
+import time
+
+def _turn_script(messages, window, tokens, token_interval, coalesced, flush_interval, flush_bytes):
+    # runs inside AppTest: module-level names are not available, so import everything here
+    import time
+    import streamlit as st
+    from core.streaming import coalesce
+
+    history = [
+        {"type": "human" if index % 2 == 0 else "ai", "content": f"Message {index}: " + "some **markdown** text " * 20}
+        for index in range(messages)
+    ]
+    hidden = max(0, len(history) - window) if window else 0
+    for msg in history[hidden:]:
+        with st.chat_message("user" if msg["type"] == "human" else "assistant"):
+            st.markdown(msg["content"])
+
+    def reply():
+        for index in range(tokens):
+            if token_interval:
+                time.sleep(token_interval)
+            yield f" token{index}"
+
+    stream = coalesce(reply(), flush_interval, flush_bytes) if coalesced else reply()
+    updates = rendered = 0
+    shown = ""
+
+    def counted(pieces):
+        nonlocal updates, rendered, shown
+        for piece in pieces:
+            updates += 1
+            shown += piece
+            rendered += len(shown)
+            yield piece
+
+    with st.chat_message("assistant"):
+        st.write_stream(counted(stream))
+    st.session_state["render_stats"] = {"updates": updates, "rendered_chars": rendered}
+
+def measure(messages, window, tokens, token_interval, coalesced, flush_interval, flush_bytes, runs):
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_function(
+        _turn_script, args=(messages, window, tokens, token_interval, coalesced, flush_interval, flush_bytes),
+        default_timeout=60,
+    )
+    app.run()  # warm-up
+    cpu = []
+    for _ in range(runs):
+        started = time.process_time()
+        app.run()
+        cpu.append((time.process_time() - started) * 1000)
+    stats = app.session_state["render_stats"]
+    return {
+        "cpu_ms_per_turn": sum(cpu) / len(cpu),
+        "stream_updates": stats["updates"],
+        "rendered_kchars": stats["rendered_chars"] / 1000,
+        "markdown_elements": len(app.markdown),
+    }
+
+def run(args):
+    variants = {
+        "baseline": dict(window=0, coalesced=False),
+        "windowed_history": dict(window=args.window, coalesced=False),
+        "coalesced_stream": dict(window=0, coalesced=True),
+        "windowed_and_coalesced": dict(window=args.window, coalesced=True),
+    }
+    return {
+        "config": vars(args),
+        "variants": {
+            name: measure(args.messages, tokens=args.tokens, token_interval=1 / args.tokens_per_second,
+                          flush_interval=args.flush_interval, flush_bytes=args.flush_bytes, runs=args.runs, **variant)
+            for name, variant in variants.items()
+        },
+    }
+
+def print_report(report):
+    print(f"{'variant':<24}{'cpu ms/turn':>12}{'updates':>10}{'re-rendered kchars':>20}{'elements':>10}")
+    for name, stats in report["variants"].items():
+        print(f"{name:<24}{stats['cpu_ms_per_turn']:>12.1f}{stats['stream_updates']:>10}"
+              f"{stats['rendered_kchars']:>20.1f}{stats['markdown_elements']:>10}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=200, help="messages in the history")
+    parser.add_argument("--window", type=int, default=20, help="messages rendered when windowed")
+    parser.add_argument("--tokens", type=int, default=400, help="tokens in the streamed reply")
+    parser.add_argument("--tokens-per-second", type=float, default=400.0)
+    parser.add_argument("--flush-interval", type=float, default=0.05)
+    parser.add_argument("--flush-bytes", type=int, default=256)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--output", help="write the JSON report here")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
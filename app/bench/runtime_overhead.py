@@ -0,0 +1,84 @@
+"""Micro-benchmark of per-call overhead: building clients, chains and event loops
+per call versus reusing the long-lived runtime.
+
+Run from the app/ directory: python -m bench.runtime_overhead
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import statistics
+import threading
+import time
+
+import httpx
+from langchain_ollama import ChatOllama
+
+from core import runtime
+from core.chains import get_session_title_chain
+from core.prompts import get_session_title_prompt
+
+ITERATIONS = 200
+
+class _OkHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+def measure(func, iterations=ITERATIONS):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1e6)
+    return statistics.median(samples)
+
+def report(name, before, after):
+    print(f"{name:<28} per-call {before:10.1f} us   reused {after:10.1f} us   ({before / after:6.1f}x)")
+
+async def _noop():
+    return None
+
+def new_loop_per_call():
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(_noop())
+    finally:
+        loop.close()
+
+def new_executor_per_call():
+    with ThreadPoolExecutor() as pool:
+        pool.submit(lambda: None).result()
+
+def main():
+    report(
+        "title chain construction",
+        measure(lambda: get_session_title_prompt() | ChatOllama(model=runtime.OLLAMA_MODEL, base_url=runtime.OLLAMA_URL)),
+        measure(get_session_title_chain),
+    )
+    report("event loop per operation", measure(new_loop_per_call), measure(lambda: runtime.run_coroutine(_noop())))
+    report("thread pool hop", measure(new_executor_per_call), measure(lambda: runtime.blocking_executor.submit(lambda: None).result()))
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _OkHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+    shared = httpx.Client(limits=runtime._http_limits())
+
+    def fresh_client():
+        with httpx.Client() as client:
+            client.get(url)
+
+    report("http request (keep-alive)", measure(fresh_client), measure(lambda: shared.get(url)))
+    shared.close()
+    server.shutdown()
+    runtime.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,50 @@
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_ollama import ChatOllama
+from functools import lru_cache
+
+from langchain_core.runnables import RunnableLambda
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_postgres.chat_message_histories import PostgresChatMessageHistory
 
-from core.prompts import get_session_title_prompt, chat_prompt
-from db.connection import get_connection
+from core.prompts import get_session_title_prompt, get_summary_prompt, chat_prompt
+from core.context import apply_context_strategy, record_prompt
+from core.router import ROUTER, CHAT, TITLE, SUMMARY
+from db.history import PooledPostgresChatMessageHistory
 
 from dotenv import load_dotenv
 import os
 
 load_dotenv()
 
-OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.2")
-OLLAMA_URL = os.getenv("OLLAMA_URL", "http://ollama:11434")
-
-CHAT_HISTORY_TABLE = os.getenv("CHAT_HISTORY_TABLE", "chat_history")
+MESSAGES_TABLE = os.getenv("MESSAGES_TABLE", "chat_messages")
 
-llm = ChatOllama(model=OLLAMA_MODEL, base_url=OLLAMA_URL)
+# chains are immutable, so each one is built once per process and shared
 
+@lru_cache(maxsize=None)
 def get_session_title_chain():
-    return get_session_title_prompt() | llm
+    return get_session_title_prompt() | ROUTER.llm(TITLE)
+
+@lru_cache(maxsize=None)
+def get_summary_chain():
+    return get_summary_prompt() | ROUTER.llm(SUMMARY)
+
+def session_llm(prompt, config):
+    """The chat model on the session's Ollama backend, noting how much of the prompt the last turn already sent."""
+    session_id = config.get("configurable", {}).get("session_id")
+    record_prompt(session_id, prompt.to_messages())
+    return ROUTER.llm(CHAT, session_id=session_id)
 
+@lru_cache(maxsize=None)
 def get_chat_chain():
-    return chat_prompt() | llm
+    # trim the history to the configured context strategy before it is rendered into the prompt
+    return RunnableLambda(apply_context_strategy) | chat_prompt() | RunnableLambda(session_llm)
 
-def get_chat_chain_with_history(chat_history_table, connection):
+def get_chat_chain_with_history(messages_table, pool, writer=None, cache=None):
     return RunnableWithMessageHistory(
         get_chat_chain(),
-        lambda session_id: PostgresChatMessageHistory(
-            chat_history_table,
+        lambda session_id: PooledPostgresChatMessageHistory(
+            messages_table,
             session_id,
-            sync_connection=connection
+            pool=pool,
+            writer=writer,
+            cache=cache
         ),
         input_messages_key="user_input",
         history_messages_key="history"
@@ -0,0 +1,273 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import hashlib
+import logging
+import threading
+import time
+
+from langchain_core.messages import SystemMessage
+from langchain_core.messages.utils import count_tokens_approximately
+
+from db.sessions import get_session_summary, store_session_summary
+from core.scheduler import SCHEDULER, BACKGROUND
+from core.metrics import observe_llm_response
+from core.router import ROUTER, SUMMARY
+
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# full | last_n | token_budget | summary
+CONTEXT_STRATEGY = os.getenv("CONTEXT_STRATEGY", "token_budget")
+CONTEXT_LAST_N_TURNS = int(os.getenv("CONTEXT_LAST_N_TURNS", "6"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2048"))
+# with the summary strategy, re-summarize once this many messages have fallen out of the window
+SUMMARY_BATCH_MESSAGES = int(os.getenv("SUMMARY_BATCH_MESSAGES", "6"))
+# share of the budget left free when the window has to move, so the next turns keep its start (and ollama's cached prefix)
+CONTEXT_PREFIX_SLACK = float(os.getenv("CONTEXT_PREFIX_SLACK", "0.25"))
+CONTEXT_MAX_SESSIONS = int(os.getenv("CONTEXT_MAX_SESSIONS", "10000"))  # sessions whose context state is kept per process
+
+class SessionLRU:
+    """Per-session state of the `max_sessions` most recently used sessions.
+
+    Least recently used sessions are dropped beyond that; everything kept
+    here can be rebuilt (from the sessions table or on the next turn).
+    """
+
+    def __init__(self, max_sessions=CONTEXT_MAX_SESSIONS):
+        self._max_sessions = max_sessions
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _store(self, session_id, value):
+        # called with the lock held
+        self._entries[session_id] = value
+        self._entries.move_to_end(session_id)
+        while len(self._entries) > self._max_sessions:
+            self._entries.popitem(last=False)
+
+    def get(self, session_id, default=None):
+        with self._lock:
+            if session_id not in self._entries:
+                return default
+            self._entries.move_to_end(session_id)
+            return self._entries[session_id]
+
+    def __getitem__(self, session_id):
+        with self._lock:
+            self._entries.move_to_end(session_id)
+            return self._entries[session_id]
+
+    def __setitem__(self, session_id, value):
+        with self._lock:
+            self._store(session_id, value)
+
+    def __contains__(self, session_id):
+        return session_id in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def setdefault(self, session_id, default):
+        with self._lock:
+            if session_id in self._entries:
+                self._entries.move_to_end(session_id)
+            else:
+                self._store(session_id, default)
+            return self._entries[session_id]
+
+    def pop(self, session_id, default=None):
+        with self._lock:
+            return self._entries.pop(session_id, default)
+
+summary_pool = ThreadPoolExecutor(max_workers=1)
+_summaries = SessionLRU()  # session_id -> (summary, message_count), mirrors the sessions table
+_pending_summaries = set()
+_summaries_lock = threading.Lock()
+
+# last context decision per session, for reporting
+context_stats = SessionLRU()
+_window_starts = SessionLRU()  # session_id -> (strategy, index of the history message the last window started at)
+_prompt_prefixes = SessionLRU()  # session_id -> digests of the messages last sent to the model
+prefix_stats = {"sent": 0, "prefix_kept": 0}
+_prefix_lock = threading.Lock()
+
+@lru_cache(maxsize=8192)
+def _count_text_tokens(message_type: str, content: str) -> int:
+    return count_tokens_approximately([(message_type, content)])
+
+def count_message_tokens(message) -> int:
+    """Approximate token count of a message, cached by its content."""
+    return _count_text_tokens(message.type, str(message.content))
+
+def _last_n_turns(history, turns):
+    # a turn is a user message and its reply
+    return history[-2 * turns:] if turns > 0 else []
+
+def _within_budget(history, budget):
+    kept = []
+    used = 0
+    for message in reversed(history):
+        used += count_message_tokens(message)
+        if used > budget:
+            break
+        kept.append(message)
+    kept.reverse()
+    # never start the window on an assistant reply
+    while kept and kept[0].type != "human":
+        kept.pop(0)
+    return kept
+
+def _cached_summary(session_id):
+    with _summaries_lock:
+        if session_id in _summaries:
+            return _summaries[session_id]
+    summary = get_session_summary(session_id)
+    with _summaries_lock:
+        _summaries[session_id] = summary
+    return summary
+
+def _summarize(session_id, previous_summary, messages, message_count):
+    from core.chains import get_summary_chain  # core.chains builds its chat chain on top of this module
+
+    try:
+        transcript = "\n".join(f"{msg.type}: {msg.content}" for msg in messages)
+        started = time.perf_counter()
+        response = SCHEDULER.invoke(
+            get_summary_chain(),
+            {"summary": previous_summary or "(none)", "messages": transcript},
+            priority=BACKGROUND
+        )
+        response_metadata = getattr(response, "response_metadata", None)
+        observe_llm_response(SUMMARY, started, None, time.perf_counter(), getattr(response, "usage_metadata", None), response_metadata)
+        ROUTER.served(SUMMARY, response_metadata)
+        summary = response.content.strip()
+        store_session_summary(session_id, summary, message_count)
+        with _summaries_lock:
+            _summaries[session_id] = (summary, message_count)
+    except Exception:
+        logger.exception("Failed to summarize session %s", session_id)
+    finally:
+        with _summaries_lock:
+            _pending_summaries.discard(session_id)
+
+def schedule_summary(session_id, history, window_start):
+    """Fold messages that left the window into the session summary in the background."""
+    summary, covered = _cached_summary(session_id)
+    if window_start - covered < SUMMARY_BATCH_MESSAGES:
+        return
+    with _summaries_lock:
+        if session_id in _pending_summaries:
+            return
+        _pending_summaries.add(session_id)
+    summary_pool.submit(_summarize, session_id, summary, history[covered:window_start], window_start)
+
+def _fits(window, turns=None, budget=None):
+    if turns is not None and len(window) > 2 * turns:
+        return False
+    return budget is None or sum(count_message_tokens(msg) for msg in window) <= budget
+
+def _slack(limit):
+    return max(1, int(limit * (1 - CONTEXT_PREFIX_SLACK)))
+
+def _stable_window(session_id, history, strategy, turns=None, budget=None):
+    """The messages from where the session's previous window started, while they still fit.
+
+    A window that slides by one turn every turn changes the start of the
+    prompt, and ollama then re-evaluates all of it. Here the start only
+    moves once the window overflows, and then far enough ahead (see
+    CONTEXT_PREFIX_SLACK) that the next turns fit again.
+    """
+    previous = _window_starts.get(session_id)
+    if previous is not None and previous[0] == strategy and previous[1] < len(history):
+        start = previous[1]
+        window = history[start:]
+        if history[start].type == "human" and _fits(window, turns, budget):
+            return window
+        turns = _slack(turns) if turns is not None else None
+        budget = _slack(budget) if budget is not None else None
+    window = history
+    if turns is not None:
+        window = _last_n_turns(window, turns)
+    if budget is not None:
+        window = _within_budget(window, budget)
+    if session_id is not None:
+        _window_starts[session_id] = (strategy, len(history) - len(window))
+    return window
+
+def select_context(session_id, history, strategy=None):
+    """Return the messages to send to the model in place of the full history."""
+    strategy = strategy or CONTEXT_STRATEGY
+    if strategy == "full":
+        return list(history)
+    if strategy == "last_n":
+        return _stable_window(session_id, history, strategy, turns=CONTEXT_LAST_N_TURNS)
+    if strategy == "token_budget":
+        return _stable_window(session_id, history, strategy, budget=CONTEXT_TOKEN_BUDGET)
+    if strategy == "summary":
+        window = _stable_window(session_id, history, strategy, turns=CONTEXT_LAST_N_TURNS, budget=CONTEXT_TOKEN_BUDGET)
+        window_start = len(history) - len(window)
+        if window_start == 0:
+            return window
+        schedule_summary(session_id, history, window_start)
+        # reuse whatever summary exists now, even if it lags a few turns behind
+        summary, _ = _cached_summary(session_id)
+        if summary:
+            return [SystemMessage(content=f"Summary of the earlier conversation: {summary}")] + window
+        return window
+    raise ValueError(f"Unknown context strategy: {strategy}")
+
+def apply_context_strategy(inputs: dict, config) -> dict:
+    """Trim the loaded history before it reaches the prompt (chain step)."""
+    session_id = config.get("configurable", {}).get("session_id")
+    history = inputs.get("history", [])
+    context = select_context(session_id, history)
+    context_stats[session_id] = {
+        "strategy": CONTEXT_STRATEGY,
+        "history_messages": len(history),
+        "context_messages": len(context),
+        "history_tokens": sum(count_message_tokens(msg) for msg in history),
+        "context_tokens": sum(count_message_tokens(msg) for msg in context),
+    }
+    return {**inputs, "history": context}
+
+def _message_digest(message):
+    return hashlib.blake2b(f"{message.type}\0{message.content}".encode(), digest_size=16).digest()
+
+def record_prompt(session_id, messages):
+    """Note how much of the prompt repeats the session's previous one, message for message.
+
+    Ollama only re-evaluates what follows that shared prefix. Records the
+    estimated tokens of both in context_stats and returns them as
+    (prefix_tokens, prompt_tokens).
+    """
+    digests = [_message_digest(msg) for msg in messages]
+    with _prefix_lock:
+        previous = _prompt_prefixes.get(session_id, [])
+        _prompt_prefixes[session_id] = digests
+        shared = 0
+        for before, now in zip(previous, digests):
+            if before != now:
+                break
+            shared += 1
+        prefix_stats["sent"] += 1
+        if previous and shared == len(previous):  # the last prompt is still the start of this one
+            prefix_stats["prefix_kept"] += 1
+    prefix_tokens = sum(count_message_tokens(msg) for msg in messages[:shared])
+    prompt_tokens = prefix_tokens + sum(count_message_tokens(msg) for msg in messages[shared:])
+    context_stats.setdefault(session_id, {}).update(
+        prefix_messages=shared, prefix_tokens=prefix_tokens, prompt_tokens_estimate=prompt_tokens,
+    )
+    return prefix_tokens, prompt_tokens
+
+def forget_session(session_id):
+    with _summaries_lock:
+        _summaries.pop(session_id, None)
+    context_stats.pop(session_id, None)
+    _window_starts.pop(session_id, None)
+    with _prefix_lock:
+        _prompt_prefixes.pop(session_id, None)
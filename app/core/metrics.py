@@ -0,0 +1,244 @@
+"""Latency/throughput histograms exported in Prometheus text format.
+
+Disabled by default; set METRICS_ENABLED=1 to record and METRICS_PORT to
+choose the side port the /metrics endpoint listens on. With
+METRICS_TRACE_LOG=1 every chat turn is also logged as one JSON line on the
+"chat.trace" logger. When disabled, every hook returns after a single flag
+check.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import inspect
+import json
+import logging
+import threading
+import time
+
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0") == "1"
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+METRICS_TRACE_LOG = os.getenv("METRICS_TRACE_LOG", "0") == "1"
+
+trace_logger = logging.getLogger("chat.trace")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 250, 500)
+RATIO_BUCKETS = (0.1, 0.25, 0.5, 0.75, 0.9, 0.95, 0.99, 1.0)
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{str(value)}"' for key, value in labels) + "}"
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Histogram:
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        if not METRICS_ENABLED or value is None:
+            return
+        key = tuple(sorted(labels.items()))
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self, labels=None):
+        """(count, sum) for one label set, mostly for tests."""
+        with self._lock:
+            series = self._series.get(tuple(sorted((labels or {}).items())))
+            return (series[2], series[1]) if series else (0, 0.0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        for key, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                le = bound if bound == "+Inf" else _format_value(float(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', le),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+_histograms = []
+_collectors = []
+
+def histogram(name, help, buckets=LATENCY_BUCKETS) -> Histogram:
+    metric = Histogram(name, help, buckets)
+    _histograms.append(metric)
+    return metric
+
+def register_collector(collect):
+    """Register a callable returning gauge samples as (name, help, labels, value) tuples."""
+    _collectors.append(collect)
+
+TIME_TO_FIRST_TOKEN = histogram("llm_time_to_first_token_seconds", "Time from request to first streamed token.")
+GENERATION_SECONDS = histogram("llm_generation_seconds", "Total time of an LLM request.")
+TOKENS_PER_SECOND = histogram("llm_tokens_per_second", "Completion tokens generated per second.", RATE_BUCKETS)
+PROMPT_TOKENS = histogram("llm_prompt_tokens", "Prompt tokens evaluated per request.", TOKEN_BUCKETS)
+COMPLETION_TOKENS = histogram("llm_completion_tokens", "Completion tokens generated per request.", TOKEN_BUCKETS)
+PROMPT_EVAL_SECONDS = histogram("llm_prompt_eval_seconds", "Time Ollama spent evaluating the prompt of a request.")
+PROMPT_REUSED_RATIO = histogram("llm_prompt_reused_ratio", "Estimated share of the prompt Ollama did not re-evaluate.", RATIO_BUCKETS)
+DB_CALL_SECONDS = histogram("db_call_seconds", "Latency of database calls by operation.")
+TITLE_GENERATION_SECONDS = histogram("title_generation_seconds", "Latency of session title generation.")
+
+def timed(metric: Histogram, **labels):
+    """Decorator observing the wall time of a sync or async function into `metric`."""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not METRICS_ENABLED:
+                    return await func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    metric.observe(time.perf_counter() - start, **labels)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not METRICS_ENABLED:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                metric.observe(time.perf_counter() - start, **labels)
+        return wrapper
+    return decorator
+
+@contextmanager
+def timer(metric: Histogram, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metric.observe(time.perf_counter() - start, **labels)
+
+def observe_llm_response(task, started, first_token_at, finished, usage=None, response_metadata=None):
+    """Record TTFT, generation time, token counts and rate of one LLM request."""
+    if not METRICS_ENABLED and not METRICS_TRACE_LOG:
+        return
+    usage = usage or {}
+    response_metadata = response_metadata or {}
+    prompt_tokens = usage.get("input_tokens", response_metadata.get("prompt_eval_count"))
+    completion_tokens = usage.get("output_tokens", response_metadata.get("eval_count"))
+    eval_duration = response_metadata.get("eval_duration")  # nanoseconds, measured by ollama itself
+    if completion_tokens and eval_duration:
+        tokens_per_second = completion_tokens / (eval_duration / 1e9)
+    elif completion_tokens and first_token_at is not None and finished > first_token_at:
+        tokens_per_second = completion_tokens / (finished - first_token_at)
+    else:
+        tokens_per_second = None
+    ttft = first_token_at - started if first_token_at is not None else None
+    # ollama counts only the prompt tokens it evaluated, not those reused from its cache
+    prompt_eval_duration = response_metadata.get("prompt_eval_duration")
+    prompt_eval_s = prompt_eval_duration / 1e9 if prompt_eval_duration is not None else None
+
+    TIME_TO_FIRST_TOKEN.observe(ttft, task=task)
+    PROMPT_EVAL_SECONDS.observe(prompt_eval_s, task=task)
+    GENERATION_SECONDS.observe(finished - started, task=task)
+    TOKENS_PER_SECOND.observe(tokens_per_second, task=task)
+    PROMPT_TOKENS.observe(prompt_tokens, task=task)
+    COMPLETION_TOKENS.observe(completion_tokens, task=task)
+    return {
+        "task": task,
+        "ttft_s": ttft,
+        "generation_s": finished - started,
+        "prompt_tokens": prompt_tokens,
+        "prompt_eval_s": prompt_eval_s,
+        "completion_tokens": completion_tokens,
+        "tokens_per_s": tokens_per_second,
+    }
+
+def observe_prompt_reuse(task, prompt_tokens_estimate, response_metadata=None):
+    """Record which share of a prompt Ollama reused from its cache instead of evaluating.
+
+    `prompt_tokens_estimate` is the approximate size of the whole prompt;
+    Ollama's prompt_eval_count only covers the part it evaluated.
+    """
+    evaluated = (response_metadata or {}).get("prompt_eval_count")
+    if not prompt_tokens_estimate or evaluated is None:
+        return None
+    reused = min(max(1 - evaluated / prompt_tokens_estimate, 0.0), 1.0)
+    PROMPT_REUSED_RATIO.observe(reused, task=task)
+    return reused
+
+def trace(event, **fields):
+    """Log one structured trace line when METRICS_TRACE_LOG is on."""
+    if METRICS_TRACE_LOG:
+        trace_logger.info(json.dumps({"event": event, "ts": time.time(), **fields}, default=str))
+
+def render() -> str:
+    lines = []
+    for metric in _histograms:
+        lines.extend(metric.render())
+    families = {}  # name -> (help, samples); samples of one family must be contiguous
+    for collect in _collectors:
+        try:
+            samples = list(collect())
+        except Exception:
+            logging.getLogger(__name__).exception("Metrics collector failed")
+            continue
+        for name, help, labels, value in samples:
+            families.setdefault(name, (help, []))[1].append((labels, value))
+    for name, (help, samples) in families.items():
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in samples:
+            lines.append(f"{name}{_format_labels(tuple(sorted(labels.items())))} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+_server = None
+_server_lock = threading.Lock()
+
+def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Serve /metrics on a side port (once per process). No-op when metrics are disabled."""
+    global _server
+    if not METRICS_ENABLED:
+        return None
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+    return _server
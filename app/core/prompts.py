@@ -1,19 +1,40 @@
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_ollama import ChatOllama
+
+# prompts are plain constants: the system prompt starts every rendered prompt, and ollama reuses the
+# evaluated prefix of a conversation only while it stays byte-identical
+TITLE_SYSTEM_PROMPT = (
+    "You are a helpful assistant that creates concise, descriptive titles for chat sessions. "
+    "Create a title that captures the main topic or purpose of the conversation. "
+    "Create a short title (3-5 words) for a chat session that starts with the message given. "
+    "Do not include any other text in your response. "
+    "If the message is vague -- no context or just a greeting, return 'New Chat'"
+)
+SUMMARY_SYSTEM_PROMPT = (
+    "You maintain a compact running summary of a conversation between a user and an assistant. "
+    "Merge the existing summary with the new messages into a single summary of at most 150 words. "
+    "Keep facts, names, decisions and open questions; drop greetings and filler. "
+    "Do not include any other text in your response."
+)
+SYSTEM_PROMPT = (
+    "You are a helpful assistant that answers general questions from the user. "
+    "Your goal is to provide quick, accurate, and helpful answers. "
+    "Make your answers short and concise while making sure to provide all the information the user is looking for."
+)
 
 def get_session_title_prompt():
     return ChatPromptTemplate.from_messages([
-        ("system", "You are a helpful assistant that creates concise, descriptive titles for chat sessions. Create a title that captures the main topic or purpose of the conversation. \
-        Create a short title (3-5 words) for a chat session that starts with the message given. Do not include any other text in your response. \
-        If the message is vague -- no context or just a greeting, return 'New Chat'"),
+        ("system", TITLE_SYSTEM_PROMPT),
         ("user", "{message}")
     ])
 
+def get_summary_prompt():
+    return ChatPromptTemplate.from_messages([
+        ("system", SUMMARY_SYSTEM_PROMPT),
+        ("user", "Existing summary:\n{summary}\n\nNew messages:\n{messages}")
+    ])
+
 def get_system_prompt():
-    system_prompt = """You are a helpful assistant that answers general questions from the user. Your goal is to provide quick, accurate, and helpful answers.\
-    Make your answers short and concise while making sure to provide all the information the user is looking for.
-    """
-    return system_prompt
+    return SYSTEM_PROMPT
 
 def chat_prompt():
     return ChatPromptTemplate.from_messages([
@@ -0,0 +1,156 @@
+import hashlib
+import logging
+import threading
+
+import httpx
+from ollama import ResponseError
+
+from core.runtime import OLLAMA_MODEL, OLLAMA_URLS, OLLAMA_NUM_CTX, get_llm
+from core.metrics import register_collector
+
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+CHAT = "chat"
+TITLE = "title"
+SUMMARY = "summary"
+
+# per task: models in order of preference and generation options, overridable with
+# <TASK>_MODELS (comma separated), <TASK>_NUM_PREDICT, <TASK>_TEMPERATURE and <TASK>_NUM_CTX
+DEFAULT_ROUTES = {
+    CHAT: (OLLAMA_MODEL, {}),
+    TITLE: (OLLAMA_MODEL, {"num_predict": 24, "temperature": 0.2}),
+    SUMMARY: (OLLAMA_MODEL, {"num_predict": 384, "temperature": 0.2}),
+}
+OPTION_TYPES = {"num_predict": int, "temperature": float, "num_ctx": int}
+
+# an ollama server that can't be reached: try the session's next backend
+BACKEND_ERRORS = (ConnectionError, httpx.ConnectError, httpx.ConnectTimeout)
+
+class ModelRoute:
+    __slots__ = ("task", "models", "options")
+
+    def __init__(self, task, models, options=None):
+        if not models:
+            raise ValueError(f"route {task!r} needs at least one model")
+        self.task = task
+        self.models = list(models)
+        self.options = dict(options or {})
+
+    def __repr__(self):
+        return f"ModelRoute({self.task!r}, {self.models!r}, {self.options!r})"
+
+def route_from_env(task, default_models, default_options) -> ModelRoute:
+    prefix = task.upper()
+    models = [model.strip() for model in os.getenv(f"{prefix}_MODELS", default_models).split(",") if model.strip()]
+    options = dict(default_options)
+    for option, cast in OPTION_TYPES.items():
+        value = os.getenv(f"{prefix}_{option.upper()}")
+        if value is not None:
+            options[option] = cast(value)
+    return ModelRoute(task, models, options)
+
+class ModelRouter:
+    """Picks the model and generation options for each kind of LLM call.
+
+    Auxiliary tasks (titles, summaries) can run on a smaller model with a
+    short output cap while chat keeps the big one. A route lists several
+    models: if Ollama rejects the preferred one (not pulled, does not fit in
+    memory) the call is retried on the next.
+
+    With several Ollama `backends`, each session is sent to the same one on
+    every turn, where its prompt prefix is still cached, and moves to the
+    next one only while that backend is unreachable.
+    """
+
+    def __init__(self, routes, llm_factory=get_llm, backends=()):
+        self.routes = {route.task: route for route in routes}
+        self.backends = list(backends)
+        self._llm_factory = llm_factory
+        self._lock = threading.Lock()
+        self._llms = {}
+        self.stats = {task: {"requests": 0, "fallbacks": 0} for task in self.routes}
+        self.backend_stats = {backend: 0 for backend in self.backends}
+        self._check_num_ctx()
+
+    def _check_num_ctx(self):
+        num_ctx = {}
+        for route in self.routes.values():
+            for model in route.models:
+                num_ctx.setdefault(model, set()).add(route.options.get("num_ctx", OLLAMA_NUM_CTX))
+        for model, values in num_ctx.items():
+            if len(values) > 1:
+                logger.warning("Tasks on %s use different num_ctx %s: ollama reloads it whenever they alternate",
+                               model, sorted(values))
+
+    def route(self, task) -> ModelRoute:
+        return self.routes[task]
+
+    def backends_for(self, session_id=None) -> list:
+        """Backends in the order a session tries them.
+
+        Rendezvous hashing: every process picks the same first backend for a
+        session, and adding or removing a backend only moves the sessions
+        that hash to it.
+        """
+        if session_id is None or len(self.backends) <= 1:
+            return list(self.backends)
+        return sorted(self.backends, reverse=True, key=lambda backend: hashlib.blake2b(
+            f"{backend}|{session_id}".encode(), digest_size=8
+        ).digest())
+
+    def _route_llm(self, route, backend=None):
+        kwargs = {"base_url": backend} if backend else {}
+        llms = [self._llm_factory(model, **kwargs, **route.options) for model in route.models]
+        if len(llms) == 1:
+            return llms[0]
+        return llms[0].with_fallbacks(llms[1:], exceptions_to_handle=(ResponseError,))
+
+    def llm(self, task, session_id=None):
+        """Runnable for a task: its preferred model, with the other models of the route as fallbacks.
+
+        With several backends, on the session's backend first and then on the others.
+        """
+        route = self.route(task)
+        if len(self.backends) <= 1:
+            return self._route_llm(route)
+        order = tuple(self.backends_for(session_id))
+        if session_id is not None:
+            with self._lock:
+                self.backend_stats[order[0]] += 1
+        key = (task, order)
+        llm = self._llms.get(key)
+        if llm is None:
+            llms = [self._route_llm(route, backend) for backend in order]
+            llm = self._llms[key] = llms[0].with_fallbacks(llms[1:], exceptions_to_handle=BACKEND_ERRORS)
+        return llm
+
+    def served(self, task, response_metadata):
+        """Count a response for a task, noting when a fallback model produced it."""
+        model = (response_metadata or {}).get("model")
+        route = self.routes.get(task)
+        if route is None:
+            return
+        with self._lock:
+            self.stats[task]["requests"] += 1
+            if model and model != route.models[0]:
+                self.stats[task]["fallbacks"] += 1
+                logger.warning("%s request served by fallback model %s instead of %s", task, model, route.models[0])
+
+ROUTER = ModelRouter(
+    [route_from_env(task, model, options) for task, (model, options) in DEFAULT_ROUTES.items()],
+    backends=OLLAMA_URLS,
+)
+
+def _router_metrics():
+    for task, values in ROUTER.stats.items():
+        for key, value in values.items():
+            yield (f"model_router_{key}", f"LLM {key} by task.", {"task": task}, value)
+    for backend, turns in ROUTER.backend_stats.items():
+        yield ("model_router_session_turns", "Session turns routed to each Ollama backend first.", {"backend": backend}, turns)
+
+register_collector(_router_metrics)
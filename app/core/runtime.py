@@ -0,0 +1,127 @@
+import asyncio
+import atexit
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+import httpx
+from langchain_ollama import ChatOllama, OllamaEmbeddings
+
+from core.scheduler import OLLAMA_REQUEST_TIMEOUT
+
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.2")
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://ollama:11434")
+# several ollama servers, comma separated: each session sticks to one of them (see core.router)
+OLLAMA_URLS = [url.strip() for url in os.getenv("OLLAMA_URLS", OLLAMA_URL).split(",") if url.strip()]
+# how long ollama keeps a model loaded after a request, sent with every request so none shortens it
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+# context window sent with every request: a request with another num_ctx reloads the model and drops its prompt cache
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "4096"))
+
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "16"))
+OLLAMA_KEEPALIVE_EXPIRY = float(os.getenv("OLLAMA_KEEPALIVE_EXPIRY", "60"))  # seconds an idle http connection is kept
+BLOCKING_WORKERS = int(os.getenv("BLOCKING_WORKERS", "8"))
+
+# bounded pool for the blocking (db / sync llm) calls made from the runtime loop
+blocking_executor = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="blocking")
+
+_loop = None
+_loop_lock = threading.Lock()
+_llms = {}
+_llms_lock = threading.Lock()
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Return the process-wide background event loop, starting its thread on first use."""
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                loop.set_default_executor(blocking_executor)
+                threading.Thread(target=loop.run_forever, name="runtime-loop", daemon=True).start()
+                _loop = loop
+    return _loop
+
+def submit(coro):
+    """Schedule a coroutine on the background loop and return its concurrent Future."""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+def run_coroutine(coro, timeout=None):
+    """Run a coroutine on the background loop and wait for its result."""
+    return submit(coro).result(timeout)
+
+async def _cancel_tasks():
+    tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+@atexit.register
+def shutdown(timeout=5):
+    """Cancel background tasks and stop the runtime loop."""
+    global _loop
+    with _loop_lock:
+        loop, _loop = _loop, None
+    if loop is None:
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(_cancel_tasks(), loop).result(timeout)
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+
+def _http_limits():
+    return httpx.Limits(
+        max_connections=OLLAMA_MAX_CONNECTIONS,
+        max_keepalive_connections=OLLAMA_MAX_CONNECTIONS,
+        keepalive_expiry=OLLAMA_KEEPALIVE_EXPIRY,
+    )
+
+def keep_alive_value(value=None):
+    """OLLAMA_KEEP_ALIVE as ollama expects it: a duration string like "30m", or seconds (-1 keeps it forever)."""
+    value = OLLAMA_KEEP_ALIVE if value is None else value
+    return int(value) if value.lstrip("-").isdigit() else value
+
+def get_llm(model=None, base_url=None, **options) -> ChatOllama:
+    """Shared ChatOllama client per model, Ollama server and generation options.
+
+    Each client keeps its own pooled keep-alive HTTP connections to Ollama,
+    so reusing it avoids a new TCP connection and client setup per call.
+    """
+    model = model or OLLAMA_MODEL
+    base_url = base_url or OLLAMA_URL
+    options.setdefault("keep_alive", keep_alive_value())
+    options.setdefault("num_ctx", OLLAMA_NUM_CTX)
+    key = (model, base_url, tuple(sorted(options.items())))
+    llm = _llms.get(key)
+    if llm is None:
+        with _llms_lock:
+            llm = _llms.get(key)
+            if llm is None:
+                llm = ChatOllama(
+                    model=model,
+                    base_url=base_url,
+                    client_kwargs={"timeout": OLLAMA_REQUEST_TIMEOUT, "limits": _http_limits()},
+                    **options
+                )
+                _llms[key] = llm
+    return llm
+
+def get_embeddings(model) -> OllamaEmbeddings:
+    """Shared OllamaEmbeddings client per model."""
+    key = ("embeddings", model)
+    embeddings = _llms.get(key)
+    if embeddings is None:
+        with _llms_lock:
+            embeddings = _llms.get(key)
+            if embeddings is None:
+                embeddings = OllamaEmbeddings(
+                    model=model,
+                    base_url=OLLAMA_URL,
+                    client_kwargs={"timeout": OLLAMA_REQUEST_TIMEOUT, "limits": _http_limits()},
+                )
+                _llms[key] = embeddings
+    return embeddings
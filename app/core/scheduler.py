@@ -0,0 +1,251 @@
+import asyncio
+from contextlib import contextmanager, asynccontextmanager
+import heapq
+import itertools
+import threading
+import time
+
+from core.metrics import register_collector
+
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+OLLAMA_MAX_IN_FLIGHT = int(os.getenv("OLLAMA_MAX_IN_FLIGHT", "4"))
+OLLAMA_MAX_QUEUE = int(os.getenv("OLLAMA_MAX_QUEUE", "32"))
+OLLAMA_REQUEST_TIMEOUT = float(os.getenv("OLLAMA_REQUEST_TIMEOUT", "120"))  # http timeout of a single ollama call
+
+# priority classes, lower runs first
+INTERACTIVE = 0
+BACKGROUND = 1
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+# how long a request may wait in the queue before it gives up
+QUEUE_TIMEOUTS = {
+    INTERACTIVE: float(os.getenv("OLLAMA_QUEUE_TIMEOUT_INTERACTIVE", "30")),
+    BACKGROUND: float(os.getenv("OLLAMA_QUEUE_TIMEOUT_BACKGROUND", "300")),
+}
+
+class SchedulerOverloaded(Exception):
+    """Raised when a request is shed because the queue is full."""
+
+class SchedulerTimeout(Exception):
+    """Raised when a request waited longer than its queue timeout."""
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "enqueued_at", "admitted", "shed", "future")
+
+    def __init__(self, priority, seq, future=None):
+        self.priority = priority
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+        self.admitted = False
+        self.shed = False
+        self.future = future  # set for async waiters, resolved when admitted or shed
+
+    def wake(self):
+        if self.future is not None:
+            self.future.get_loop().call_soon_threadsafe(_resolve, self.future)
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+class OllamaScheduler:
+    """Admission control in front of the Ollama server.
+
+    At most `max_in_flight` requests run at once; the rest wait in a priority
+    queue (interactive before background, FIFO within a class). When the queue
+    holds `max_queue` requests a new request displaces the newest waiter of a
+    lower priority class, or is rejected with SchedulerOverloaded.
+
+    Threads wait with acquire()/slot()/stream(); coroutines share the same
+    queue through aacquire()/aslot()/astream() without occupying a thread.
+    """
+
+    def __init__(self, max_in_flight=OLLAMA_MAX_IN_FLIGHT, max_queue=OLLAMA_MAX_QUEUE):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self._cond = threading.Condition()
+        self._queue = []
+        self._in_flight = 0
+        self._seq = itertools.count()
+        self._stats = {
+            name: {"requests": 0, "shed": 0, "timeouts": 0, "wait_seconds_total": 0.0, "wait_seconds_max": 0.0}
+            for name in PRIORITY_NAMES.values()
+        }
+
+    def _admit_waiters(self):
+        while self._queue and self._in_flight < self.max_in_flight:
+            waiter = heapq.heappop(self._queue)
+            waiter.admitted = True
+            self._in_flight += 1
+            waiter.wake()
+        self._cond.notify_all()
+
+    def _shed_for(self, priority):
+        # drop the newest waiter of the lowest priority class if it ranks below the newcomer
+        victim = max(self._queue, key=lambda w: (w.priority, w.seq))
+        if victim.priority <= priority:
+            return False
+        self._queue.remove(victim)
+        heapq.heapify(self._queue)
+        victim.shed = True
+        victim.wake()
+        self._cond.notify_all()
+        return True
+
+    def _enqueue(self, priority, future=None):
+        """Take a free slot (return None) or queue a waiter. Call with the lock held."""
+        stats = self._stats[PRIORITY_NAMES[priority]]
+        stats["requests"] += 1
+        if not self._queue and self._in_flight < self.max_in_flight:
+            self._in_flight += 1
+            return None
+        if len(self._queue) >= self.max_queue and not self._shed_for(priority):
+            stats["shed"] += 1
+            raise SchedulerOverloaded(f"Ollama queue is full ({self.max_queue} waiting)")
+        waiter = _Waiter(priority, next(self._seq), future)
+        heapq.heappush(self._queue, waiter)
+        return waiter
+
+    def _give_up(self, waiter, timeout):
+        """Dequeue a waiter that ran out of time. Call with the lock held."""
+        self._queue.remove(waiter)
+        heapq.heapify(self._queue)
+        self._stats[PRIORITY_NAMES[waiter.priority]]["timeouts"] += 1
+        raise SchedulerTimeout(f"Waited more than {timeout}s for an Ollama slot")
+
+    def _admitted(self, waiter):
+        """Record the wait of a woken waiter and raise if it was shed. Call with the lock held."""
+        stats = self._stats[PRIORITY_NAMES[waiter.priority]]
+        waited = time.monotonic() - waiter.enqueued_at
+        stats["wait_seconds_total"] += waited
+        stats["wait_seconds_max"] = max(stats["wait_seconds_max"], waited)
+        if waiter.shed:
+            stats["shed"] += 1
+            raise SchedulerOverloaded("Request shed to make room for higher priority work")
+        return waited
+
+    def acquire(self, priority=INTERACTIVE, timeout=None):
+        """Wait for an in-flight slot. Return the seconds spent queued."""
+        timeout = QUEUE_TIMEOUTS[priority] if timeout is None else timeout
+        with self._cond:
+            waiter = self._enqueue(priority)
+            if waiter is None:
+                return 0.0
+            deadline = waiter.enqueued_at + timeout
+            while not waiter.admitted and not waiter.shed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._give_up(waiter, timeout)
+                self._cond.wait(remaining)
+            return self._admitted(waiter)
+
+    async def aacquire(self, priority=INTERACTIVE, timeout=None):
+        """Async acquire(): wait for a slot on the event loop instead of in a thread."""
+        timeout = QUEUE_TIMEOUTS[priority] if timeout is None else timeout
+        with self._cond:
+            waiter = self._enqueue(priority, asyncio.get_running_loop().create_future())
+            if waiter is None:
+                return 0.0
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+        except asyncio.TimeoutError:
+            with self._cond:
+                if not waiter.admitted and not waiter.shed:
+                    self._give_up(waiter, timeout)
+        except asyncio.CancelledError:
+            with self._cond:
+                if waiter.admitted:  # admitted just as we were cancelled, hand the slot back
+                    self.release()
+                elif not waiter.shed:
+                    self._queue.remove(waiter)
+                    heapq.heapify(self._queue)
+            raise
+        with self._cond:
+            return self._admitted(waiter)
+
+    def release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._admit_waiters()
+
+    @contextmanager
+    def slot(self, priority=INTERACTIVE, timeout=None):
+        self.acquire(priority, timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def invoke(self, runnable, inputs, priority=INTERACTIVE, **kwargs):
+        """runnable.invoke() once a slot is free."""
+        with self.slot(priority):
+            return runnable.invoke(inputs, **kwargs)
+
+    def stream(self, runnable, inputs, priority=INTERACTIVE, **kwargs):
+        """runnable.stream(), holding a slot until the stream is exhausted or closed.
+
+        Closing this generator closes the runnable's stream right away, which
+        aborts the HTTP request to ollama instead of letting it finish unread.
+        """
+        with self.slot(priority):
+            stream = iter(runnable.stream(inputs, **kwargs))
+            try:
+                yield from stream
+            finally:
+                if hasattr(stream, "close"):  # runnables promise an iterator, langchain's are generators
+                    stream.close()
+
+    @asynccontextmanager
+    async def aslot(self, priority=INTERACTIVE, timeout=None):
+        await self.aacquire(priority, timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def ainvoke(self, runnable, inputs, priority=INTERACTIVE, **kwargs):
+        """runnable.ainvoke() once a slot is free."""
+        async with self.aslot(priority):
+            return await runnable.ainvoke(inputs, **kwargs)
+
+    async def astream(self, runnable, inputs, priority=INTERACTIVE, **kwargs):
+        """runnable.astream(), holding a slot until the stream is exhausted or closed."""
+        async with self.aslot(priority):
+            stream = runnable.astream(inputs, **kwargs)
+            try:
+                async for chunk in stream:
+                    yield chunk
+            finally:
+                if hasattr(stream, "aclose"):
+                    await stream.aclose()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "in_flight": self._in_flight,
+                "queue_depth": len(self._queue),
+                "max_in_flight": self.max_in_flight,
+                "max_queue": self.max_queue,
+                "priorities": {name: dict(values) for name, values in self._stats.items()},
+            }
+
+# shared by every caller in this process
+SCHEDULER = OllamaScheduler()
+
+def _scheduler_metrics():
+    stats = SCHEDULER.stats()
+    yield ("ollama_in_flight", "Ollama requests currently running.", {}, stats["in_flight"])
+    yield ("ollama_queue_depth", "Ollama requests waiting for a slot.", {}, stats["queue_depth"])
+    for priority, values in stats["priorities"].items():
+        for key, value in values.items():
+            yield (f"ollama_scheduler_{key}", f"Scheduler {key} by priority class.", {"priority": priority}, value)
+
+register_collector(_scheduler_metrics)
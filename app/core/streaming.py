@@ -0,0 +1,60 @@
+import time
+
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+STREAM_FLUSH_INTERVAL = float(os.getenv("STREAM_FLUSH_INTERVAL", "0.05"))  # seconds between flushes
+STREAM_FLUSH_BYTES = int(os.getenv("STREAM_FLUSH_BYTES", "256"))  # flush early once this much text is buffered
+
+class ChunkCoalescer:
+    """Batches streamed text so a reply is sent and rendered in a few updates instead of one per token.
+
+    add() returns the buffered text once `interval` seconds have passed since
+    the last flush or `max_bytes` are buffered, else None. The first piece is
+    released at once so time-to-first-token is unaffected. The clock is only
+    checked when text arrives; call flush() at the end of the stream.
+    """
+
+    def __init__(self, interval=STREAM_FLUSH_INTERVAL, max_bytes=STREAM_FLUSH_BYTES, clock=time.monotonic):
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self._clock = clock
+        self._buffer = []
+        self._size = 0
+        self._last_flush = None
+        self.pieces = self.flushes = 0
+
+    def add(self, text):
+        if not text:
+            return None
+        self.pieces += 1
+        self._buffer.append(text)
+        self._size += len(text.encode())
+        now = self._clock()
+        if self._last_flush is None or self._size >= self.max_bytes or now - self._last_flush >= self.interval:
+            return self.flush(now)
+        return None
+
+    def flush(self, now=None):
+        """Return and clear the buffered text ("" if empty)."""
+        if not self._buffer:
+            return ""
+        text = "".join(self._buffer)
+        self._buffer.clear()
+        self._size = 0
+        self._last_flush = self._clock() if now is None else now
+        self.flushes += 1
+        return text
+
+def coalesce(texts, interval=STREAM_FLUSH_INTERVAL, max_bytes=STREAM_FLUSH_BYTES):
+    """Re-yield an iterable of text pieces in coalesced batches."""
+    coalescer = ChunkCoalescer(interval, max_bytes)
+    for text in texts:
+        batch = coalescer.add(text)
+        if batch:
+            yield batch
+    batch = coalescer.flush()
+    if batch:
+        yield batch
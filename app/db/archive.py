@@ -0,0 +1,293 @@
+"""Bulk export, import and retention of chat sessions.
+
+Sessions are written as zstandard-compressed JSONL, one session per line
+with its sessions-table row and all of its messages. Rows are streamed out
+of Postgres with COPY and back in with COPY. Work is done in batches of
+sessions, each in its own short transaction, and progress is printed as it
+goes.
+
+Run from the app/ directory:
+
+    python -m db.archive export sessions.jsonl.zst
+    python -m db.archive export old.jsonl.zst --inactive-days 180
+    python -m db.archive import sessions.jsonl.zst
+    python -m db.archive prune --inactive-days 180 --archive old.jsonl.zst
+
+`prune` deletes sessions inactive for that many days, after writing each
+batch to the archive (when given) and syncing it to disk. Sessions that
+get a new message while a batch is being archived are kept.
+"""
+import argparse
+from datetime import datetime, timedelta, timezone
+import io
+import json
+import os
+import sys
+import time
+
+from psycopg import sql
+import zstandard
+
+from db.connection import get_connection
+from db.messages import MESSAGES_TABLE
+from db.sessions import SESSIONS_TABLE
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "200"))  # sessions per batch and transaction
+ARCHIVE_COMPRESSION_LEVEL = int(os.getenv("ARCHIVE_COMPRESSION_LEVEL", "3"))
+
+SESSION_FIELDS = (
+    "title", "created_at", "last_activity", "message_count", "prompt_tokens", "completion_tokens",
+    "summary", "summary_message_count",
+)
+
+class Progress:
+    """Counts sessions, messages and bytes of a bulk job and prints the throughput now and then."""
+
+    def __init__(self, label, out=sys.stderr, interval=1.0, clock=time.monotonic):
+        self.label = label
+        self.out = out
+        self.interval = interval
+        self._clock = clock
+        self.started = self._last_report = clock()
+        self.sessions = self.messages = self.bytes = 0
+
+    def add(self, sessions=0, messages=0, nbytes=0):
+        self.sessions += sessions
+        self.messages += messages
+        self.bytes += nbytes
+        now = self._clock()
+        if self.out is not None and now - self._last_report >= self.interval:
+            self._last_report = now
+            self.report()
+
+    def stats(self) -> dict:
+        seconds = max(self._clock() - self.started, 1e-9)
+        return {
+            "sessions": self.sessions,
+            "messages": self.messages,
+            "bytes": self.bytes,
+            "seconds": seconds,
+            "sessions_per_s": self.sessions / seconds,
+            "messages_per_s": self.messages / seconds,
+            "mb_per_s": self.bytes / seconds / 1e6,
+        }
+
+    def report(self):
+        stats = self.stats()
+        print(f"{self.label}: {stats['sessions']} sessions, {stats['messages']} messages, "
+              f"{stats['bytes'] / 1e6:.1f} MB in {stats['seconds']:.1f}s "
+              f"({stats['sessions_per_s']:.0f} sessions/s, {stats['messages_per_s']:.0f} messages/s, "
+              f"{stats['mb_per_s']:.1f} MB/s)", file=self.out, flush=True)
+
+def _cutoff(inactive_days):
+    return None if inactive_days is None else datetime.now(timezone.utc) - timedelta(days=inactive_days)
+
+def _batch_query():
+    # keyset walk from the oldest activity, so deleted batches are always behind the cursor
+    return sql.SQL("""
+        SELECT session_id, last_activity, message_count
+        FROM {sessions}
+        WHERE (%(cutoff)s::timestamptz IS NULL OR last_activity < %(cutoff)s::timestamptz)
+          AND (%(after_ts)s::timestamptz IS NULL
+               OR (last_activity, session_id) > (%(after_ts)s::timestamptz, %(after_id)s::uuid))
+        ORDER BY last_activity, session_id
+        LIMIT %(limit)s
+    """).format(sessions=sql.Identifier(SESSIONS_TABLE))
+
+def _export_query():
+    fields = sql.SQL(", ").join(
+        sql.SQL("{name}, s.{column}").format(name=sql.Literal(field), column=sql.Identifier(field)) for field in SESSION_FIELDS
+    )
+    return sql.SQL("""
+        COPY (
+            SELECT jsonb_build_object('session_id', s.session_id, {fields}, 'messages', (
+                SELECT coalesce(jsonb_agg(jsonb_build_object('role', h.role, 'content', h.content, 'metadata', h.metadata, 'created_at', h.created_at) ORDER BY h.id), '[]')
+                FROM {history} h WHERE h.session_id = s.session_id
+            ))::text
+            FROM {sessions} s
+            WHERE s.session_id = ANY(%(ids)s::uuid[])
+            ORDER BY s.last_activity, s.session_id
+        ) TO STDOUT
+    """).format(fields=fields, history=sql.Identifier(MESSAGES_TABLE), sessions=sql.Identifier(SESSIONS_TABLE))
+
+def _delete_queries():
+    # only sessions still inactive: a message stored since the batch was read moves last_activity past the cutoff
+    sessions = sql.SQL("""
+        DELETE FROM {sessions}
+        WHERE session_id = ANY(%(ids)s::uuid[])
+          AND (%(cutoff)s::timestamptz IS NULL OR last_activity < %(cutoff)s::timestamptz)
+        RETURNING session_id
+    """).format(sessions=sql.Identifier(SESSIONS_TABLE))
+    history = sql.SQL("DELETE FROM {history} WHERE session_id = ANY(%s::uuid[])").format(
+        history=sql.Identifier(MESSAGES_TABLE)
+    )
+    return sessions, history
+
+def _write_batch(cursor, writer, ids):
+    """COPY a batch of sessions into the compressed writer. Returns the uncompressed bytes written."""
+    written = 0
+    with cursor.copy(_export_query(), {"ids": ids}) as copy:
+        for (line,) in copy.rows():
+            data = line.encode() + b"\n"
+            writer.write(data)
+            written += len(data)
+    return written
+
+def _sync(writer, f):
+    # end the zstd frame and sync the file, so the batch can be read back even if the job dies later
+    writer.flush(zstandard.FLUSH_FRAME)
+    f.flush()
+    os.fsync(f.fileno())
+
+def archive_sessions(conn, output=None, inactive_days=None, delete=False, batch_size=ARCHIVE_BATCH_SIZE, progress=None,
+                     append=False):
+    """Export sessions (all, or those inactive for `inactive_days`) to `output`, and/or delete them.
+
+    Each batch is exported and deleted in its own transaction, and synced to
+    disk before its rows are deleted. `output` must not exist yet unless
+    `append` is set. Returns the number of sessions exported, or deleted
+    when `delete` is set.
+    """
+    if delete and inactive_days is None:
+        raise ValueError("deleting sessions needs inactive_days")
+    if output is None and not delete:
+        raise ValueError("nothing to do without an output or delete")
+    cutoff = _cutoff(inactive_days)
+    progress = progress or Progress("archive", out=None)
+    delete_sessions, delete_history = _delete_queries()
+    f = open(output, "ab" if append else "xb") if output else None
+    writer = zstandard.ZstdCompressor(level=ARCHIVE_COMPRESSION_LEVEL).stream_writer(f, closefd=False) if f else None
+    done, after_ts, after_id = 0, None, None
+    try:
+        while True:
+            with conn.cursor() as cursor:
+                cursor.execute(_batch_query(), {
+                    "cutoff": cutoff, "after_ts": after_ts, "after_id": after_id, "limit": batch_size,
+                })
+                rows = cursor.fetchall()
+                if not rows:
+                    conn.commit()
+                    break
+                ids = [row[0] for row in rows]
+                after_ts, after_id = rows[-1][1], rows[-1][0]
+                nbytes = 0
+                if writer is not None:
+                    nbytes = _write_batch(cursor, writer, ids)
+                    _sync(writer, f)
+                if delete:
+                    cursor.execute(delete_sessions, {"ids": ids, "cutoff": cutoff})
+                    deleted = {row[0] for row in cursor.fetchall()}
+                    cursor.execute(delete_history, (list(deleted),))
+                    rows = [row for row in rows if row[0] in deleted]
+            conn.commit()
+            done += len(rows)
+            progress.add(sessions=len(rows), messages=sum(row[2] for row in rows), nbytes=nbytes)
+    finally:
+        if writer is not None:
+            writer.close()
+        if f is not None:
+            f.close()
+    return done
+
+def read_archive(path):
+    """Yield the session records of an archive written by archive_sessions()."""
+    with open(path, "rb") as f:
+        reader = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+        for line in io.TextIOWrapper(reader, encoding="utf-8"):
+            if line.strip():
+                yield json.loads(line)
+
+def _batches(records, size):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _import_batch(cursor, batch):
+    """Insert sessions that aren't already stored, then their messages. Returns (sessions, messages) imported."""
+    records = {record["session_id"]: record for record in batch}  # the last copy of a session exported twice
+    columns = ("session_id",) + SESSION_FIELDS
+    # sessions rows first: ON CONFLICT tells which sessions are new, even with another import running
+    cursor.executemany(sql.SQL(
+        "INSERT INTO {sessions} ({columns}) VALUES ({values}) ON CONFLICT (session_id) DO NOTHING RETURNING session_id"
+    ).format(
+        sessions=sql.Identifier(SESSIONS_TABLE),
+        columns=sql.SQL(", ").join(map(sql.Identifier, columns)),
+        values=sql.SQL(", ").join(sql.Placeholder() * len(columns)),
+    ), [tuple(record.get(column) for column in columns) for record in records.values()], returning=True)
+    inserted = set()
+    while True:
+        inserted.update(str(row[0]) for row in cursor.fetchall())
+        if not cursor.nextset():
+            break
+    new = [record for session_id, record in records.items() if session_id in inserted]
+    if not new:
+        return 0, 0
+    messages = 0
+    copy_query = sql.SQL("COPY {history} (session_id, role, content, metadata, created_at) FROM STDIN").format(
+        history=sql.Identifier(MESSAGES_TABLE)
+    )
+    with cursor.copy(copy_query) as copy:
+        for record in new:
+            for message in record["messages"]:
+                metadata = json.dumps(message["metadata"]) if message["metadata"] is not None else None
+                copy.write_row((record["session_id"], message["role"], message["content"], metadata, message["created_at"]))
+                messages += 1
+    return len(new), messages
+
+def import_sessions(conn, path, batch_size=ARCHIVE_BATCH_SIZE, progress=None):
+    """Load an archive back. Sessions that already exist are skipped with their messages, so re-running is safe.
+
+    Returns the number of sessions imported.
+    """
+    progress = progress or Progress("import", out=None)
+    imported = 0
+    for batch in _batches(read_archive(path), batch_size):
+        with conn.cursor() as cursor:
+            sessions, messages = _import_batch(cursor, batch)
+        conn.commit()
+        imported += sessions
+        progress.add(sessions=sessions, messages=messages)
+    return imported
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk export, import and retention of chat sessions.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="write sessions to a zstd-compressed JSONL file")
+    export.add_argument("output")
+    export.add_argument("--inactive-days", type=float, help="only sessions inactive for this many days")
+    load = commands.add_parser("import", help="load sessions from an export")
+    load.add_argument("input")
+    prune = commands.add_parser("prune", help="delete sessions inactive for N days, archiving them first")
+    prune.add_argument("--inactive-days", type=float, required=True)
+    prune.add_argument("--archive", help="append the deleted sessions to this file first")
+    for command in (export, load, prune):
+        command.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE, help="sessions per transaction")
+    args = parser.parse_args(argv)
+    if args.command == "export" and os.path.exists(args.output):
+        parser.error(f"{args.output} already exists")  # appending would export its sessions twice
+
+    progress = Progress(args.command)
+    with get_connection() as conn:
+        if args.command == "export":
+            archive_sessions(conn, args.output, args.inactive_days, batch_size=args.batch_size, progress=progress)
+        elif args.command == "import":
+            from db.schema import ensure_schema
+            ensure_schema()
+            import_sessions(conn, args.input, batch_size=args.batch_size, progress=progress)
+        else:
+            archive_sessions(conn, args.archive, args.inactive_days, delete=True, batch_size=args.batch_size, progress=progress,
+                             append=True)
+    progress.report()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,13 @@
+import asyncio
+
 import psycopg
+from psycopg_pool import ConnectionPool, AsyncConnectionPool
+
+from core.metrics import register_collector
 
 from dotenv import load_dotenv
 import os
+import threading
 
 load_dotenv()
 
@@ -11,6 +17,141 @@ DB_PASSWORD = os.getenv("DB_PASSWORD", "password")
 DB_HOST = os.getenv("DB_HOST", "db")
 DB_PORT = os.getenv("DB_PORT", "5432")
 
-def get_connection():
-    conn_info = f"dbname={DB_NAME} user={DB_USER} password={DB_PASSWORD} host={DB_HOST} port={DB_PORT}"
-    return psycopg.connect(conn_info)
\ No newline at end of file
+# pool sizing, see get_pool_stats() for the numbers to tune these against
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # seconds to wait for a free connection
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "300"))  # idle connections above min_size are closed after this
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "3600"))
+
+_pool = None
+_async_pools = {}  # event loop -> async pool, an async pool only works on the loop that opened it
+_pool_lock = threading.Lock()
+
+_query_count = 0
+_query_count_lock = threading.Lock()
+
+def _count_query(n=1):
+    global _query_count
+    with _query_count_lock:
+        _query_count += n
+
+def get_query_count() -> int:
+    """Number of statements executed through pooled connections since startup."""
+    return _query_count
+
+class CountingCursor(psycopg.Cursor):
+    def execute(self, query, params=None, **kwargs):
+        _count_query()
+        return super().execute(query, params, **kwargs)
+
+    def executemany(self, query, params_seq, **kwargs):
+        _count_query()
+        return super().executemany(query, params_seq, **kwargs)
+
+class AsyncCountingCursor(psycopg.AsyncCursor):
+    async def execute(self, query, params=None, **kwargs):
+        _count_query()
+        return await super().execute(query, params, **kwargs)
+
+    async def executemany(self, query, params_seq, **kwargs):
+        _count_query()
+        return await super().executemany(query, params_seq, **kwargs)
+
+def _configure_connection(conn):
+    conn.cursor_factory = CountingCursor
+
+async def _aconfigure_connection(conn):
+    conn.cursor_factory = AsyncCountingCursor
+
+def get_conninfo():
+    return f"dbname={DB_NAME} user={DB_USER} password={DB_PASSWORD} host={DB_HOST} port={DB_PORT}"
+
+def get_connection(autocommit=False):
+    """Open a dedicated connection. Prefer get_pool() for request paths."""
+    return psycopg.connect(get_conninfo(), autocommit=autocommit)
+
+def _pool_kwargs():
+    return dict(
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        timeout=DB_POOL_TIMEOUT,
+        max_idle=DB_POOL_MAX_IDLE,
+        max_lifetime=DB_POOL_MAX_LIFETIME,
+    )
+
+def get_pool() -> ConnectionPool:
+    """Return the process-wide connection pool, opening it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    get_conninfo(),
+                    check=ConnectionPool.check_connection,  # health check on checkout
+                    configure=_configure_connection,
+                    name="chat-sync",
+                    open=True,
+                    **_pool_kwargs()
+                )
+    return _pool
+
+async def get_async_pool() -> AsyncConnectionPool:
+    """Return the async connection pool of the running event loop, opening it on first use.
+
+    Async pools are bound to the loop they were opened on, so each loop that
+    talks to the database (the API server, the runtime loop) gets its own.
+    """
+    loop = asyncio.get_running_loop()
+    pool = _async_pools.get(loop)
+    if pool is None:
+        pool = AsyncConnectionPool(
+            get_conninfo(),
+            check=AsyncConnectionPool.check_connection,
+            configure=_aconfigure_connection,
+            name=f"chat-async-{len(_async_pools)}",
+            open=False,
+            **_pool_kwargs()
+        )
+        await pool.open()
+        if loop not in _async_pools:
+            _async_pools[loop] = pool
+        else:  # another task on this loop won the race
+            await pool.close()
+            pool = _async_pools[loop]
+    return pool
+
+def get_pool_stats() -> dict:
+    """Checkout and wait-time counters for the open pools.
+
+    Keys come from psycopg_pool (requests_num, requests_wait_ms, usage_ms,
+    connections_num, pool_size, pool_available, requests_waiting, ...).
+    """
+    stats = {}
+    if _pool is not None:
+        stats["sync"] = _pool.get_stats()
+    for pool in list(_async_pools.values()):
+        stats[pool.name] = pool.get_stats()
+    return stats
+
+def _pool_metrics():
+    yield ("db_queries_total", "Statements executed through pooled connections.", {}, get_query_count())
+    for pool_name, stats in get_pool_stats().items():
+        for key, value in stats.items():
+            yield (f"db_pool_{key}", f"psycopg_pool {key}.", {"pool": pool_name}, value)
+
+register_collector(_pool_metrics)
+
+def close_pools():
+    """Close the sync pool. Async pools must be closed on their loop with aclose_pools()."""
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool = None
+
+async def aclose_pools():
+    """Close the running loop's async pool and the sync pool."""
+    pool = _async_pools.pop(asyncio.get_running_loop(), None)
+    if pool is not None:
+        await pool.close()
+    close_pools()
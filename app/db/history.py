@@ -0,0 +1,192 @@
+from contextlib import contextmanager, asynccontextmanager
+import re
+import uuid
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from psycopg import sql
+
+from db.connection import get_pool, get_async_pool
+from db.messages import message_to_row, row_to_message
+from db.sessions import record_messages, arecord_messages, delete_session_row, adelete_session_row
+
+class PooledPostgresChatMessageHistory(BaseChatMessageHistory):
+    """Chat history on the compact messages table (see db.messages) that borrows
+    a pooled connection per operation instead of holding one for its lifetime.
+
+    Appends and clears also keep the sessions table in step, in the same
+    transaction as the message write. The a-prefixed methods use the
+    running event loop's async pool, so RunnableWithMessageHistory's astream
+    path never blocks a thread on the database.
+
+    With a `writer` (see db.write_behind), appends are only queued and the
+    writer commits them in batches. Reads then add the session's messages
+    still in the queue, with id None until they are committed.
+
+    With a `cache` (see services.history_cache), get_messages() and
+    aget_messages() read only rows newer than the cached ones.
+    """
+
+    def __init__(self, table_name: str, session_id: str, pool=None, async_pool=None, writer=None, cache=None):
+        try:
+            uuid.UUID(session_id)
+        except ValueError:
+            raise ValueError(f"Invalid session id. Session id must be a valid UUID. Got {session_id}")
+        if not re.match(r"^\w+$", table_name):
+            raise ValueError("Invalid table name. Table name must contain only alphanumeric characters and underscores.")
+
+        self._session_id = session_id
+        self._table_name = table_name
+        self._pool = pool or get_pool()
+        self._async_pool = async_pool
+        self._writer = writer
+        self._cache = cache
+        self._connection = None
+        self._aconnection = None
+
+    @contextmanager
+    def _borrow(self):
+        with self._pool.connection() as conn:
+            self._connection = conn
+            try:
+                yield conn
+            finally:
+                self._connection = None
+
+    @asynccontextmanager
+    async def _aborrow(self):
+        pool = self._async_pool or await get_async_pool()
+        async with pool.connection() as conn:
+            self._aconnection = conn
+            try:
+                yield conn
+            finally:
+                self._aconnection = None
+
+    def _insert_query(self, messages):
+        values = [(self._session_id, *message_to_row(message)) for message in messages]
+        query = sql.SQL("INSERT INTO {table} (session_id, role, content, metadata) VALUES (%s, %s, %s, %s)").format(
+            table=sql.Identifier(self._table_name)
+        )
+        return query, values
+
+    def add_messages(self, messages):
+        if self._writer is not None:
+            self._writer.put(self._session_id, messages)
+            return
+        query, values = self._insert_query(messages)
+        with self._borrow() as conn:
+            with conn.cursor() as cursor:
+                cursor.executemany(query, values)
+                record_messages(cursor, self._session_id, messages)
+            conn.commit()
+
+    async def aadd_messages(self, messages):
+        if self._writer is not None:
+            await self._writer.aput(self._session_id, messages)
+            return
+        query, values = self._insert_query(messages)
+        async with self._aborrow() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.executemany(query, values)
+                await arecord_messages(cursor, self._session_id, messages)
+            await conn.commit()
+
+    @property
+    def messages(self):
+        return self.get_messages()
+
+    def get_messages(self):
+        if self._cache is not None:
+            return self._cache.get(self._session_id, self)
+        return [message for _, message in self.get_message_rows()]
+
+    async def aget_messages(self):
+        if self._cache is not None:
+            return await self._cache.aget(self._session_id, self)
+        return [message for _, message in await self.aget_message_rows()]
+
+    def _message_rows_query(self, after_id, before_id, limit):
+        conditions = [sql.SQL("session_id = %(session_id)s")]
+        if after_id is not None:
+            conditions.append(sql.SQL("id > %(after_id)s"))
+        if before_id is not None:
+            conditions.append(sql.SQL("id < %(before_id)s"))
+        query = sql.SQL("SELECT id, role, content, metadata FROM {table} WHERE {conditions} ORDER BY id {order}").format(
+            table=sql.Identifier(self._table_name),
+            conditions=sql.SQL(" AND ").join(conditions),
+            order=sql.SQL("DESC LIMIT %(limit)s" if limit is not None else "ASC"),
+        )
+        params = {"session_id": self._session_id, "after_id": after_id, "before_id": before_id, "limit": limit}
+        return query, params
+
+    def _pending(self, before_id):
+        # taken before the query: a message committed meanwhile is then either in the rows or has its id here
+        if self._writer is None or before_id is not None:
+            return []
+        return self._writer.pending(self._session_id)
+
+    @staticmethod
+    def _message_rows(rows, limit, after_id=None, pending=()):
+        if limit is not None:
+            rows.reverse()
+        result = [(message_id, row_to_message(role, content, metadata)) for message_id, role, content, metadata in rows]
+        if pending:
+            stored = {message_id for message_id, _ in result}
+            result += [
+                (message.id, message.message) for message in pending
+                if message.id is None or (message.id not in stored and (after_id is None or message.id > after_id))
+            ]
+            if limit is not None:
+                result = result[-limit:]
+        return result
+
+    def get_message_rows(self, after_id=None, before_id=None, limit=None):
+        """Return (id, message) pairs in insertion order.
+
+        `after_id` / `before_id` bound the row ids exclusively; with `limit`
+        the newest matching rows are returned. Queued messages come last,
+        with id None.
+        """
+        query, params = self._message_rows_query(after_id, before_id, limit)
+        pending = self._pending(before_id)
+        with self._borrow() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(query, params)
+                rows = cursor.fetchall()
+        return self._message_rows(rows, limit, after_id, pending)
+
+    async def aget_message_rows(self, after_id=None, before_id=None, limit=None):
+        query, params = self._message_rows_query(after_id, before_id, limit)
+        pending = self._pending(before_id)
+        async with self._aborrow() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(query, params)
+                rows = await cursor.fetchall()
+        return self._message_rows(rows, limit, after_id, pending)
+
+    def _clear_query(self):
+        return sql.SQL("DELETE FROM {table} WHERE session_id = %s").format(
+            table=sql.Identifier(self._table_name)
+        )
+
+    def clear(self):
+        if self._writer is not None:  # queued messages must not land after the delete
+            self._writer.flush()
+        with self._borrow() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(self._clear_query(), (self._session_id,))
+                delete_session_row(cursor, self._session_id)
+            conn.commit()
+        if self._cache is not None:
+            self._cache.invalidate(self._session_id)
+
+    async def aclear(self):
+        if self._writer is not None:
+            await self._writer.aflush()
+        async with self._aborrow() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(self._clear_query(), (self._session_id,))
+                await adelete_session_row(cursor, self._session_id)
+            await conn.commit()
+        if self._cache is not None:
+            self._cache.invalidate(self._session_id)
@@ -0,0 +1,238 @@
+"""Compact storage of chat messages.
+
+Each message is one row of typed columns: role, content, created_at, and a
+small metadata document holding only what the app reads back. That is the
+token usage and a few response flags; LangChain's run ids and Ollama's
+timing fields are dropped. Long content is compressed by Postgres itself:
+the content column uses lz4 TOAST compression where the server supports it,
+so search and snippets keep working on plain text.
+
+Run `python -m db.messages` from the app/ directory to copy messages from
+the legacy JSONB chat_history table. It copies in id-ordered batches, keeps
+the message ids and can be re-run to pick up rows written in the meantime.
+A legacy row whose id a new message took in the meantime is copied under a
+new id, and the number of such rows is reported.
+"""
+import argparse
+import json
+import logging
+import sys
+
+import psycopg
+from langchain_core.messages import AIMessage, ChatMessage, HumanMessage, SystemMessage
+from psycopg import sql
+
+from db.connection import get_connection
+
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+MESSAGES_TABLE = os.getenv("MESSAGES_TABLE", "chat_messages")
+LEGACY_CHAT_HISTORY_TABLE = os.getenv("CHAT_HISTORY_TABLE", "chat_history")
+MESSAGE_COMPRESSION = os.getenv("MESSAGE_COMPRESSION", "lz4")  # postgres column compression of long content
+MIGRATE_BATCH_SIZE = int(os.getenv("MIGRATE_BATCH_SIZE", "10000"))
+
+# response_metadata keys worth keeping; ollama's durations, timestamps and done flags are not read back
+KEPT_RESPONSE_METADATA = ("model", "cancelled", "cancel_reason", "cached")
+MESSAGE_CLASSES = {"human": HumanMessage, "ai": AIMessage, "system": SystemMessage}
+CHUNK_ROLES = {"AIMessageChunk": "ai", "HumanMessageChunk": "human", "SystemMessageChunk": "system"}
+
+def create_messages_table(conn):
+    """Create the messages table and its (session_id, id) index if they don't exist."""
+    table = sql.Identifier(MESSAGES_TABLE)
+    conn.execute(sql.SQL("""
+        CREATE TABLE IF NOT EXISTS {table} (
+            id BIGSERIAL PRIMARY KEY,
+            session_id UUID NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            metadata JSONB,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+    """).format(table=table))
+    conn.execute(sql.SQL("CREATE INDEX IF NOT EXISTS {index} ON {table} (session_id, id)").format(
+        index=sql.Identifier(f"idx_{MESSAGES_TABLE}_session_id_id"), table=table,
+    ))
+    reserve_legacy_ids(conn)
+    if MESSAGE_COMPRESSION:
+        try:
+            conn.execute(sql.SQL("ALTER TABLE {table} ALTER COLUMN content SET COMPRESSION {method}").format(
+                table=table, method=sql.SQL(MESSAGE_COMPRESSION),
+            ))
+        except psycopg.Error as e:  # postgres < 14 or built without lz4: the default pglz still applies
+            logger.warning("Could not set %s compression on %s.content: %s", MESSAGE_COMPRESSION, MESSAGES_TABLE, e)
+
+def reserve_legacy_ids(conn):
+    """Start new message ids after the legacy table's, so migrated rows keep their ids without clashing.
+
+    Never moves the sequence back: ids handed out but not committed yet may
+    be above every stored one.
+    """
+    if conn.execute("SELECT to_regclass(%s)", (LEGACY_CHAT_HISTORY_TABLE,)).fetchone()[0] is None:
+        return
+    conn.execute(sql.SQL("""
+        SELECT setval(seq::regclass, greatest(
+            (SELECT max(id) FROM {legacy}), (SELECT max(id) FROM {table}), pg_sequence_last_value(seq::regclass), 1
+        ))
+        FROM pg_get_serial_sequence({name}, 'id') AS seq
+    """).format(
+        name=sql.Literal(MESSAGES_TABLE),
+        legacy=sql.Identifier(LEGACY_CHAT_HISTORY_TABLE),
+        table=sql.Identifier(MESSAGES_TABLE),
+    ))
+
+def message_to_row(message):
+    """(role, content, metadata JSON or None) of a LangChain message."""
+    role = CHUNK_ROLES.get(message.type, message.type)
+    content = message.content
+    metadata = {}
+    if not isinstance(content, str):
+        content = json.dumps(content)
+        metadata["json_content"] = True
+    usage = getattr(message, "usage_metadata", None)
+    if usage:
+        metadata["usage"] = {"input_tokens": usage.get("input_tokens", 0), "output_tokens": usage.get("output_tokens", 0)}
+    response_metadata = getattr(message, "response_metadata", None) or {}
+    for key in KEPT_RESPONSE_METADATA:
+        if response_metadata.get(key) is not None:
+            metadata[key] = response_metadata[key]
+    return role, content, json.dumps(metadata) if metadata else None
+
+def row_to_message(role, content, metadata=None):
+    """Rebuild the LangChain message of a stored row."""
+    metadata = metadata or {}
+    if metadata.get("json_content"):
+        content = json.loads(content)
+    response_metadata = {key: metadata[key] for key in KEPT_RESPONSE_METADATA if key in metadata}
+    if role == "ai":
+        usage = metadata.get("usage")
+        if usage:
+            usage = {**usage, "total_tokens": usage["input_tokens"] + usage["output_tokens"]}
+        return AIMessage(content=content, response_metadata=response_metadata, usage_metadata=usage)
+    if role in MESSAGE_CLASSES:
+        return MESSAGE_CLASSES[role](content=content, response_metadata=response_metadata)
+    return ChatMessage(role=role, content=content, response_metadata=response_metadata)
+
+def _legacy_row_sql():
+    # the same conversion as message_to_row(), done inside postgres so migration never round-trips rows
+    roles = sql.SQL(" ").join(
+        sql.SQL("WHEN {chunk} THEN {role}").format(chunk=sql.Literal(chunk), role=sql.Literal(role))
+        for chunk, role in CHUNK_ROLES.items()
+    )
+    kept = sql.SQL(", ").join(
+        sql.SQL("{key}, l.message -> 'data' -> 'response_metadata' -> {key}").format(key=sql.Literal(key))
+        for key in KEPT_RESPONSE_METADATA
+    )
+    return sql.SQL("""
+        l.id, l.session_id,
+        CASE l.message ->> 'type' {roles} ELSE l.message ->> 'type' END,
+        CASE jsonb_typeof(l.message -> 'data' -> 'content')
+            WHEN 'string' THEN l.message -> 'data' ->> 'content'
+            ELSE coalesce(l.message -> 'data' -> 'content', '""'::jsonb)::text
+        END,
+        nullif(jsonb_strip_nulls(jsonb_build_object(
+            'json_content', CASE WHEN jsonb_typeof(l.message -> 'data' -> 'content') <> 'string' THEN true END,
+            'usage', CASE WHEN jsonb_typeof(l.message -> 'data' -> 'usage_metadata') = 'object' THEN jsonb_build_object(
+                'input_tokens', coalesce((l.message -> 'data' -> 'usage_metadata' ->> 'input_tokens')::int, 0),
+                'output_tokens', coalesce((l.message -> 'data' -> 'usage_metadata' ->> 'output_tokens')::int, 0)
+            ) END,
+            {kept}
+        )), '{{}}'::jsonb),
+        l.created_at
+    """).format(roles=roles, kept=kept)
+
+def migrate_messages(conn, batch_size=MIGRATE_BATCH_SIZE, progress=None):
+    """Copy legacy chat_history rows into the messages table, keeping their ids.
+
+    Each batch is its own transaction. Rows already copied are skipped, so
+    the migration can be re-run. Legacy rows written after the messages
+    table took over can collide with the id of a new message; those are
+    copied under a new id and logged. Returns the number of rows copied.
+    """
+    names = dict(legacy=sql.Identifier(LEGACY_CHAT_HISTORY_TABLE), table=sql.Identifier(MESSAGES_TABLE))
+    upper_query = sql.SQL("SELECT max(id) FROM (SELECT id FROM {legacy} WHERE id > %s ORDER BY id LIMIT %s) batch").format(**names)
+    copy_query = sql.SQL("""
+        INSERT INTO {table} (id, session_id, role, content, metadata, created_at)
+        SELECT {row} FROM {legacy} l
+        WHERE l.id > %s AND l.id <= %s
+        ORDER BY l.id
+        ON CONFLICT (id) DO NOTHING
+    """).format(row=_legacy_row_sql(), **names)
+    # rows of the batch still missing after the copy lost their id to a new message (copies made by earlier runs match)
+    collided_query = sql.SQL("""
+        INSERT INTO {table} (session_id, role, content, metadata, created_at)
+        SELECT r.session_id, r.role, r.content, r.metadata, r.created_at
+        FROM (SELECT {row} FROM {legacy} l WHERE l.id > %s AND l.id <= %s)
+            AS r (id, session_id, role, content, metadata, created_at)
+        WHERE NOT EXISTS (
+            SELECT 1 FROM {table} t
+            WHERE t.session_id = r.session_id AND t.created_at = r.created_at
+              AND t.role = r.role AND t.content = r.content
+        )
+        ORDER BY r.id
+    """).format(row=_legacy_row_sql(), **names)
+    copied, collided, after_id = 0, 0, 0
+    while True:
+        with conn.cursor() as cursor:
+            cursor.execute(upper_query, (after_id, batch_size))
+            upper = cursor.fetchone()[0]
+            if upper is None:
+                break
+            cursor.execute(copy_query, (after_id, upper))
+            batch = cursor.rowcount
+            cursor.execute(collided_query, (after_id, upper))
+            collided += cursor.rowcount
+            batch += cursor.rowcount
+        conn.commit()
+        copied += batch
+        if progress is not None:
+            progress.add(messages=batch)
+        after_id = upper
+    reserve_legacy_ids(conn)  # in case the legacy table grew while this ran
+    conn.commit()
+    if collided:
+        logger.warning("%d legacy messages had ids already taken by new messages and were copied under new ids", collided)
+    return copied
+
+def storage_stats(conn, table):
+    """Rows, total bytes on disk (with TOAST and indexes) and average row bytes of a message table."""
+    row = conn.execute(sql.SQL("""
+        SELECT count(*), pg_total_relation_size({name}::regclass), coalesce(avg(pg_column_size(t.*)), 0)
+        FROM {table} t
+    """).format(name=sql.Literal(table), table=sql.Identifier(table))).fetchone()
+    rows, total_bytes, row_bytes = row
+    return {
+        "rows": rows,
+        "total_bytes": total_bytes,
+        "bytes_per_message": total_bytes / rows if rows else 0.0,
+        "avg_row_bytes": float(row_bytes),
+    }
+
+def main(argv=None):
+    from db.archive import Progress
+    from db.schema import ensure_schema
+
+    parser = argparse.ArgumentParser(description="Copy legacy chat_history messages into the compact messages table.")
+    parser.add_argument("--batch-size", type=int, default=MIGRATE_BATCH_SIZE, help="messages per transaction")
+    args = parser.parse_args(argv)
+
+    ensure_schema()
+    progress = Progress("migrate")
+    with get_connection() as conn:
+        if conn.execute("SELECT to_regclass(%s)", (LEGACY_CHAT_HISTORY_TABLE,)).fetchone()[0] is None:
+            print(f"No {LEGACY_CHAT_HISTORY_TABLE} table, nothing to migrate")
+            return 0
+        migrate_messages(conn, batch_size=args.batch_size, progress=progress)
+        progress.report()
+        for table in (LEGACY_CHAT_HISTORY_TABLE, MESSAGES_TABLE):
+            stats = storage_stats(conn, table)
+            print(f"{table}: {stats['rows']} messages, {stats['total_bytes'] / 1e6:.1f} MB, "
+                  f"{stats['bytes_per_message']:.0f} bytes/message")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+import json
+
+from psycopg import sql
+
+from db.sessions import SESSIONS_TABLE
+
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+SESSION_EVENTS_CHANNEL = os.getenv("SESSION_EVENTS_CHANNEL", "chat_session_events")
+
+CREATED = "created"
+TITLED = "title"
+DELETED = "deleted"
+
+def create_session_notify_trigger(conn):
+    """NOTIFY on session create, title change and delete, whichever process or job writes them.
+
+    Notifications are sent when the writing transaction commits. Counter and
+    activity updates on every message do not notify.
+    """
+    names = dict(
+        table=sql.Identifier(SESSIONS_TABLE),
+        function=sql.Identifier(f"{SESSIONS_TABLE}_notify"),
+        trigger=sql.Identifier(f"trg_{SESSIONS_TABLE}_notify"),
+        channel=sql.Literal(SESSION_EVENTS_CHANNEL),
+    )
+    conn.execute(sql.SQL("""
+        CREATE OR REPLACE FUNCTION {function}() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                PERFORM pg_notify({channel}, json_build_object('event', 'deleted', 'session_id', OLD.session_id)::text);
+                RETURN OLD;
+            ELSIF TG_OP = 'INSERT' THEN
+                PERFORM pg_notify({channel}, json_build_object('event', 'created', 'session_id', NEW.session_id,
+                                                               'title', left(NEW.title, 200))::text);
+            ELSIF NEW.title IS DISTINCT FROM OLD.title THEN
+                PERFORM pg_notify({channel}, json_build_object('event', 'title', 'session_id', NEW.session_id,
+                                                               'title', left(NEW.title, 200))::text);
+            END IF;
+            RETURN NEW;
+        END
+        $$
+    """).format(**names))
+    conn.execute(sql.SQL("""
+        CREATE OR REPLACE TRIGGER {trigger} AFTER INSERT OR DELETE OR UPDATE OF title ON {table}
+        FOR EACH ROW EXECUTE FUNCTION {function}()
+    """).format(**names))
+
+def parse_notification(payload) -> dict:
+    """Session event of a NOTIFY payload: {"event", "session_id"[, "title"]}."""
+    event = json.loads(payload)
+    event["session_id"] = str(event["session_id"])
+    return event
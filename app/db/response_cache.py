@@ -0,0 +1,93 @@
+from psycopg import sql
+
+from db.connection import get_pool, get_async_pool
+
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+RESPONSE_CACHE_TABLE = os.getenv("RESPONSE_CACHE_TABLE", "response_cache")
+RESPONSE_CACHE_EMBED_DIM = int(os.getenv("RESPONSE_CACHE_EMBED_DIM", "768"))  # must match the embedding model
+
+def create_response_cache_table(conn):
+    """Create the pgvector table and indexes of the semantic response cache."""
+    conn.execute("CREATE EXTENSION IF NOT EXISTS vector")
+    conn.execute(sql.SQL("""
+        CREATE TABLE IF NOT EXISTS {table} (
+            id BIGSERIAL PRIMARY KEY,
+            namespace TEXT NOT NULL,
+            prompt TEXT NOT NULL,
+            embedding vector({dim}) NOT NULL,
+            response TEXT NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            last_hit_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            hits INTEGER NOT NULL DEFAULT 0
+        )
+    """).format(table=sql.Identifier(RESPONSE_CACHE_TABLE), dim=sql.Literal(RESPONSE_CACHE_EMBED_DIM)))
+    conn.execute(sql.SQL("CREATE INDEX IF NOT EXISTS {index} ON {table} USING hnsw (embedding vector_cosine_ops)").format(
+        index=sql.Identifier(f"idx_{RESPONSE_CACHE_TABLE}_embedding"),
+        table=sql.Identifier(RESPONSE_CACHE_TABLE),
+    ))
+    conn.execute(sql.SQL("CREATE INDEX IF NOT EXISTS {index} ON {table} (last_hit_at)").format(
+        index=sql.Identifier(f"idx_{RESPONSE_CACHE_TABLE}_last_hit_at"),
+        table=sql.Identifier(RESPONSE_CACHE_TABLE),
+    ))
+
+def vector_literal(embedding) -> str:
+    return "[" + ",".join(repr(float(value)) for value in embedding) + "]"
+
+def _find_similar_query(namespace, embedding, threshold, ttl):
+    # nearest live neighbour in the namespace, counted as a hit only if it is similar enough
+    query = sql.SQL("""
+        WITH nearest AS (
+            SELECT id, response, 1 - (embedding <=> %(embedding)s::vector) AS similarity
+            FROM {table}
+            WHERE namespace = %(namespace)s AND created_at > NOW() - make_interval(secs => %(ttl)s)
+            ORDER BY embedding <=> %(embedding)s::vector
+            LIMIT 1
+        )
+        UPDATE {table} t SET hits = t.hits + 1, last_hit_at = NOW()
+        FROM nearest
+        WHERE t.id = nearest.id AND nearest.similarity >= %(threshold)s
+        RETURNING nearest.response, nearest.similarity
+    """).format(table=sql.Identifier(RESPONSE_CACHE_TABLE))
+    params = {"namespace": namespace, "embedding": vector_literal(embedding), "threshold": threshold, "ttl": ttl}
+    return query, params
+
+def _store_queries(namespace, prompt, embedding, response, max_entries, ttl):
+    table = sql.Identifier(RESPONSE_CACHE_TABLE)
+    insert = sql.SQL(
+        "INSERT INTO {table} (namespace, prompt, embedding, response) VALUES (%s, %s, %s::vector, %s)"
+    ).format(table=table)
+    # expire by age, then keep only the max_entries most recently hit rows
+    evict = sql.SQL("""
+        DELETE FROM {table}
+        WHERE created_at <= NOW() - make_interval(secs => %(ttl)s)
+           OR id IN (SELECT id FROM {table} ORDER BY last_hit_at DESC OFFSET %(max_entries)s)
+    """).format(table=table)
+    return [
+        (insert, (namespace, prompt, vector_literal(embedding), response)),
+        (evict, {"ttl": ttl, "max_entries": max_entries}),
+    ]
+
+def find_similar(namespace, embedding, threshold, ttl):
+    """Return (response, similarity) of the closest cached prompt above `threshold`, or None."""
+    with get_pool().connection() as conn:
+        return conn.execute(*_find_similar_query(namespace, embedding, threshold, ttl)).fetchone()
+
+async def afind_similar(namespace, embedding, threshold, ttl):
+    async with (await get_async_pool()).connection() as conn:
+        cursor = await conn.execute(*_find_similar_query(namespace, embedding, threshold, ttl))
+        return await cursor.fetchone()
+
+def store_response(namespace, prompt, embedding, response, max_entries, ttl):
+    """Insert a cached response and evict expired and least recently hit rows."""
+    with get_pool().connection() as conn:
+        for query, params in _store_queries(namespace, prompt, embedding, response, max_entries, ttl):
+            conn.execute(query, params)
+
+async def astore_response(namespace, prompt, embedding, response, max_entries, ttl):
+    async with (await get_async_pool()).connection() as conn:
+        for query, params in _store_queries(namespace, prompt, embedding, response, max_entries, ttl):
+            await conn.execute(query, params)
@@ -0,0 +1,79 @@
+import threading
+
+from db.connection import get_connection
+from db.messages import create_messages_table, MESSAGES_TABLE
+from db.sessions import create_sessions_table, add_summary_columns, SESSIONS_TABLE, SUMMARY_COLUMNS
+from db.notify import create_session_notify_trigger
+from db.response_cache import create_response_cache_table, RESPONSE_CACHE_TABLE
+from db.search import create_search_columns, create_search_indexes
+
+SCHEMA_LOCK_ID = 72430115  # advisory lock key, serializes schema setup across processes
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+def missing_schema(conn, response_cache=False) -> set:
+    """Names of the tables, columns ("table.column") and triggers the app needs that don't exist yet.
+
+    Only reads the catalog.
+    """
+    tables = [MESSAGES_TABLE, SESSIONS_TABLE] + ([RESPONSE_CACHE_TABLE] if response_cache else [])
+    columns = [f"{SESSIONS_TABLE}.{column}" for column in SUMMARY_COLUMNS]
+    triggers = [f"trg_{SESSIONS_TABLE}_notify", f"trg_{MESSAGES_TABLE}_content_tsv"]
+    present = {row[0] for row in conn.execute("""
+        SELECT name FROM unnest(%(tables)s::text[]) AS name WHERE to_regclass(quote_ident(name)) IS NOT NULL
+        UNION ALL
+        SELECT %(sessions)s || '.' || attname FROM pg_attribute
+        WHERE attrelid = to_regclass(quote_ident(%(sessions)s)) AND attname = ANY(%(columns)s::text[]) AND NOT attisdropped
+        UNION ALL
+        SELECT tgname FROM pg_trigger WHERE tgname = ANY(%(triggers)s::text[]) AND pg_table_is_visible(tgrelid)
+    """, {
+        "tables": tables, "sessions": SESSIONS_TABLE, "columns": list(SUMMARY_COLUMNS), "triggers": triggers,
+    }).fetchall()}
+    return set(tables + columns + triggers) - present
+
+def create_schema(conn, response_cache=False):
+    """Create the tables and triggers the app uses that are missing, on an autocommit connection.
+
+    Holds an advisory lock so API workers starting together don't race on
+    the same CREATE statements. Existing tables only get the columns they
+    lack. The search indexes are only built here for a new messages table;
+    on existing data `python -m db.search` builds them CONCURRENTLY,
+    outside of this lock.
+    """
+    conn.execute("SELECT pg_advisory_lock(%s)", (SCHEMA_LOCK_ID,))
+    try:
+        missing = missing_schema(conn, response_cache)
+        if MESSAGES_TABLE in missing:
+            create_messages_table(conn)
+        if SESSIONS_TABLE in missing:
+            create_sessions_table(conn)
+        elif any(f"{SESSIONS_TABLE}.{column}" in missing for column in SUMMARY_COLUMNS):
+            add_summary_columns(conn)
+        if f"trg_{SESSIONS_TABLE}_notify" in missing:
+            create_session_notify_trigger(conn)
+        if RESPONSE_CACHE_TABLE in missing:
+            create_response_cache_table(conn)
+        if f"trg_{MESSAGES_TABLE}_content_tsv" in missing:
+            create_search_columns(conn)
+            if MESSAGES_TABLE in missing:  # empty tables: a plain build is instant
+                create_search_indexes(conn, concurrently=False)
+    finally:
+        conn.execute("SELECT pg_advisory_unlock(%s)", (SCHEMA_LOCK_ID,))
+
+def ensure_schema(response_cache=False) -> bool:
+    """Create the schema once per process. Return whether this call created it."""
+    global _schema_ready
+    if _schema_ready:
+        return False
+    with _schema_lock:
+        if _schema_ready:
+            return False
+        with get_connection(autocommit=True) as conn:
+            if missing_schema(conn, response_cache):  # usually nothing: no DDL, no locks
+                create_schema(conn, response_cache)
+        _schema_ready = True
+    return True
+
+def schema_ready() -> bool:
+    return _schema_ready
@@ -0,0 +1,206 @@
+"""Full-text search over chat messages and session titles.
+
+The messages table gets a `content_tsv` tsvector column with a GIN index,
+filled by a trigger for new rows. Adding the column this way only changes the
+catalog; a STORED generated column would rewrite the whole table under an
+exclusive lock. Session titles are matched through an expression GIN index
+on the small sessions table.
+
+Run `python -m db.search` from the app/ directory to add the column and
+trigger, backfill existing messages in short batches and then build the
+indexes CONCURRENTLY (rebuilding any left invalid by an interrupted run).
+Reads and writes continue throughout. The app itself only creates the
+column and trigger when they are missing, and the indexes for a new table.
+"""
+from psycopg import sql
+
+from db.connection import get_connection, get_async_pool
+from db.messages import MESSAGES_TABLE
+from db.sessions import SESSIONS_TABLE
+
+from dotenv import load_dotenv
+import os
+import time
+
+load_dotenv()
+
+SEARCH_LANGUAGE = os.getenv("SEARCH_LANGUAGE", "english")  # postgres text search configuration
+SEARCH_MAX_CANDIDATES = int(os.getenv("SEARCH_MAX_CANDIDATES", "5000"))  # newest matching messages ranked per query
+SEARCH_BACKFILL_BATCH = int(os.getenv("SEARCH_BACKFILL_BATCH", "5000"))
+TITLE_RANK_WEIGHT = 2.0  # a title match counts more than one message match
+
+HIGHLIGHT_OPTIONS = "StartSel=**, StopSel=**, MaxWords=24, MinWords=8, MaxFragments=2, FragmentDelimiter=\" … \""
+
+def _names():
+    return dict(
+        history=sql.Identifier(MESSAGES_TABLE),
+        sessions=sql.Identifier(SESSIONS_TABLE),
+        config=sql.Literal(SEARCH_LANGUAGE),
+        function=sql.Identifier(f"{MESSAGES_TABLE}_content_tsv"),
+        trigger=sql.Identifier(f"trg_{MESSAGES_TABLE}_content_tsv"),
+        content_index=sql.Identifier(f"idx_{MESSAGES_TABLE}_content_tsv"),
+        title_index=sql.Identifier(f"idx_{SESSIONS_TABLE}_title_tsv"),
+    )
+
+def _content_tsv(row):
+    return sql.SQL("to_tsvector({config}::regconfig, {row}.content)").format(
+        config=sql.Literal(SEARCH_LANGUAGE), row=sql.SQL(row)
+    )
+
+def _title_tsv(row):
+    return sql.SQL("to_tsvector({config}::regconfig, coalesce({row}.title, ''))").format(
+        config=sql.Literal(SEARCH_LANGUAGE), row=sql.SQL(row)
+    )
+
+def create_search_columns(conn):
+    """Add the tsvector column and the trigger that fills it on insert. Both are catalog-only changes."""
+    names = _names()
+    conn.execute(sql.SQL("ALTER TABLE {history} ADD COLUMN IF NOT EXISTS content_tsv tsvector").format(**names))
+    conn.execute(sql.SQL("""
+        CREATE OR REPLACE FUNCTION {function}() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            NEW.content_tsv := {content_tsv};
+            RETURN NEW;
+        END
+        $$
+    """).format(content_tsv=_content_tsv("NEW"), **names))
+    conn.execute(sql.SQL("""
+        CREATE OR REPLACE TRIGGER {trigger} BEFORE INSERT OR UPDATE OF content ON {history}
+        FOR EACH ROW EXECUTE FUNCTION {function}()
+    """).format(**names))
+
+def invalid_search_indexes(conn) -> list:
+    """Search indexes left INVALID by an interrupted concurrent build, which IF NOT EXISTS would keep."""
+    names = [f"idx_{MESSAGES_TABLE}_content_tsv", f"idx_{SESSIONS_TABLE}_title_tsv"]
+    rows = conn.execute("""
+        SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = ANY(%s) AND NOT i.indisvalid AND pg_table_is_visible(c.oid)
+    """, (names,)).fetchall()
+    return [row[0] for row in rows]
+
+def create_search_indexes(conn, concurrently=True):
+    """Build the GIN indexes, CONCURRENTLY unless the tables are new; `conn` must be in autocommit mode."""
+    names = _names()
+    if concurrently:
+        for index in invalid_search_indexes(conn):
+            conn.execute(sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {index}").format(index=sql.Identifier(index)))
+    names["concurrently"] = sql.SQL("CONCURRENTLY" if concurrently else "")
+    conn.execute(sql.SQL(
+        "CREATE INDEX {concurrently} IF NOT EXISTS {content_index} ON {history} USING gin (content_tsv)"
+    ).format(**names))
+    conn.execute(sql.SQL(
+        "CREATE INDEX {concurrently} IF NOT EXISTS {title_index} ON {sessions} USING gin ({title_tsv})"
+    ).format(title_tsv=_title_tsv(SESSIONS_TABLE), **names))
+
+def backfill_search(conn, batch_size=SEARCH_BACKFILL_BATCH, progress=None):
+    """Fill content_tsv for messages stored before the trigger existed, in id order.
+
+    Each batch is its own short transaction on an autocommit connection, so
+    only the rows of one batch are locked at a time. Returns the number of
+    rows updated.
+    """
+    query = sql.SQL("""
+        WITH batch AS (
+            SELECT id FROM {history}
+            WHERE id > %(after_id)s AND content_tsv IS NULL
+            ORDER BY id
+            LIMIT %(batch_size)s
+        )
+        UPDATE {history} h SET content_tsv = {content_tsv}
+        FROM batch WHERE h.id = batch.id
+        RETURNING h.id
+    """).format(content_tsv=_content_tsv("h"), **_names())
+    updated, after_id = 0, 0
+    while True:
+        ids = [row[0] for row in conn.execute(query, {"after_id": after_id, "batch_size": batch_size}).fetchall()]
+        if not ids:
+            return updated
+        updated += len(ids)
+        after_id = max(ids)
+        if progress is not None:
+            progress(updated)
+
+def _search_query(query, limit, before):
+    before_rank, before_id = before if before else (None, None)
+    statement = sql.SQL("""
+        WITH q AS (SELECT websearch_to_tsquery({config}::regconfig, %(query)s) AS query),
+        candidates AS (
+            SELECT h.session_id, h.content_tsv
+            FROM {history} h, q
+            WHERE h.content_tsv @@ q.query
+            ORDER BY h.id DESC
+            LIMIT %(max_candidates)s
+        ),
+        hits AS (
+            SELECT c.session_id, ts_rank_cd(c.content_tsv, q.query) AS rank, 1 AS matches
+            FROM candidates c, q
+            UNION ALL
+            SELECT s.session_id, ts_rank_cd({title_tsv}, q.query) * %(title_weight)s, 0
+            FROM {sessions} s, q
+            WHERE {title_tsv} @@ q.query
+        ),
+        ranked AS (
+            SELECT session_id, max(rank)::real AS rank, sum(matches) AS matches
+            FROM hits
+            GROUP BY session_id
+        )
+        SELECT r.session_id, s.title, s.last_activity, r.rank, r.matches
+        FROM ranked r
+        JOIN {sessions} s ON s.session_id = r.session_id
+        WHERE %(before_rank)s::real IS NULL OR (r.rank, r.session_id) < (%(before_rank)s::real, %(before_id)s::uuid)
+        ORDER BY r.rank DESC, r.session_id DESC
+        LIMIT %(limit)s
+    """).format(title_tsv=_title_tsv("s"), **_names())
+    params = {
+        "query": query, "max_candidates": SEARCH_MAX_CANDIDATES, "title_weight": TITLE_RANK_WEIGHT,
+        "before_rank": before_rank, "before_id": before_id, "limit": limit,
+    }
+    return statement, params
+
+def _snippets_query(query, session_ids, per_session):
+    statement = sql.SQL("""
+        WITH q AS (SELECT websearch_to_tsquery({config}::regconfig, %(query)s) AS query)
+        SELECT session_id, id, role, ts_headline({config}::regconfig, content, q.query, %(options)s)
+        FROM (
+            SELECT h.session_id, h.id, h.role, h.content,
+                   row_number() OVER (PARTITION BY h.session_id ORDER BY ts_rank_cd(h.content_tsv, q.query) DESC, h.id DESC) AS n
+            FROM {history} h, q
+            WHERE h.session_id = ANY(%(session_ids)s::uuid[]) AND h.content_tsv @@ q.query
+        ) best, q
+        WHERE n <= %(per_session)s
+        ORDER BY session_id, n
+    """).format(**_names())
+    params = {"query": query, "options": HIGHLIGHT_OPTIONS, "session_ids": session_ids, "per_session": per_session}
+    return statement, params
+
+async def asearch_sessions(query, limit=20, before=None, snippets=2):
+    """Sessions whose messages or title match `query` (websearch syntax), best match first.
+
+    Each result has the session's title, rank, number of matching messages
+    and up to `snippets` highlighted fragments (matches wrapped in **), best
+    first. Pass (rank, session_id) of the last result as `before` for the
+    next page.
+    """
+    async with (await get_async_pool()).connection() as conn:
+        cursor = await conn.execute(*_search_query(query, limit, before))
+        rows = await cursor.fetchall()
+        results = [
+            {"session_id": str(session_id), "title": title, "last_activity": last_activity,
+             "rank": rank, "matches": matches, "snippets": []}
+            for session_id, title, last_activity, rank, matches in rows
+        ]
+        if results and snippets:
+            by_session = {result["session_id"]: result for result in results}
+            cursor = await conn.execute(*_snippets_query(query, list(by_session), snippets))
+            for session_id, message_id, message_type, snippet in await cursor.fetchall():
+                by_session[str(session_id)]["snippets"].append({"id": message_id, "type": message_type, "text": snippet})
+    return results
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    with get_connection(autocommit=True) as conn:
+        create_search_columns(conn)
+        count = backfill_search(conn, progress=lambda done: print(f"  {done} messages indexed", flush=True))
+        print(f"Backfilled search vectors of {count} messages in {time.perf_counter() - start:.2f}s, building indexes...")
+        create_search_indexes(conn)
+    print(f"Search ready in {time.perf_counter() - start:.2f}s")
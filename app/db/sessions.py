@@ -0,0 +1,177 @@
+"""Denormalized per-session summary table.
+
+One row per session holding its title, activity timestamps, message count
+and token totals. Rows are kept current by the history layer on every
+append (see db.history), so listing sessions never has to aggregate
+the messages table.
+
+Run `python -m db.sessions` from the app/ directory to create the table and
+backfill it from the messages table and the legacy session_titles table.
+"""
+from psycopg import sql
+
+from db.connection import get_pool
+
+from dotenv import load_dotenv
+import os
+import time
+
+load_dotenv()
+
+SESSIONS_TABLE = os.getenv("SESSIONS_TABLE", "sessions")
+MESSAGES_TABLE = os.getenv("MESSAGES_TABLE", "chat_messages")
+LEGACY_SESSION_TITLES_TABLE = os.getenv("SESSION_TITLES_TABLE", "session_titles")
+
+def create_sessions_table(conn):
+    """Create the sessions table and its listing index if they don't exist."""
+    conn.execute(sql.SQL("""
+        CREATE TABLE IF NOT EXISTS {table} (
+            session_id UUID PRIMARY KEY,
+            title TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            last_activity TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            message_count INTEGER NOT NULL DEFAULT 0,
+            prompt_tokens BIGINT NOT NULL DEFAULT 0,
+            completion_tokens BIGINT NOT NULL DEFAULT 0,
+            -- rolling summary of older turns, see core.context
+            summary TEXT,
+            summary_message_count INTEGER NOT NULL DEFAULT 0
+        )
+    """).format(table=sql.Identifier(SESSIONS_TABLE)))
+    conn.execute(sql.SQL(
+        "CREATE INDEX IF NOT EXISTS {index} ON {table} (last_activity DESC, session_id DESC)"
+    ).format(
+        index=sql.Identifier(f"idx_{SESSIONS_TABLE}_last_activity"),
+        table=sql.Identifier(SESSIONS_TABLE),
+    ))
+
+# columns added after the table was first released, see add_summary_columns()
+SUMMARY_COLUMNS = ("summary", "summary_message_count")
+
+def add_summary_columns(conn):
+    """Add the summary columns to a sessions table created before they existed.
+
+    Only run when they are missing (see db.schema.missing_schema): the ALTER
+    takes an ACCESS EXCLUSIVE lock, though only briefly, since neither
+    column needs a table rewrite.
+    """
+    conn.execute(sql.SQL("""
+        ALTER TABLE {table}
+            ADD COLUMN IF NOT EXISTS summary TEXT,
+            ADD COLUMN IF NOT EXISTS summary_message_count INTEGER NOT NULL DEFAULT 0
+    """).format(table=sql.Identifier(SESSIONS_TABLE)))
+
+def token_totals(messages):
+    """Sum prompt and completion tokens from the messages' usage metadata."""
+    prompt_tokens = completion_tokens = 0
+    for message in messages:
+        usage = getattr(message, "usage_metadata", None) or {}
+        prompt_tokens += usage.get("input_tokens", 0)
+        completion_tokens += usage.get("output_tokens", 0)
+    return prompt_tokens, completion_tokens
+
+def _record_messages_query(session_id, messages):
+    prompt_tokens, completion_tokens = token_totals(messages)
+    query = sql.SQL("""
+        INSERT INTO {table} AS s (session_id, message_count, prompt_tokens, completion_tokens)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (session_id) DO UPDATE SET
+            last_activity = NOW(),
+            message_count = s.message_count + EXCLUDED.message_count,
+            prompt_tokens = s.prompt_tokens + EXCLUDED.prompt_tokens,
+            completion_tokens = s.completion_tokens + EXCLUDED.completion_tokens
+    """).format(table=sql.Identifier(SESSIONS_TABLE))
+    return query, (session_id, len(messages), prompt_tokens, completion_tokens)
+
+def record_messages(cursor, session_id, messages):
+    """Bump the session's counters for newly appended messages.
+
+    Must run in the same transaction as the message insert.
+    """
+    cursor.execute(*_record_messages_query(session_id, messages))
+
+async def arecord_messages(cursor, session_id, messages):
+    """Async record_messages() for an async cursor."""
+    await cursor.execute(*_record_messages_query(session_id, messages))
+
+def record_batch(cursor, messages_by_session):
+    """record_messages() for many sessions in one executemany.
+
+    Sessions are updated in id order, so concurrent batches don't deadlock.
+    """
+    queries = [_record_messages_query(session_id, messages) for session_id, messages in sorted(messages_by_session.items())]
+    cursor.executemany(queries[0][0], [params for _, params in queries])
+
+def _delete_session_row_query():
+    return sql.SQL("DELETE FROM {table} WHERE session_id = %s").format(table=sql.Identifier(SESSIONS_TABLE))
+
+def delete_session_row(cursor, session_id):
+    cursor.execute(_delete_session_row_query(), (session_id,))
+
+async def adelete_session_row(cursor, session_id):
+    await cursor.execute(_delete_session_row_query(), (session_id,))
+
+def get_session_summary(session_id):
+    """Return (summary, number of messages it covers) for a session."""
+    with get_pool().connection() as conn:
+        row = conn.execute(
+            sql.SQL("SELECT summary, summary_message_count FROM {table} WHERE session_id = %s").format(
+                table=sql.Identifier(SESSIONS_TABLE)
+            ),
+            (session_id,)
+        ).fetchone()
+    return (row[0], row[1]) if row else (None, 0)
+
+def store_session_summary(session_id, summary, message_count):
+    with get_pool().connection() as conn:
+        conn.execute(
+            sql.SQL("UPDATE {table} SET summary = %s, summary_message_count = %s WHERE session_id = %s").format(
+                table=sql.Identifier(SESSIONS_TABLE)
+            ),
+            (summary, message_count, session_id)
+        )
+
+def backfill_sessions(conn):
+    """Populate the sessions table from the messages table and the legacy titles table.
+
+    Idempotent: counters are recomputed from the messages and existing titles
+    are kept. Returns the number of session rows written.
+    """
+    create_sessions_table(conn)
+    cursor = conn.cursor()
+    cursor.execute("SELECT to_regclass(%s)", (LEGACY_SESSION_TITLES_TABLE,))
+    has_legacy_titles = cursor.fetchone()[0] is not None
+
+    usage = sql.SQL("h.metadata -> 'usage'")
+    cursor.execute(sql.SQL("""
+        INSERT INTO {table} AS s (session_id, created_at, last_activity, message_count, prompt_tokens, completion_tokens)
+        SELECT h.session_id, MIN(h.created_at), MAX(h.created_at), COUNT(*),
+               COALESCE(SUM(({usage} ->> 'input_tokens')::bigint), 0),
+               COALESCE(SUM(({usage} ->> 'output_tokens')::bigint), 0)
+        FROM {history} h
+        GROUP BY h.session_id
+        ON CONFLICT (session_id) DO UPDATE SET
+            created_at = EXCLUDED.created_at,
+            last_activity = EXCLUDED.last_activity,
+            message_count = EXCLUDED.message_count,
+            prompt_tokens = EXCLUDED.prompt_tokens,
+            completion_tokens = EXCLUDED.completion_tokens
+    """).format(table=sql.Identifier(SESSIONS_TABLE), history=sql.Identifier(MESSAGES_TABLE), usage=usage))
+    written = cursor.rowcount
+
+    if has_legacy_titles:
+        cursor.execute(sql.SQL("""
+            UPDATE {table} s SET title = t.title
+            FROM {titles} t
+            WHERE t.session_id = s.session_id AND s.title IS NULL
+        """).format(table=sql.Identifier(SESSIONS_TABLE), titles=sql.Identifier(LEGACY_SESSION_TITLES_TABLE)))
+
+    conn.commit()
+    cursor.close()
+    return written
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    with get_pool().connection() as conn:
+        count = backfill_sessions(conn)
+    print(f"Backfilled {count} sessions into {SESSIONS_TABLE} in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,300 @@
+import asyncio
+import atexit
+import json
+from collections import defaultdict, deque
+from datetime import datetime, timezone
+import logging
+import threading
+import time
+
+import psycopg
+from psycopg import sql
+
+from db.connection import get_pool
+from db.messages import MESSAGES_TABLE, message_to_row
+from db.sessions import record_batch
+from core.metrics import histogram, register_collector
+
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "1") == "1"
+WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", "0.1"))  # seconds a message waits for others to batch with
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "500"))  # messages per COPY and transaction
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "10000"))  # writers wait once this many are queued
+WRITE_BEHIND_RETRY = float(os.getenv("WRITE_BEHIND_RETRY", "1"))  # seconds before retrying a failed batch
+WRITE_BEHIND_MAX_RETRIES = int(os.getenv("WRITE_BEHIND_MAX_RETRIES", "60"))  # then the batch goes to the dead-letter log
+WRITE_BEHIND_DEAD_LETTER = os.getenv("WRITE_BEHIND_DEAD_LETTER", "write_behind_dead_letter.jsonl")  # empty: only log them
+WRITE_BEHIND_REPLY_TIMEOUT = float(os.getenv("WRITE_BEHIND_REPLY_TIMEOUT", "5"))  # multi-worker API: wait for a turn's commit
+WRITE_BEHIND_SHUTDOWN_TIMEOUT = float(os.getenv("WRITE_BEHIND_SHUTDOWN_TIMEOUT", "30"))
+
+# connection losses, pool timeouts, serialization failures and deadlocks: the same batch can succeed later
+TRANSIENT_ERRORS = (psycopg.OperationalError,)
+
+BATCH_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+WRITE_BEHIND_BATCH_MESSAGES = histogram("write_behind_batch_messages", "Messages written per write-behind batch.", BATCH_BUCKETS)
+WRITE_BEHIND_LAG_SECONDS = histogram("write_behind_lag_seconds", "Time from queuing a message to its commit.")
+
+class PendingMessage:
+    """A queued message. `id` is set once it is committed."""
+    __slots__ = ("session_id", "message", "row", "created_at", "queued_at", "seq", "reserved_id", "id")
+
+    def __init__(self, session_id, message, seq):
+        self.session_id = session_id
+        self.message = message
+        self.row = message_to_row(message)
+        self.created_at = datetime.now(timezone.utc)
+        self.queued_at = time.monotonic()
+        self.seq = seq
+        self.reserved_id = None  # taken from the id sequence by the latest write attempt
+        self.id = None
+
+class MessageWriter:
+    """Write-behind queue for chat messages.
+
+    put() returns as soon as the messages are queued. A background thread
+    writes them in batches across sessions: one COPY into the messages
+    table plus the sessions-table counters, in one transaction, every
+    `interval` seconds or `batch_size` messages. Failed batches are retried
+    in order, up to `max_retries` times while Postgres is unreachable. A
+    batch Postgres rejects (say, a NUL character in a message) is split
+    until the offending messages are found; those go to the dead-letter
+    log and the rest is committed. Until a message is committed, pending()
+    returns it, so the session that wrote it reads it back (see
+    db.history). flush() waits for everything queued so far to be
+    committed or dead-lettered.
+    """
+
+    def __init__(self, pool=None, table=MESSAGES_TABLE, interval=WRITE_BEHIND_INTERVAL,
+                 batch_size=WRITE_BEHIND_BATCH_SIZE, max_pending=WRITE_BEHIND_MAX_PENDING, retry_delay=WRITE_BEHIND_RETRY,
+                 max_retries=WRITE_BEHIND_MAX_RETRIES, dead_letter=WRITE_BEHIND_DEAD_LETTER):
+        self._pool = pool
+        self._table = table
+        self._interval = interval
+        self._batch_size = batch_size
+        self._max_pending = max_pending
+        self._retry_delay = retry_delay
+        self._max_retries = max_retries
+        self._dead_letter = dead_letter
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._queue = deque()
+        self._by_session = defaultdict(list)  # queued and in-flight messages per session
+        self._seq = self._committed = 0
+        self._flush_requested = self._stopping = False
+        self._thread = None
+        self._pid = None
+        self.stats = {"queued": 0, "written": 0, "batches": 0, "errors": 0, "waits": 0, "dead_letters": 0}
+
+    def _ensure_started(self):
+        # called with the lock held; a forked child starts its own thread
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        self._stopping = False
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name="message-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, session_id, messages):
+        """Queue messages of a session. Blocks only while `max_pending` messages are already queued."""
+        with self._changed:
+            self._ensure_started()
+            if len(self._queue) >= self._max_pending:
+                self.stats["waits"] += 1
+                self._flush_requested = True
+                self._changed.notify_all()
+                self._changed.wait_for(lambda: len(self._queue) < self._max_pending)
+            for message in messages:
+                self._seq += 1
+                pending = PendingMessage(session_id, message, self._seq)
+                self._queue.append(pending)
+                self._by_session[session_id].append(pending)
+            self.stats["queued"] += len(messages)
+            self._changed.notify_all()
+
+    async def aput(self, session_id, messages):
+        if self.full():
+            await asyncio.to_thread(self.put, session_id, messages)
+        else:
+            self.put(session_id, messages)
+
+    def full(self) -> bool:
+        return len(self._queue) >= self._max_pending
+
+    def pending(self, session_id) -> list:
+        """Messages of the session not committed yet, oldest first."""
+        with self._lock:
+            return list(self._by_session.get(session_id, ()))
+
+    def flush(self, timeout=None) -> bool:
+        """Wait until every message queued before the call is committed. Return False on timeout."""
+        with self._changed:
+            target = self._seq
+            if self._committed >= target:
+                return True
+            self._ensure_started()
+            self._flush_requested = True
+            self._changed.notify_all()
+            return self._changed.wait_for(lambda: self._committed >= target, timeout)
+
+    async def aflush(self, timeout=None) -> bool:
+        if self._committed >= self._seq:
+            return True
+        return await asyncio.to_thread(self.flush, timeout)
+
+    def close(self, timeout=WRITE_BEHIND_SHUTDOWN_TIMEOUT) -> bool:
+        """Flush and stop the writer thread. Return False if messages were left unwritten."""
+        if self._thread is None:
+            return True
+        flushed = self.flush(timeout)
+        if not flushed:
+            logger.error("Shutting down with %d chat messages not written", len(self._queue))
+        with self._changed:
+            self._stopping = True
+            self._changed.notify_all()
+        return flushed
+
+    def backlog(self) -> int:
+        """Messages queued or being written, not committed yet."""
+        return self._seq - self._committed
+
+    def lag(self) -> float:
+        """Seconds the oldest uncommitted message has been waiting."""
+        with self._lock:
+            oldest = min((messages[0].queued_at for messages in self._by_session.values() if messages), default=None)
+        return time.monotonic() - oldest if oldest is not None else 0.0
+
+    def _ready(self):
+        if self._stopping or self._flush_requested or len(self._queue) >= self._batch_size:
+            return True
+        return bool(self._queue) and time.monotonic() - self._queue[0].queued_at >= self._interval
+
+    def _next_batch(self):
+        with self._changed:
+            while not self._ready():
+                wait = self._interval - (time.monotonic() - self._queue[0].queued_at) if self._queue else None
+                self._changed.wait(wait)
+            if not self._queue:
+                self._flush_requested = False
+                return None
+            count = min(len(self._queue), self._batch_size)
+            batch = [self._queue.popleft() for _ in range(count)]
+            if not self._queue:
+                self._flush_requested = False
+            self._changed.notify_all()  # room for writers waiting on max_pending
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                if self._stopping:
+                    return
+                continue
+            self._committed_batch(batch, self._write_or_split(batch))
+
+    def _write_or_split(self, batch):
+        """Write the batch, retrying transient errors. Returns the messages that were dead-lettered instead."""
+        retries = 0
+        while True:
+            try:
+                self._write(batch)
+                return []
+            except TRANSIENT_ERRORS as e:  # keep the batch: it is retried in order, and still read back meanwhile
+                self.stats["errors"] += 1
+                retries += 1
+                if retries > self._max_retries:
+                    self._dead_letter_messages(batch, e)
+                    return batch
+                logger.warning("Writing %d chat messages failed, retrying: %s", len(batch), e)
+                time.sleep(self._retry_delay)
+            except Exception as e:  # rejected data fails the same way every time: isolate it
+                self.stats["errors"] += 1
+                if len(batch) == 1:
+                    self._dead_letter_messages(batch, e)
+                    return batch
+                middle = len(batch) // 2
+                return self._write_or_split(batch[:middle]) + self._write_or_split(batch[middle:])
+
+    def _dead_letter_messages(self, messages, error):
+        self.stats["dead_letters"] += len(messages)
+        logger.error("Dropping %d chat messages that could not be written: %s", len(messages), error)
+        if not self._dead_letter:
+            return
+        try:
+            with open(self._dead_letter, "a") as f:
+                for pending in messages:
+                    role, content, metadata = pending.row
+                    f.write(json.dumps({
+                        "session_id": str(pending.session_id), "role": role, "content": content,
+                        "metadata": metadata and json.loads(metadata), "created_at": pending.created_at.isoformat(),
+                        "error": str(error),
+                    }) + "\n")
+        except OSError:
+            logger.exception("Writing the dead-letter log %s failed", self._dead_letter)
+
+    def _write(self, batch):
+        pool = self._pool or get_pool()
+        with pool.connection() as conn:
+            with conn.cursor() as cursor:
+                if batch[0].reserved_id is not None and self._stored(cursor, batch):
+                    return  # the commit of an earlier attempt went through, only its reply was lost
+                # ids in queue order, so each session's messages keep their order
+                cursor.execute(
+                    "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+                    (self._table, len(batch)),
+                )
+                for pending, message_id in zip(batch, sorted(row[0] for row in cursor.fetchall())):
+                    pending.reserved_id = message_id
+                copy_query = sql.SQL("COPY {table} (id, session_id, role, content, metadata, created_at) FROM STDIN").format(
+                    table=sql.Identifier(self._table)
+                )
+                with cursor.copy(copy_query) as copy:
+                    for pending in batch:
+                        copy.write_row((pending.reserved_id, pending.session_id, *pending.row, pending.created_at))
+                by_session = defaultdict(list)
+                for pending in batch:
+                    by_session[pending.session_id].append(pending.message)
+                record_batch(cursor, by_session)
+            conn.commit()
+
+    def _stored(self, cursor, batch):
+        cursor.execute(sql.SQL("SELECT count(*) FROM {table} WHERE id = ANY(%s)").format(table=sql.Identifier(self._table)),
+                       ([pending.reserved_id for pending in batch],))
+        return cursor.fetchone()[0] == len(batch)
+
+    def _committed_batch(self, batch, dead=()):
+        now = time.monotonic()
+        for pending in batch:
+            if pending in dead:
+                continue
+            pending.id = pending.reserved_id
+            WRITE_BEHIND_LAG_SECONDS.observe(now - pending.queued_at)
+        WRITE_BEHIND_BATCH_MESSAGES.observe(len(batch) - len(dead))
+        with self._changed:
+            for pending in batch:
+                messages = self._by_session[pending.session_id]
+                messages.remove(pending)
+                if not messages:
+                    del self._by_session[pending.session_id]
+            self._committed = batch[-1].seq
+            self.stats["written"] += len(batch) - len(dead)
+            self.stats["batches"] += 1
+            self._changed.notify_all()
+
+MESSAGE_WRITER = MessageWriter()
+
+atexit.register(MESSAGE_WRITER.close)  # durable on a normal exit, even without an explicit close()
+
+def _message_writer_metrics():
+    yield ("write_behind_pending_messages", "Chat messages queued and not committed yet.", {}, MESSAGE_WRITER.backlog())
+    yield ("write_behind_oldest_pending_seconds", "Age of the oldest uncommitted chat message.", {}, MESSAGE_WRITER.lag())
+    for key, value in MESSAGE_WRITER.stats.items():
+        yield (f"write_behind_{key}", f"Write-behind {key} since startup.", {}, value)
+
+register_collector(_message_writer_metrics)
@@ -1,51 +1,143 @@
 import streamlit as st
-from services.chat import get_response_stream, get_chat_history, list_sessions, delete_chat
-from services.chat_sessions import create_session_title, get_session_title, get_session_title_sync, rename_session, delete_session_title
-import uuid
-import asyncio
-from concurrent.futures import ThreadPoolExecutor
-
-# initialize thread pool for async operations
-thread_pool = ThreadPoolExecutor()
-
-def run_async(coro):
-    """Run an async function in a new event loop."""
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    try:
-        return loop.run_until_complete(coro)
-    finally:
-        loop.close()
+from services.api_client import API_CLIENT, ApiBusy, ApiError
+from services.session_events import SessionEventHub, SessionEventListener, RESYNC
+from core.streaming import coalesce
+
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+# must be the first Streamlit command of every run
+st.set_page_config(
+    page_title="Ollama Chatbot",
+)
+
+HISTORY_RENDER_WINDOW = int(os.getenv("HISTORY_RENDER_WINDOW", "20"))  # messages rendered per rerun
+SESSION_EVENTS_POLL = float(os.getenv("SESSION_EVENTS_POLL", "2"))  # seconds between checks for session changes
+
+@st.cache_resource(show_spinner=False)
+def session_event_hub():
+    """One subscription to the API's session events per UI process, shared by every browser tab."""
+    return SessionEventListener(SessionEventHub(), API_CLIENT.session_events).start().hub
 
 def create_new_session():
     st.session_state["session_id"] = None
     st.session_state["history"] = []
+    st.session_state["messages_cursor"] = None
+    st.session_state["render_window"] = HISTORY_RENDER_WINDOW
 
-async def delete_session(session_id): # delete session history and session title on the backend asynchronously
-    delete_chat(session_id)
+def delete_session(session_id): # delete session history and session title through the api
+    API_CLIENT.delete_session(session_id)
     if session_id == st.session_state["session_id"]:
-        st.session_state["session_id"] = None
-    st.session_state["history"] = [] 
-    await delete_session_title(session_id)
+        create_new_session()
+
+def stop_reply(session_id):
+    # the click also reruns the script, which drops the stream; cancelling first records it as a user stop
+    API_CLIENT.cancel(session_id)
+
+def stream_reply(session_id, user_input):
+    """Stream the assistant reply. Return False if the model is too busy to take the request."""
+    st.button("Stop", key="stop_reply", on_click=stop_reply, args=(session_id,))
+    try:
+        # batch tokens so the reply is redrawn a few times per second, not once per token
+        st.write_stream(coalesce(API_CLIENT.stream_reply(session_id, user_input)))
+        return True
+    except ApiBusy:
+        st.warning("The assistant is busy right now. Please try again in a moment.")
+        return False
+    except ApiError:
+        st.error("Something went wrong while generating the reply.")
+        return False
+
+def api_unavailable():
+    """End this run with an error instead of a traceback when the chat API cannot answer."""
+    st.error("The chat service is unavailable right now. Please try again in a moment.")
+    st.stop()
+
+def load_more_sessions():
+    """Fetch the next page of older sessions into the sidebar."""
+    page = API_CLIENT.list_sessions(before=st.session_state["sessions_cursor"])
+    st.session_state["older_sessions"] += page["sessions"]
+    st.session_state["sessions_cursor"] = page["next"]
+
+def open_session(session_id):
+    create_new_session()
+    st.session_state["session_id"] = session_id
+
+def run_search():
+    """Search messages and titles for the sidebar query; an empty query shows the chat list again."""
+    query = st.session_state["search_query"].strip()
+    page = API_CLIENT.search(query) if query else {"results": [], "next": None}
+    st.session_state["search_results"] = page["results"]
+    st.session_state["search_cursor"] = page["next"]
+
+def load_more_results():
+    page = API_CLIENT.search(st.session_state["search_query"].strip(), before=st.session_state["search_cursor"])
+    st.session_state["search_results"] += page["results"]
+    st.session_state["search_cursor"] = page["next"]
+
+def apply_session_events(events, complete):
+    """Patch the cached older sidebar pages with session events from other tabs and replicas."""
+    if not complete or any(event["event"] == RESYNC for event in events):
+        del st.session_state["older_sessions"]  # missed some: reload them from the first page's cursor
+        return
+    for event in events:
+        if event["event"] == "deleted":
+            st.session_state["older_sessions"] = [
+                s for s in st.session_state["older_sessions"] if s["session_id"] != event["session_id"]
+            ]
+            if event["session_id"] == st.session_state["session_id"]:
+                create_new_session()
+        elif event["event"] == "title":
+            for s in st.session_state["older_sessions"]:
+                if s["session_id"] == event["session_id"]:
+                    s["title"] = event["title"]
 
-async def update_session_title(session_id: str, messages: str):
-    """Update session title asynchronously."""
-    new_title = await rename_session(session_id, messages)
-    if new_title:
-        return new_title
-    return None
+@st.fragment(run_every=SESSION_EVENTS_POLL)
+def watch_session_events():
+    """Redraw the page when sessions changed elsewhere. Only checks this process's event buffer, no requests."""
+    hub = session_event_hub()
+    events, complete = hub.since(st.session_state["events_version"])
+    if not events and complete:
+        return
+    st.session_state["events_version"] = events[-1]["version"] if events else hub.version
+    apply_session_events(events, complete)
+    st.rerun()  # the first sidebar page is re-read on every run, which picks up new sessions and titles
 
-# session management
-if "sessions" not in st.session_state:
-    st.session_state["sessions"] = [str(session_id) for session_id in list_sessions()]
+def show_earlier_messages():
+    st.session_state["render_window"] += HISTORY_RENDER_WINDOW
+
+def load_older_messages():
+    """Fetch the page of messages before the oldest one shown."""
+    page = API_CLIENT.get_messages(st.session_state["session_id"], before=st.session_state["messages_cursor"])
+    st.session_state["history"] = page["messages"] + st.session_state["history"]
+    st.session_state["messages_cursor"] = page["next_before"]
+    st.session_state["render_window"] += len(page["messages"])
+
+# session management: the first page is re-read on every rerun (one query) so new titles show up,
+# older pages are only fetched when the user asks for them
+try:
+    first_page = API_CLIENT.list_sessions()
+except (ApiBusy, ApiError):
+    api_unavailable()
+recent_sessions = first_page["sessions"]
+if "older_sessions" not in st.session_state:
+    st.session_state["older_sessions"] = []
+    st.session_state["sessions_cursor"] = first_page["next"]
+
+recent_ids = {s["session_id"] for s in recent_sessions}
+sessions = recent_sessions + [s for s in st.session_state["older_sessions"] if s["session_id"] not in recent_ids]
+session_titles = {s["session_id"]: s["title"] for s in sessions}
 
 # default session_id is None
 if "session_id" not in st.session_state:
     st.session_state["session_id"] = None
-
-st.set_page_config(
-    page_title="Ollama Chatbot",
-)
+if "events_version" not in st.session_state:
+    st.session_state["events_version"] = session_event_hub().version
+if "search_results" not in st.session_state:
+    st.session_state["search_results"] = []
+    st.session_state["search_cursor"] = None
 
 with st.sidebar:
         
@@ -54,13 +146,36 @@ with st.sidebar:
     
     st.divider()
     
+    # full-text search over all messages, runs when the query is submitted
+    search_query = st.text_input("Search chats", key="search_query", on_change=run_search, placeholder="Search chats")
+
+    if search_query.strip():
+        st.header("Search Results")
+        if not st.session_state["search_results"]:
+            st.caption("No matching chats.")
+        for result in st.session_state["search_results"]:
+            st.button(
+                result["title"] or "New Chat",
+                key=f"result_{result['session_id']}",
+                on_click=open_session,
+                args=(result["session_id"],),
+                use_container_width=True,
+                type="primary" if result["session_id"] == st.session_state["session_id"] else "secondary",
+            )
+            for snippet in result["snippets"]:
+                st.caption(snippet["text"])  # matches are wrapped in ** by the API
+        if st.session_state["search_cursor"] is not None:
+            st.button("More results", on_click=load_more_results, use_container_width=True)
+        st.divider()
+
     st.header("Chat History")
 
     # list session history
-    for session in st.session_state["sessions"]:
+    for session_row in sessions:
+        session = session_row["session_id"]
         session_title_col, delete_col = st.columns([4, 1])
         with session_title_col:
-            session_title = get_session_title_sync(session) or f"New Chat" # get session title or default to "New Chat" if no title yet
+            session_title = session_row["title"] or f"New Chat" # get session title or default to "New Chat" if no title yet
 
             if session == st.session_state["session_id"]:
                 st.button(
@@ -75,15 +190,21 @@ with st.sidebar:
                     key=f"session_{session}",
                     use_container_width=True
                 ):
-                    st.session_state["session_id"] = session 
-                    st.session_state["history"] = []
+                    create_new_session()
+                    st.session_state["session_id"] = session
                     st.rerun()
         with delete_col: # delete session button
             if st.button("🗑️", key=f"delete_{session}", use_container_width=True):
-                st.session_state["sessions"].remove(session)
-                run_async(delete_session(session))
+                st.session_state["older_sessions"] = [s for s in st.session_state["older_sessions"] if s["session_id"] != session]
+                delete_session(session)
                 st.rerun()
 
+    if st.session_state["sessions_cursor"] is not None:
+        st.button("Load more", on_click=load_more_sessions, use_container_width=True)
+
+    # new sessions, titles and deletions from other tabs and replicas
+    watch_session_events()
+
 # Main chat area
 
 session_id = st.session_state["session_id"]
@@ -91,25 +212,41 @@ session_id = st.session_state["session_id"]
 if session_id is None: # default no session selected
     st.title("Hi! How can I help you today?")
 else: # if session selected, show session title
-    session_title = get_session_title_sync(session_id)
-    if "session_title" in st.session_state:
-        st.title(st.session_state["session_title"])
-    else:
-        st.title(session_title if session_title else f"New Chat")
+    try:
+        session_title = session_titles[session_id] if session_id in session_titles else API_CLIENT.get_session(session_id)["title"]
+    except (ApiBusy, ApiError):
+        api_unavailable()
+    st.title(session_title if session_title else f"New Chat")
 
 if "history" not in st.session_state:
-    st.session_state["history"] = []
+    create_new_session()
 
-# fetch history from db
+# fetch history incrementally: the newest page once, then only messages after the last one shown
 if session_id is not None:
-    st.session_state["history"] = get_chat_history(session_id)
+    # messages the API has not committed yet come without an id: drop them, the next fetch returns them again
+    st.session_state["history"] = [msg for msg in st.session_state["history"] if msg["id"] is not None]
+    try:
+        if not st.session_state["history"]:
+            page = API_CLIENT.get_messages(session_id)
+            st.session_state["history"] = page["messages"]
+            st.session_state["messages_cursor"] = page["next_before"]
+        else:
+            st.session_state["history"] += API_CLIENT.get_messages(session_id, after=st.session_state["history"][-1]["id"])["messages"]
+    except (ApiBusy, ApiError):
+        api_unavailable()
 
-# display chat history
-for msg in st.session_state["history"]:
+# display chat history: only the newest messages are rendered on each rerun, older ones stay collapsed
+history = st.session_state["history"]
+hidden = max(0, len(history) - st.session_state["render_window"])
+if hidden:
+    st.button(f"Show {min(hidden, HISTORY_RENDER_WINDOW)} earlier messages", on_click=show_earlier_messages, use_container_width=True)
+elif session_id is not None and st.session_state["messages_cursor"] is not None:
+    st.button("Load earlier messages", on_click=load_older_messages, use_container_width=True)
+for msg in history[hidden:]:
     if msg["type"] == "human":
         with st.chat_message("user"):   
             st.markdown(f"{msg['content']}")
-    elif msg["type"] == "ai" or msg["type"] == "AIMessageChunk":
+    elif msg["type"] == "ai":
         with st.chat_message("assistant"):
             st.markdown(f"{msg['content']}")
 
@@ -120,18 +257,14 @@ if user_input and user_input != "":
         st.markdown(f"{user_input}")
     with st.chat_message("assistant"):
         if session_id is None:  # if this is a new chat, create a new session
-            session_id = str(uuid.uuid4())
-            st.session_state["session_id"] = session_id
-            st.session_state["sessions"] = [session_id] + st.session_state["sessions"] # add new session to the top of the list
-            thread_pool.submit(run_async, create_session_title(session_id, user_input)) # create session title asynchronously
-            st.write_stream(get_response_stream(session_id, user_input))
-            st.rerun()
-        else:
-            st.write_stream(get_response_stream(session_id, user_input))
-            if get_session_title_sync(session_id) == "New Chat": # rename session after getting more information from the session
-                message_history = get_chat_history(session_id)
-                messages = "\n".join(f"{msg['type']}: {msg['content']}" for msg in message_history[-4:]) 
-                new_title = run_async(update_session_title(session_id, messages))
-                if new_title:
-                    st.session_state["session_title"] = new_title
-            st.rerun()  # refresh the UI to update sidebar and title
\ No newline at end of file
+            try:
+                session_id = API_CLIENT.create_session()
+            except (ApiBusy, ApiError):
+                api_unavailable()
+            st.session_state["session_id"] = session_id # the api titles the session in the background from its first message
+            if stream_reply(session_id, user_input):
+                st.rerun()
+            else:
+                st.session_state["session_id"] = None
+        elif stream_reply(session_id, user_input):
+            st.rerun()  # refresh the UI to update sidebar and title
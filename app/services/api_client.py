@@ -0,0 +1,139 @@
+import json
+
+import httpx
+
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+CHAT_API_URL = os.getenv("CHAT_API_URL", "http://localhost:8000")
+CHAT_API_TIMEOUT = float(os.getenv("CHAT_API_TIMEOUT", "30"))
+CHAT_API_STREAM_TIMEOUT = float(os.getenv("CHAT_API_STREAM_TIMEOUT", "300"))  # read timeout between streamed events
+SESSION_EVENTS_READ_TIMEOUT = float(os.getenv("SESSION_EVENTS_READ_TIMEOUT", "60"))  # the API sends a keepalive every 15s
+
+class ApiBusy(Exception):
+    """Raised when the API reports that the model is saturated (HTTP 503)."""
+
+class ApiError(Exception):
+    """Raised when the API answers with an error status, the connection fails, or a reply stream ends with an error event."""
+
+def iter_sse(lines):
+    """Parse Server-Sent Events from an iterable of lines into (event, data) pairs."""
+    event, data = "message", []
+    for line in lines:
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].lstrip())
+    if data:
+        yield event, json.loads("\n".join(data))
+
+class ChatApiClient:
+    """Synchronous client of the chat HTTP API (api/server.py).
+
+    Keeps one pooled keep-alive HTTP client for all calls.
+    """
+
+    def __init__(self, base_url=CHAT_API_URL, transport=None):
+        self._client = httpx.Client(base_url=base_url, timeout=CHAT_API_TIMEOUT, transport=transport)
+
+    def _check(self, response):
+        if response.status_code == 503:
+            try:
+                error = response.json().get("error")
+            except ValueError:  # a proxy's own 503 page
+                error = response.text
+            raise ApiBusy(error)
+        try:
+            response.raise_for_status()
+        except httpx.HTTPStatusError as e:
+            raise ApiError(str(e)) from e
+        return response
+
+    def _request(self, method, path, **kwargs):
+        """Send one request and return its checked response. Connection failures raise ApiError."""
+        try:
+            return self._check(self._client.request(method, path, **kwargs))
+        except httpx.TransportError as e:  # refused or timed out
+            raise ApiError(f"{method} {path} failed: {e}") from e
+
+    def create_session(self) -> str:
+        return self._request("POST", "/api/sessions").json()["session_id"]
+
+    def list_sessions(self, limit=20, before=None) -> dict:
+        """One page of the session catalog: {"sessions": [...], "next": cursor or None}."""
+        params = {"limit": limit, **(before or {})}
+        return self._request("GET", "/api/sessions", params=params).json()
+
+    def search(self, query, limit=20, before=None) -> dict:
+        """One page of search results: {"results": [...], "next": cursor or None}."""
+        params = {"q": query, "limit": limit, **(before or {})}
+        return self._request("GET", "/api/search", params=params).json()
+
+    def get_session(self, session_id) -> dict:
+        return self._request("GET", f"/api/sessions/{session_id}").json()
+
+    def get_messages(self, session_id, before=None, after=None, limit=None) -> dict:
+        """One page of history, oldest first: {"messages": [...], "next_before": id or None}."""
+        params = {"before": before, "after": after, "limit": limit}
+        params = {key: value for key, value in params.items() if value is not None}
+        return self._request("GET", f"/api/sessions/{session_id}/messages", params=params).json()
+
+    def delete_session(self, session_id):
+        self._request("DELETE", f"/api/sessions/{session_id}")
+
+    def cancel(self, session_id) -> int:
+        """Stop the session's in-flight replies. Return how many were stopped."""
+        return self._request("POST", f"/api/sessions/{session_id}/cancel").json()["cancelled"]
+
+    def stream_reply(self, session_id, content):
+        """Send a message and yield the reply text as it streams in.
+
+        Ends quietly if the reply is cancelled; closing the generator early
+        drops the connection, which stops the generation server-side.
+        """
+        timeout = httpx.Timeout(CHAT_API_TIMEOUT, read=CHAT_API_STREAM_TIMEOUT)
+        try:
+            with self._client.stream(
+                "POST", f"/api/sessions/{session_id}/messages", json={"content": content}, timeout=timeout
+            ) as response:
+                if response.status_code >= 400:
+                    response.read()
+                    self._check(response)
+                for event, data in iter_sse(response.iter_lines()):
+                    if event == "token":
+                        yield data["content"]
+                    elif event == "error":
+                        raise ApiError(data["error"])
+                    elif event in ("done", "cancelled"):
+                        return
+        except httpx.TransportError as e:  # refused, timed out or dropped midway
+            raise ApiError(f"Reply stream of session {session_id} failed: {e}") from e
+
+    def session_events(self, stop=None):
+        """Yield session change events from the API (see services.session_events).
+
+        Yields None once subscribed. Raises when the connection drops or
+        goes silent, so the caller can reconnect.
+        """
+        timeout = httpx.Timeout(CHAT_API_TIMEOUT, read=SESSION_EVENTS_READ_TIMEOUT)
+        with self._client.stream("GET", "/api/sessions/events", timeout=timeout) as response:
+            if response.status_code >= 400:
+                response.read()
+                self._check(response)
+            yield None
+            for _, data in iter_sse(response.iter_lines()):
+                yield data
+                if stop is not None and stop.is_set():
+                    return
+
+    def close(self):
+        self._client.close()
+
+# shared by every Streamlit session in this process
+API_CLIENT = ChatApiClient()
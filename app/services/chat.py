@@ -1,76 +1,355 @@
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.runnables.history import RunnableWithMessageHistory
+from langchain_core.messages import HumanMessage, AIMessage
 
-from langchain_postgres import PostgresChatMessageHistory
+from psycopg import sql
 
-import psycopg
-import uuid
-
-from services.chat_sessions import get_session_title
 from core.chains import get_chat_chain_with_history
-from db.connection import get_connection
+from db.connection import get_pool, get_async_pool
+from db.schema import ensure_schema
+from db.history import PooledPostgresChatMessageHistory
+from db.sessions import SESSIONS_TABLE
+from db.search import asearch_sessions
+from db.notify import DELETED
+from db.write_behind import MESSAGE_WRITER, WRITE_BEHIND_ENABLED
+from services.history_cache import HistoryCache
+from services.generations import GENERATIONS, DISCONNECT, DELETED as DELETED_REASON
+from services.title_worker import TITLE_WORKER
+from services.session_events import RESYNC
+from services.response_cache import RESPONSE_CACHE, RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_SEMANTIC, replay, areplay
+from core.context import context_stats, forget_session, prefix_stats
+from core.scheduler import SCHEDULER, INTERACTIVE
+from core.runtime import run_coroutine
+from core.router import ROUTER, CHAT
+from core.metrics import timed, DB_CALL_SECONDS, observe_llm_response, observe_prompt_reuse, trace, register_collector
 
 from dotenv import load_dotenv
+import asyncio
+import logging
 import os
+import time
 
 load_dotenv()
 
-CHAT_HISTORY_TABLE = os.getenv("CHAT_HISTORY_TABLE", "chat_history")
+logger = logging.getLogger(__name__)
 
-DB_NAME = os.getenv("DB_NAME", "chat-history")
-DB_USER = os.getenv("DB_USER", "postgres")
-DB_PASSWORD = os.getenv("DB_PASSWORD", "password")
-DB_HOST = os.getenv("DB_HOST", "db")
-DB_PORT = os.getenv("DB_PORT", "5432")
+MESSAGES_TABLE = os.getenv("MESSAGES_TABLE", "chat_messages")
 
-IS_TESTING = os.getenv("IS_TESTING", "0") == "1"
+SESSION_PAGE_SIZE = int(os.getenv("SESSION_PAGE_SIZE", "20"))
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "50"))
 
-if not IS_TESTING:
-    SYNC_CONNECTION = get_connection()
-    PostgresChatMessageHistory.create_tables(
-        SYNC_CONNECTION,
-        CHAT_HISTORY_TABLE
-    )
-    CHAIN_WITH_HISTORY = get_chat_chain_with_history(CHAT_HISTORY_TABLE, SYNC_CONNECTION)
-else:
-    SYNC_CONNECTION = None
-    CHAIN_WITH_HISTORY = None
+CHAIN_WITH_HISTORY = None  # built on first use, see get_chain_with_history()
+
+# messages are queued and committed in batches after the reply, see db.write_behind
+HISTORY_WRITER = MESSAGE_WRITER if WRITE_BEHIND_ENABLED else None
+
+# the history each turn sends to the chain, read incrementally after a session's first turn in this process
+HISTORY_CACHE = HistoryCache()
+
+def get_chain_with_history():
+    """The chat chain, creating the schema first if startup (services.startup) has not done it yet."""
+    global CHAIN_WITH_HISTORY
+    if CHAIN_WITH_HISTORY is None:
+        ensure_schema(response_cache=RESPONSE_CACHE_ENABLED and RESPONSE_CACHE_SEMANTIC)
+        CHAIN_WITH_HISTORY = get_chat_chain_with_history(MESSAGES_TABLE, get_pool(), writer=HISTORY_WRITER, cache=HISTORY_CACHE)
+    return CHAIN_WITH_HISTORY
 
 def get_session_history(session_id):
-    return PostgresChatMessageHistory(
-        CHAT_HISTORY_TABLE,
+    return PooledPostgresChatMessageHistory(
+        MESSAGES_TABLE,
         session_id,
-        sync_connection=SYNC_CONNECTION
+        pool=get_pool(),
+        writer=HISTORY_WRITER
     )
 
+def _prompt_prefix_metrics():
+    yield ("chat_prompts_sent", "Chat prompts sent to the model.", {}, prefix_stats["sent"])
+    yield ("chat_prompts_prefix_kept", "Chat prompts that started with the session's previous prompt.", {}, prefix_stats["prefix_kept"])
+
+register_collector(_prompt_prefix_metrics)
+
+def _history_cache_metrics():
+    stats = HISTORY_CACHE.stats()
+    yield ("history_cache_sessions", "Sessions held in the history cache.", {}, stats["sessions"])
+    yield ("history_cache_bytes", "Estimated size of the history cache.", {}, stats["bytes"])
+    yield ("history_cache_hits", "History cache hits since startup.", {}, stats["hits"])
+    yield ("history_cache_misses", "History cache misses since startup.", {}, stats["misses"])
+
+register_collector(_history_cache_metrics)
+
+class _TurnObserver:
+    """Collects timing and token usage of one streamed chat turn."""
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.started = time.perf_counter()
+        self.first_token_at = None
+        self.usage = self.response_metadata = None
+        self.content = ""
+        self.chunks = 0
+
+    def chunk(self, chunk):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.chunks += 1
+        content = getattr(chunk, "content", None)
+        if isinstance(content, str):
+            self.content += content
+        if getattr(chunk, "usage_metadata", None): # ollama reports token counts on the final chunk
+            self.usage = chunk.usage_metadata
+            self.response_metadata = chunk.response_metadata
+            record_prompt_tokens(self.session_id, self.usage)
+
+    def finish(self):
+        timings = observe_llm_response(
+            CHAT, self.started, self.first_token_at, time.perf_counter(), self.usage, self.response_metadata
+        )
+        ROUTER.served(CHAT, self.response_metadata)
+        stats = context_stats.get(self.session_id, {})
+        reused = observe_prompt_reuse(CHAT, stats.get("prompt_tokens_estimate"), self.response_metadata)
+        trace("chat_turn", session_id=self.session_id, prompt_reused=reused, **(timings or {}), **stats)
+
+    @property
+    def completion_tokens(self) -> int:
+        # ollama streams about one token per chunk, the exact count only arrives with the final one
+        return (self.usage or {}).get("output_tokens", self.chunks)
+
+    @property
+    def stream_seconds(self) -> float:
+        return time.perf_counter() - self.first_token_at if self.first_token_at else 0.0
+
+def _partial_turn(user_input, observer, generation):
+    """Messages to store for a generation stopped midway: the user message and whatever was streamed."""
+    messages = [HumanMessage(content=user_input)]
+    if observer.content:
+        messages.append(AIMessage(
+            content=observer.content,
+            response_metadata={"cancelled": True, "cancel_reason": generation.reason or DISCONNECT},
+        ))
+    return messages
+
+def _save_partial(session_id, user_input, observer, generation):
+    GENERATIONS.aborted(generation, observer.completion_tokens)
+    if generation.persist_partial:
+        get_session_history(session_id).add_messages(_partial_turn(user_input, observer, generation))
+
+async def _asave_partial(session_id, user_input, observer, generation):
+    GENERATIONS.aborted(generation, observer.completion_tokens)
+    if generation.persist_partial:
+        await get_session_history(session_id).aadd_messages(_partial_turn(user_input, observer, generation))
+
+def _cache_lookup(session_id, user_input):
+    """Return (history, lookup) when the turn is eligible for the response cache, else (None, None)."""
+    history = get_session_history(session_id)
+    recent = [msg for _, msg in history.get_message_rows(limit=RESPONSE_CACHE.max_history + 1)]
+    if not RESPONSE_CACHE.cacheable(recent):
+        return None, None
+    return history, RESPONSE_CACHE.lookup(user_input, recent)
+
+async def _acache_lookup(session_id, user_input):
+    history = get_session_history(session_id)
+    recent = [msg for _, msg in await history.aget_message_rows(limit=RESPONSE_CACHE.max_history + 1)]
+    if not RESPONSE_CACHE.cacheable(recent):
+        return None, None
+    return history, await RESPONSE_CACHE.alookup(user_input, recent)
+
 def get_response_stream(session_id, user_input):
-    response = CHAIN_WITH_HISTORY.stream({"user_input": user_input}, config={"configurable": {"session_id": session_id}})
-    for chunk in response:
-        yield chunk
+    history = lookup = None
+    if RESPONSE_CACHE_ENABLED:
+        history, lookup = _cache_lookup(session_id, user_input)
+    if lookup is not None and lookup.response is not None:
+        # answered from the cache: no model call, but the turn is stored like any other (before the
+        # replay, so a stopped replay still leaves the full answer in history)
+        history.add_messages([HumanMessage(content=user_input), AIMessage(content=lookup.response, response_metadata={"cached": True})])
+        trace("chat_turn", session_id=session_id, cached=lookup.tier)
+        yield from replay(lookup.response)
+        return
 
-def get_chat_history(session_id):
-    chat_history = get_session_history(session_id)
-    return [
-        {"type": msg.type, "content": msg.content}
-        for msg in chat_history.messages
-    ] 
+    # waits for an interactive slot on the ollama scheduler and holds it while streaming
+    generation = GENERATIONS.start(session_id)
+    response = SCHEDULER.stream(
+        get_chain_with_history(),
+        {"user_input": user_input},
+        priority=INTERACTIVE,
+        config={"configurable": {"session_id": session_id}}
+    )
+    observer = _TurnObserver(session_id)
+    try:
+        for chunk in response:
+            if generation.cancelled:
+                break
+            observer.chunk(chunk)
+            yield chunk
+    except GeneratorExit:
+        # the consumer stopped reading: close the model stream so ollama stops generating
+        response.close()
+        _save_partial(session_id, user_input, observer, generation)
+        raise
+    except Exception:
+        GENERATIONS.finish(generation)
+        raise
+    if generation.cancelled:
+        response.close()
+        _save_partial(session_id, user_input, observer, generation)
+        return
+    observer.finish()
+    GENERATIONS.finish(generation, observer.completion_tokens, observer.stream_seconds)
+    if lookup is not None and observer.content:
+        RESPONSE_CACHE.store(lookup, observer.content)
+
+async def aget_response_stream(session_id, user_input):
+    """Async get_response_stream(): history, scheduler slot and model stream all run on the event loop.
+
+    GENERATIONS.cancel() cancels the consuming task, which closes the model
+    stream and stores the partial reply before the cancellation propagates.
+    """
+    history = lookup = None
+    if RESPONSE_CACHE_ENABLED:
+        history, lookup = await _acache_lookup(session_id, user_input)
+    if lookup is not None and lookup.response is not None:
+        await history.aadd_messages([HumanMessage(content=user_input), AIMessage(content=lookup.response, response_metadata={"cached": True})])
+        trace("chat_turn", session_id=session_id, cached=lookup.tier)
+        async for chunk in areplay(lookup.response):
+            yield chunk
+        return
+
+    generation = GENERATIONS.start(session_id)
+    response = SCHEDULER.astream(
+        get_chain_with_history(),
+        {"user_input": user_input},
+        priority=INTERACTIVE,
+        config={"configurable": {"session_id": session_id}}
+    )
+    observer = _TurnObserver(session_id)
+    try:
+        async for chunk in response:
+            observer.chunk(chunk)
+            yield chunk
+    except (asyncio.CancelledError, GeneratorExit):
+        await response.aclose()
+        await _asave_partial(session_id, user_input, observer, generation)
+        raise
+    except Exception:
+        GENERATIONS.finish(generation)
+        raise
+    observer.finish()
+    GENERATIONS.finish(generation, observer.completion_tokens, observer.stream_seconds)
+    if lookup is not None and observer.content:
+        await RESPONSE_CACHE.astore(lookup, observer.content)
+
+def record_prompt_tokens(session_id, usage):
+    stats = context_stats.setdefault(session_id, {})
+    stats["prompt_tokens"] = usage.get("input_tokens")
+    stats["completion_tokens"] = usage.get("output_tokens")
+    logger.info("session %s context: %s", session_id, stats)
+
+def get_context_stats(session_id):
+    """Context window size and token counts of the session's last request."""
+    return context_stats.get(session_id, {})
+
+@timed(DB_CALL_SECONDS, op="get_message_page")
+async def aget_message_page(session_id, before_id=None, limit=HISTORY_PAGE_SIZE, after_id=None):
+    """Return one page of messages (oldest first) ending before message id `before_id`,
+    and the cursor for the page before it, or None if it was the first one.
+
+    With `after_id`, return every message newer than it instead (cursor None).
+    """
+    history = get_session_history(session_id)
+    if after_id is not None:
+        rows, cursor = await history.aget_message_rows(after_id=after_id), None
+    else:
+        rows = await history.aget_message_rows(before_id=before_id, limit=limit)
+        cursor = rows[0][0] if len(rows) == limit else None
+    return [{"id": message_id, "type": msg.type, "content": msg.content} for message_id, msg in rows], cursor
+
+def get_message_page(session_id, before_id=None, limit=HISTORY_PAGE_SIZE, after_id=None):
+    return run_coroutine(aget_message_page(session_id, before_id, limit, after_id))
+
+@timed(DB_CALL_SECONDS, op="list_sessions")
+async def alist_sessions():
+    async with (await get_async_pool()).connection() as conn:
+        # get distinct sessions
+        cursor = await conn.execute(sql.SQL("""
+            SELECT session_id
+            FROM {table}
+            WHERE message_count > 0
+            ORDER BY last_activity ASC
+        """).format(table=sql.Identifier(SESSIONS_TABLE)))
+        return [row[0] for row in await cursor.fetchall()]
 
 def list_sessions():
-    cursor = SYNC_CONNECTION.cursor()
-    # get distinct sessions
-    cursor.execute("""
-        WITH latest_messages AS (
-            SELECT session_id, MAX(created_at) as last_activity
-            FROM chat_history
-            GROUP BY session_id
+    return run_coroutine(alist_sessions())
+
+@timed(DB_CALL_SECONDS, op="list_session_catalog")
+async def alist_session_catalog(limit=SESSION_PAGE_SIZE, before=None):
+    """List sessions with their title, last activity and message count from the sessions table.
+
+    Sessions are ordered most recent first. Pass the cursor returned by
+    catalog_cursor() as `before` to fetch the next (older) page.
+    """
+    before_ts, before_id = before if before else (None, None)
+    async with (await get_async_pool()).connection() as conn:
+        cursor = await conn.execute(sql.SQL("""
+            SELECT session_id, title, last_activity, message_count
+            FROM {table}
+            WHERE message_count > 0
+              AND (%(before_ts)s::timestamptz IS NULL
+                   OR (last_activity, session_id) < (%(before_ts)s::timestamptz, %(before_id)s::uuid))
+            ORDER BY last_activity DESC, session_id DESC
+            LIMIT %(limit)s
+        """).format(table=sql.Identifier(SESSIONS_TABLE)),
+            {"before_ts": before_ts, "before_id": before_id, "limit": limit}
         )
-        SELECT session_id 
-        FROM latest_messages 
-        ORDER BY last_activity ASC
-    """)
-    return [row[0] for row in cursor.fetchall()]
+        return [
+            {"session_id": str(session_id), "title": title, "last_activity": last_activity, "message_count": message_count}
+            for session_id, title, last_activity, message_count in await cursor.fetchall()
+        ]
+
+def list_session_catalog(limit=SESSION_PAGE_SIZE, before=None):
+    return run_coroutine(alist_session_catalog(limit, before))
+
+def catalog_cursor(page, limit=SESSION_PAGE_SIZE):
+    """Return the keyset cursor for the page after `page`, or None if it was the last one."""
+    if len(page) < limit:
+        return None
+    last = page[-1]
+    return (last["last_activity"], last["session_id"])
+
+@timed(DB_CALL_SECONDS, op="delete_chat")
+async def adelete_chat(session_id):
+    await get_session_history(session_id).aclear()
+    HISTORY_CACHE.invalidate(session_id)
+    forget_session(session_id)
 
 def delete_chat(session_id):
-    chat_history = get_session_history(session_id)
-    chat_history.clear()
\ No newline at end of file
+    run_coroutine(adelete_chat(session_id))
+
+def handle_session_event(event):
+    """Stop the replies and title jobs of a session deleted anywhere and drop what this process keeps
+    about it (see services.session_events), so none of them writes the session back.
+    """
+    if event["event"] == DELETED:
+        GENERATIONS.cancel(event["session_id"], DELETED_REASON)
+        TITLE_WORKER.cancel(event["session_id"])
+        HISTORY_CACHE.invalidate(event["session_id"])
+        forget_session(event["session_id"])
+    elif event["event"] == RESYNC:
+        HISTORY_CACHE.clear()  # deletions may have been missed
+
+@timed(DB_CALL_SECONDS, op="search_chats")
+async def asearch_chats(query, limit=SESSION_PAGE_SIZE, before=None):
+    """Full-text search of messages and titles, one result per session with highlighted snippets.
+
+    Pass the cursor returned by search_cursor() as `before` for the next page.
+    """
+    if not query or not query.strip():
+        return []
+    return await asearch_sessions(query.strip(), limit=limit, before=before)
+
+def search_chats(query, limit=SESSION_PAGE_SIZE, before=None):
+    return run_coroutine(asearch_chats(query, limit, before))
+
+def search_cursor(results, limit=SESSION_PAGE_SIZE):
+    """Return the keyset cursor (rank, session_id) for the page after `results`, or None if it was the last one."""
+    if len(results) < limit:
+        return None
+    last = results[-1]
+    return (last["rank"], last["session_id"])
@@ -1,138 +1,110 @@
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_ollama import ChatOllama
-import psycopg
-import uuid
-import asyncio
-from concurrent.futures import ThreadPoolExecutor
-
-from db.connection import get_connection
-from core.prompts import get_session_title_prompt
+from psycopg import sql
+import time
+
+from db.connection import get_async_pool
+from db.sessions import SESSIONS_TABLE
+from db.write_behind import MESSAGE_WRITER
+from core.chains import get_session_title_chain
+from core.scheduler import SCHEDULER, BACKGROUND
+from core.router import ROUTER, TITLE
+from core.runtime import run_coroutine
+from core.metrics import timed, DB_CALL_SECONDS, TITLE_GENERATION_SECONDS, observe_llm_response
 
 from dotenv import load_dotenv
-import os
 
 load_dotenv()
 
-OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.2")
-OLLAMA_URL = os.getenv("OLLAMA_URL", "http://ollama:11434")
-
-SESSION_TITLES_TABLE = os.getenv("SESSION_TITLES_TABLE", "session_titles")
-
-IS_TESTING = os.getenv("IS_TESTING", "0") == "1"
-
-# Create a thread pool for running synchronous operations
-thread_pool = ThreadPoolExecutor()
-
-async def run_in_thread(func, *args, **kwargs):
-    """Run a synchronous function in a thread pool."""
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(thread_pool, lambda: func(*args, **kwargs))
-
-def init_session_titles_table():
-    """Initialize the session_titles table if it doesn't exist."""
-    sync_connection = get_connection()
-    cursor = sync_connection.cursor()
-    
-    # Create table if it doesn't exist
-    cursor.execute(f"""
-        CREATE TABLE IF NOT EXISTS {SESSION_TITLES_TABLE} (
-            session_id UUID PRIMARY KEY,
-            title TEXT NOT NULL
-        )
-    """)
-    
-    sync_connection.commit()
-    cursor.close()
-    sync_connection.close()
+# The a-prefixed / async functions are the implementation and run on the caller's event loop.
+# Their synchronous versions run them on the runtime loop, so never call those from that loop.
 
+@timed(TITLE_GENERATION_SECONDS, kind="create")
 async def create_session_title(session_id: str, first_message: str) -> str:
     """Generate a title for a chat session based on the first message."""
-    # Initialize LLM
-    llm = ChatOllama(model=OLLAMA_MODEL, base_url=OLLAMA_URL)
-    
-    # Create prompt template
-    prompt = get_session_title_prompt()
-    
-    # Generate title
-    chain = prompt | llm
-    response = await run_in_thread(chain.invoke, {"message": first_message})
+    # Generate title with the shared title chain
+    chain = get_session_title_chain()
+    started = time.perf_counter()
+    response = await SCHEDULER.ainvoke(chain, {"message": first_message}, priority=BACKGROUND)
+    response_metadata = getattr(response, "response_metadata", None)
+    observe_llm_response(TITLE, started, None, time.perf_counter(), getattr(response, "usage_metadata", None), response_metadata)
+    ROUTER.served(TITLE, response_metadata)
     title = response.content.strip()
     
     # Store title in database
-    await run_in_thread(store_title_in_db, session_id, title)
+    await astore_title_in_db(session_id, title)
     return title
 
+@timed(DB_CALL_SECONDS, op="store_title_in_db")
+async def astore_title_in_db(session_id: str, title: str):
+    """Store the title of a session whose first turn is stored.
+
+    Only updates the session's row, so a session deleted while its title
+    was generated stays deleted. A first turn still queued for writing
+    (see db.write_behind) is committed first.
+    """
+    if MESSAGE_WRITER.pending(session_id):
+        await MESSAGE_WRITER.aflush()
+    await aupdate_title_in_db(session_id, title)
+
 def store_title_in_db(session_id: str, title: str):
-    """Store title in database (synchronous function)."""
-    sync_connection = get_connection()
-    cursor = sync_connection.cursor()
-    
-    cursor.execute(
-        f"INSERT INTO {SESSION_TITLES_TABLE} (session_id, title) VALUES (%s, %s) ON CONFLICT (session_id) DO UPDATE SET title = %s",
-        (session_id, title, title)
-    )
-    
-    sync_connection.commit()
-    cursor.close()
-    sync_connection.close()
+    """Synchronous version of astore_title_in_db."""
+    run_coroutine(astore_title_in_db(session_id, title))
 
+@timed(TITLE_GENERATION_SECONDS, kind="rename")
 async def rename_session(session_id: str, messages: str) -> str:
     """Rename a session."""
-    llm = ChatOllama(model=OLLAMA_MODEL, base_url=OLLAMA_URL)
-
-    prompt = get_session_title_prompt()
-
-    chain = prompt | llm
-    response = await run_in_thread(chain.invoke, {"message": messages})
+    chain = get_session_title_chain()
+    started = time.perf_counter()
+    response = await SCHEDULER.ainvoke(chain, {"message": messages}, priority=BACKGROUND)
+    response_metadata = getattr(response, "response_metadata", None)
+    observe_llm_response(TITLE, started, None, time.perf_counter(), getattr(response, "usage_metadata", None), response_metadata)
+    ROUTER.served(TITLE, response_metadata)
     new_title = response.content.strip()
 
-    await run_in_thread(update_title_in_db, session_id, new_title)
+    await aupdate_title_in_db(session_id, new_title)
     return new_title
 
+@timed(DB_CALL_SECONDS, op="update_title_in_db")
+async def aupdate_title_in_db(session_id: str, new_title: str):
+    """Update title in database."""
+    async with (await get_async_pool()).connection() as conn:
+        await conn.execute(
+            sql.SQL("UPDATE {table} SET title = %s WHERE session_id = %s").format(table=sql.Identifier(SESSIONS_TABLE)),
+            (new_title, session_id)
+        )
+
 def update_title_in_db(session_id: str, new_title: str):
-    """Update title in database (synchronous function)."""
-    sync_connection = get_connection()
-    cursor = sync_connection.cursor()
-    
-    cursor.execute(f"UPDATE {SESSION_TITLES_TABLE} SET title = %s WHERE session_id = %s", (new_title, session_id))
-    sync_connection.commit()
-    cursor.close()
-    sync_connection.close()
+    """Synchronous version of aupdate_title_in_db."""
+    run_coroutine(aupdate_title_in_db(session_id, new_title))
 
+@timed(DB_CALL_SECONDS, op="get_title_from_db")
 async def get_session_title(session_id: str) -> str:
     """Retrieve the title for a given session."""
-    return await run_in_thread(get_title_from_db, session_id)
+    async with (await get_async_pool()).connection() as conn:
+        cursor = await conn.execute(
+            sql.SQL("SELECT title FROM {table} WHERE session_id = %s").format(table=sql.Identifier(SESSIONS_TABLE)),
+            (session_id,)
+        )
+        result = await cursor.fetchone()
+
+    return result[0] if result else None
 
 def get_title_from_db(session_id: str) -> str:
     """Get title from database (synchronous function)."""
-    sync_connection = get_connection()
-    cursor = sync_connection.cursor()
-    
-    cursor.execute(f"SELECT title FROM {SESSION_TITLES_TABLE} WHERE session_id = %s", (session_id,))
-    result = cursor.fetchone()
-    
-    cursor.close()
-    sync_connection.close()
-    
-    return result[0] if result else None
+    return run_coroutine(get_session_title(session_id))
 
+@timed(DB_CALL_SECONDS, op="delete_session_title")
 async def delete_session_title(session_id: str):
     """Delete session title from database asynchronously."""
-    await run_in_thread(_delete_session_title_sync, session_id)
-        
+    async with (await get_async_pool()).connection() as conn:
+        await conn.execute(
+            sql.SQL("UPDATE {table} SET title = NULL WHERE session_id = %s").format(table=sql.Identifier(SESSIONS_TABLE)),
+            (session_id,)
+        )
+
 def _delete_session_title_sync(session_id: str):
     """Delete session title from database (synchronous function)."""
-    sync_connection = get_connection()
-    cursor = sync_connection.cursor()
-    
-    cursor.execute(f"DELETE FROM {SESSION_TITLES_TABLE} WHERE session_id = %s", (session_id,))
-    sync_connection.commit()
-    cursor.close()
-    sync_connection.close()
+    run_coroutine(delete_session_title(session_id))
 
 def get_session_title_sync(session_id: str) -> str:
     """Synchronous version of get_session_title."""
     return get_title_from_db(session_id)
-
-if not IS_TESTING:
-    init_session_titles_table()
@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import threading
+import time
+
+from core.metrics import register_collector, histogram
+
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# prior for the savings estimate until real generations have been observed
+EXPECTED_COMPLETION_TOKENS = int(os.getenv("EXPECTED_COMPLETION_TOKENS", "256"))
+EXPECTED_TOKENS_PER_SECOND = float(os.getenv("EXPECTED_TOKENS_PER_SECOND", "20"))
+AVERAGE_WEIGHT = 0.1  # weight of the newest generation in the running averages
+
+CANCEL_SECONDS_SAVED = histogram("llm_cancel_seconds_saved", "Estimated model seconds saved per cancelled generation.")
+
+# cancel reasons
+USER = "user"
+DISCONNECT = "disconnect"
+DELETED = "deleted"
+
+class Generation:
+    """One in-flight chat reply that can be cancelled from another thread or task."""
+
+    def __init__(self, session_id, task=None):
+        self.session_id = session_id
+        self.task = task  # asyncio task consuming the stream, None for the sync path
+        self.started = time.monotonic()
+        self.reason = None
+        self._event = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason):
+        if self._event.is_set():
+            return False
+        self.reason = reason
+        self._event.set()
+        if self.task is not None:
+            # cancelling the consumer task unwinds the stream down to the ollama http request, closing it
+            self.task.get_loop().call_soon_threadsafe(self.task.cancel)
+        return True
+
+    @property
+    def persist_partial(self) -> bool:
+        """Whether the partial reply should be stored (not once its session is being deleted)."""
+        return self.reason != DELETED
+
+class GenerationTracker:
+    """Registry of in-flight generations per session.
+
+    Keeps cancel counts by reason and running averages of completion length
+    and speed, used to estimate the model time a cancellation saved.
+    """
+
+    def __init__(self):
+        self._active = {}  # session_id -> set of Generation
+        self._lock = threading.Lock()
+        self._avg_tokens = float(EXPECTED_COMPLETION_TOKENS)
+        self._avg_rate = EXPECTED_TOKENS_PER_SECOND
+        self.stats = {"started": 0, "finished": 0, "cancelled": 0, "seconds_saved": 0.0}
+        self.cancel_reasons = {}
+
+    def start(self, session_id) -> Generation:
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        generation = Generation(session_id, task)
+        with self._lock:
+            self._active.setdefault(session_id, set()).add(generation)
+            self.stats["started"] += 1
+        return generation
+
+    def _remove(self, generation):
+        with self._lock:
+            generations = self._active.get(generation.session_id)
+            if generations is not None:
+                generations.discard(generation)
+                if not generations:
+                    del self._active[generation.session_id]
+
+    def finish(self, generation, completion_tokens=0, seconds=0.0):
+        """Record a generation that ran to completion, or failed when called without usage."""
+        self._remove(generation)
+        with self._lock:
+            self.stats["finished"] += 1
+            if completion_tokens:
+                self._avg_tokens += AVERAGE_WEIGHT * (completion_tokens - self._avg_tokens)
+                if seconds > 0:
+                    self._avg_rate += AVERAGE_WEIGHT * (completion_tokens / seconds - self._avg_rate)
+
+    def aborted(self, generation, completion_tokens, reason=DISCONNECT) -> float:
+        """Record a generation stopped before completion. Return the estimated model seconds saved."""
+        self._remove(generation)
+        reason = generation.reason or reason
+        with self._lock:
+            saved = max(0.0, self._avg_tokens - completion_tokens) / self._avg_rate
+            self.stats["cancelled"] += 1
+            self.stats["seconds_saved"] += saved
+            self.cancel_reasons[reason] = self.cancel_reasons.get(reason, 0) + 1
+        CANCEL_SECONDS_SAVED.observe(saved, reason=reason)
+        logger.info("generation for session %s cancelled (%s) after %d tokens, ~%.1fs saved",
+                    generation.session_id, reason, completion_tokens, saved)
+        return saved
+
+    def cancel(self, session_id, reason=USER) -> int:
+        """Cancel every in-flight generation of a session. Return how many were cancelled."""
+        with self._lock:
+            generations = list(self._active.get(session_id, ()))
+        return sum(generation.cancel(reason) for generation in generations)
+
+    def cancel_task(self, task, reason=DISCONNECT) -> int:
+        """Cancel the generations consumed by an asyncio task, e.g. a request whose client went away."""
+        with self._lock:
+            generations = [generation for generations in self._active.values() for generation in generations
+                           if generation.task is task]
+        return sum(generation.cancel(reason) for generation in generations)
+
+    def active(self, session_id=None) -> int:
+        with self._lock:
+            if session_id is not None:
+                return len(self._active.get(session_id, ()))
+            return sum(len(generations) for generations in self._active.values())
+
+GENERATIONS = GenerationTracker()
+
+def _generation_metrics():
+    yield ("generations_active", "Chat generations currently streaming.", {}, GENERATIONS.active())
+    for key, value in GENERATIONS.stats.items():
+        yield (f"generations_{key}", f"Chat generations {key} since startup.", {}, value)
+    for reason, count in GENERATIONS.cancel_reasons.items():
+        yield ("generations_cancelled_by_reason", "Cancelled chat generations by reason.", {"reason": reason}, count)
+
+register_collector(_generation_metrics)
@@ -0,0 +1,96 @@
+from collections import OrderedDict
+import threading
+
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+HISTORY_CACHE_MAX_BYTES = int(os.getenv("HISTORY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+MESSAGE_OVERHEAD_BYTES = 200  # rough per-message cost of the message object and its strings
+
+def _message_size(message) -> int:
+    return len(str(message.content)) + MESSAGE_OVERHEAD_BYTES
+
+class _Entry:
+    def __init__(self):
+        self.messages = []
+        self.last_id = None
+        self.size = 0
+
+class HistoryCache:
+    """In-process LRU cache of the chat history the chain sends through the context strategy.
+
+    The first turn of a session in this process reads its stored messages
+    once; later turns read only rows newer than the last cached id.
+    Messages still queued by the write-behind writer (id None) are returned
+    but not cached, so they are read again once committed. Entries are
+    evicted least recently used first once the total estimated size
+    exceeds `max_bytes`.
+    """
+
+    def __init__(self, max_bytes=HISTORY_CACHE_MAX_BYTES):
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _snapshot(self, session_id):
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                entry = self._entries[session_id] = _Entry()
+                self.misses += 1
+            else:
+                self._entries.move_to_end(session_id)
+                self.hits += 1
+            return entry, entry.last_id, list(entry.messages)
+
+    def _merge(self, session_id, entry, last_id, cached, rows):
+        stored = [(message_id, message) for message_id, message in rows if message_id is not None]
+        with self._lock:
+            # the database read ran without the lock: only extend an entry nobody changed, evicted or invalidated meanwhile
+            if stored and entry.last_id == last_id and self._entries.get(session_id) is entry:
+                added = [message for _, message in stored]
+                entry.messages.extend(added)
+                entry.last_id = max(message_id for message_id, _ in stored)
+                size = sum(_message_size(message) for message in added)
+                entry.size += size
+                self._size += size
+                self._evict()
+        return cached + [message for _, message in rows]
+
+    def get(self, session_id, history) -> list:
+        """The session's messages, reading only rows newer than the cached ones from `history`."""
+        entry, last_id, cached = self._snapshot(session_id)
+        rows = history.get_message_rows(after_id=last_id)
+        return self._merge(session_id, entry, last_id, cached, rows)
+
+    async def aget(self, session_id, history) -> list:
+        entry, last_id, cached = self._snapshot(session_id)
+        rows = await history.aget_message_rows(after_id=last_id)
+        return self._merge(session_id, entry, last_id, cached, rows)
+
+    def invalidate(self, session_id):
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+            if entry is not None:
+                self._size -= entry.size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _evict(self):
+        # called with the lock held; always keeps the most recently used entry, even if it alone exceeds the budget
+        while self._size > self._max_bytes and len(self._entries) > 1:
+            _, entry = self._entries.popitem(last=False)
+            self._size -= entry.size
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"sessions": len(self._entries), "bytes": self._size, "hits": self.hits, "misses": self.misses}
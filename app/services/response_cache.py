@@ -0,0 +1,201 @@
+import asyncio
+from collections import OrderedDict
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+
+from langchain_core.messages import AIMessageChunk
+
+from core.prompts import get_system_prompt
+from core.runtime import get_embeddings
+from core.router import ROUTER, CHAT
+from core.scheduler import SCHEDULER, INTERACTIVE
+from core.metrics import register_collector
+from db.response_cache import find_similar, afind_similar, store_response, astore_response
+
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "0") == "1"
+# prior messages a turn may have and still be answered from / stored in the cache
+RESPONSE_CACHE_MAX_HISTORY = int(os.getenv("RESPONSE_CACHE_MAX_HISTORY", "0"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+RESPONSE_CACHE_SEMANTIC = os.getenv("RESPONSE_CACHE_SEMANTIC", "0") == "1"
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.92"))  # cosine similarity
+RESPONSE_CACHE_EMBED_MODEL = os.getenv("RESPONSE_CACHE_EMBED_MODEL", "nomic-embed-text")
+RESPONSE_CACHE_REPLAY_DELAY = float(os.getenv("RESPONSE_CACHE_REPLAY_DELAY", "0"))  # seconds between replayed chunks
+
+def normalize_prompt(text: str) -> str:
+    """Case-fold, collapse whitespace and drop trailing punctuation."""
+    return re.sub(r"\s+", " ", text.lower()).strip().rstrip("?!. ")
+
+def cache_namespace(model=None, system_prompt=None) -> str:
+    """Hash of the model and system prompt; answers are only shared within one namespace."""
+    payload = json.dumps([model or ROUTER.route(CHAT).models[0], system_prompt if system_prompt is not None else get_system_prompt()])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def cache_key(namespace, user_input, history=()) -> str:
+    payload = json.dumps([namespace, [(msg.type, normalize_prompt(str(msg.content))) for msg in history], normalize_prompt(user_input)])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def _replay_pieces(response):
+    return re.findall(r"\s*\S+(?:\s+$)?", response) or [response]
+
+class CacheLookup:
+    __slots__ = ("key", "prompt", "embedding", "response", "tier")
+
+    def __init__(self, key, prompt):
+        self.key = key
+        self.prompt = prompt
+        self.embedding = None
+        self.response = None
+        self.tier = None
+
+class ResponseCache:
+    """Cache of model answers for turns with no or little history.
+
+    The exact tier is an in-process LRU keyed on the normalized prompt, the
+    prior messages and the model/system prompt namespace, with a TTL. The
+    optional semantic tier embeds first-message prompts and looks up the
+    nearest cached prompt in Postgres (pgvector), accepting it above a cosine
+    similarity threshold; it is shared by every process.
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES, ttl=RESPONSE_CACHE_TTL, semantic=RESPONSE_CACHE_SEMANTIC,
+                 similarity=RESPONSE_CACHE_SIMILARITY, max_history=RESPONSE_CACHE_MAX_HISTORY, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.semantic = semantic
+        self.similarity = similarity
+        self.max_history = max_history
+        self._clock = clock
+        self._entries = OrderedDict()  # key -> (expires_at, response)
+        self._lock = threading.Lock()
+        self.stats = {"lookups": 0, "exact_hits": 0, "semantic_hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0}
+
+    def cacheable(self, history) -> bool:
+        return len(history) <= self.max_history
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, response = entry
+            if expires_at <= self._clock():
+                del self._entries[key]
+                self.stats["expired"] += 1
+                return None
+            self._entries.move_to_end(key)
+            return response
+
+    def _put(self, key, response):
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def _begin(self, user_input, history):
+        self.stats["lookups"] += 1
+        lookup = CacheLookup(cache_key(cache_namespace(), user_input, history), normalize_prompt(user_input))
+        lookup.response = self._get(lookup.key)
+        if lookup.response is not None:
+            lookup.tier = "exact"
+            self.stats["exact_hits"] += 1
+        return lookup
+
+    def _semantic_result(self, lookup, match):
+        if match is None:
+            self.stats["misses"] += 1
+            return lookup
+        lookup.response, similarity = match
+        lookup.tier = "semantic"
+        self.stats["semantic_hits"] += 1
+        logger.info("semantic cache hit (similarity %.3f) for %r", similarity, lookup.prompt)
+        self._put(lookup.key, lookup.response)
+        return lookup
+
+    def lookup(self, user_input, history=()) -> CacheLookup:
+        """Look the turn up in the exact tier, then (first messages only) in the semantic tier."""
+        lookup = self._begin(user_input, history)
+        if lookup.response is not None:
+            return lookup
+        match = None
+        if self.semantic and not history:
+            try:
+                with SCHEDULER.slot(INTERACTIVE):
+                    lookup.embedding = get_embeddings(RESPONSE_CACHE_EMBED_MODEL).embed_query(lookup.prompt)
+                match = find_similar(cache_namespace(), lookup.embedding, self.similarity, self.ttl)
+            except Exception:
+                logger.warning("semantic cache lookup failed", exc_info=True)
+        return self._semantic_result(lookup, match)
+
+    async def alookup(self, user_input, history=()) -> CacheLookup:
+        lookup = self._begin(user_input, history)
+        if lookup.response is not None:
+            return lookup
+        match = None
+        if self.semantic and not history:
+            try:
+                async with SCHEDULER.aslot(INTERACTIVE):
+                    lookup.embedding = await get_embeddings(RESPONSE_CACHE_EMBED_MODEL).aembed_query(lookup.prompt)
+                match = await afind_similar(cache_namespace(), lookup.embedding, self.similarity, self.ttl)
+            except Exception:
+                logger.warning("semantic cache lookup failed", exc_info=True)
+        return self._semantic_result(lookup, match)
+
+    def store(self, lookup: CacheLookup, response: str):
+        """Cache the model's answer for a looked-up turn that missed."""
+        self._put(lookup.key, response)
+        self.stats["stores"] += 1
+        if self.semantic and lookup.embedding is not None:
+            try:
+                store_response(cache_namespace(), lookup.prompt, lookup.embedding, response, self.max_entries, self.ttl)
+            except Exception:
+                logger.warning("semantic cache store failed", exc_info=True)
+
+    async def astore(self, lookup: CacheLookup, response: str):
+        self._put(lookup.key, response)
+        self.stats["stores"] += 1
+        if self.semantic and lookup.embedding is not None:
+            try:
+                await astore_response(cache_namespace(), lookup.prompt, lookup.embedding, response, self.max_entries, self.ttl)
+            except Exception:
+                logger.warning("semantic cache store failed", exc_info=True)
+
+    def hit_rate(self) -> float:
+        lookups = self.stats["lookups"]
+        return (self.stats["exact_hits"] + self.stats["semantic_hits"]) / lookups if lookups else 0.0
+
+def replay(response: str):
+    """Yield a cached answer word by word as message chunks, like a model stream."""
+    for piece in _replay_pieces(response):
+        yield AIMessageChunk(content=piece, response_metadata={"cached": True})
+        if RESPONSE_CACHE_REPLAY_DELAY:
+            time.sleep(RESPONSE_CACHE_REPLAY_DELAY)
+
+async def areplay(response: str):
+    for piece in _replay_pieces(response):
+        yield AIMessageChunk(content=piece, response_metadata={"cached": True})
+        if RESPONSE_CACHE_REPLAY_DELAY:
+            await asyncio.sleep(RESPONSE_CACHE_REPLAY_DELAY)
+
+RESPONSE_CACHE = ResponseCache()
+
+def _response_cache_metrics():
+    for key, value in RESPONSE_CACHE.stats.items():
+        yield (f"response_cache_{key}", f"Response cache {key} since startup.", {}, value)
+    yield ("response_cache_hit_rate", "Share of cache lookups answered from the cache.", {}, RESPONSE_CACHE.hit_rate())
+    yield ("response_cache_entries", "Entries in the in-process exact tier.", {}, len(RESPONSE_CACHE._entries))
+
+register_collector(_response_cache_metrics)
@@ -0,0 +1,153 @@
+from collections import deque
+import logging
+import os
+import threading
+import time
+
+from psycopg import sql
+
+from db.connection import get_connection
+from db.notify import SESSION_EVENTS_CHANNEL, parse_notification
+from core.metrics import register_collector
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SESSION_EVENTS_BUFFER = int(os.getenv("SESSION_EVENTS_BUFFER", "1000"))  # recent events kept for pollers
+SESSION_EVENTS_RETRY = float(os.getenv("SESSION_EVENTS_RETRY", "2"))  # seconds before reconnecting a lost listener
+
+# published after a (re)connect: events may have been missed, so local copies should be reloaded
+RESYNC = "resync"
+
+class SessionEventHub:
+    """Fans session events out to everything in this process that caches session data.
+
+    Callbacks registered with subscribe() run on the listener thread for
+    every event. Pollers such as Streamlit fragments instead remember the
+    `version` they last saw and ask since() for what is new.
+    """
+
+    def __init__(self, max_events=SESSION_EVENTS_BUFFER):
+        self._lock = threading.Lock()
+        self._events = deque(maxlen=max_events)
+        self._subscribers = []
+        self.version = 0
+
+    def publish(self, event):
+        with self._lock:
+            self.version += 1
+            event = {**event, "version": self.version}
+            self._events.append(event)
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(event)
+            except Exception:
+                logger.exception("Session event subscriber failed on %s", event)
+        return event
+
+    def subscribe(self, callback):
+        """Call `callback(event)` for every event. Returns a function that unsubscribes."""
+        with self._lock:
+            self._subscribers.append(callback)
+
+        def unsubscribe():
+            with self._lock:
+                if callback in self._subscribers:
+                    self._subscribers.remove(callback)
+        return unsubscribe
+
+    def since(self, version):
+        """Events newer than `version`, and whether that is all of them (False once older ones were dropped)."""
+        with self._lock:
+            events = [event for event in self._events if event["version"] > version]
+            oldest = self._events[0]["version"] if self._events else self.version + 1
+            complete = version >= self.version or oldest <= version + 1
+        return events, complete
+
+def postgres_events(stop, channel=SESSION_EVENTS_CHANNEL, poll_interval=1.0, connect=None):
+    """LISTEN on a dedicated connection and yield session events, or None every `poll_interval` without any."""
+    with (connect or (lambda: get_connection(autocommit=True)))() as conn:
+        conn.execute(sql.SQL("LISTEN {channel}").format(channel=sql.Identifier(channel)))
+        yield None  # listening
+        while not stop.is_set():
+            for notify in conn.notifies(timeout=poll_interval):
+                yield parse_notification(notify.payload)
+            yield None
+
+class SessionEventListener:
+    """Feeds a hub from one event source per process, reconnecting when it fails.
+
+    `source(stop)` returns an iterator of events that may yield None as a
+    heartbeat (see postgres_events, or ChatApiClient.session_events in the
+    UI process). A RESYNC event is published whenever the source
+    reconnects.
+    """
+
+    def __init__(self, hub, source=postgres_events, retry_delay=SESSION_EVENTS_RETRY):
+        self.hub = hub
+        self._source = source
+        self._retry_delay = retry_delay
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.connected = threading.Event()
+        self.stats = {"events": 0, "reconnects": 0, "errors": 0}
+
+    def start(self):
+        """Start the listener thread once per process (again in a forked child)."""
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return self
+            self._stop.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="session-events", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self.connected.clear()
+
+    def _run(self):
+        first = True
+        while not self._stop.is_set():
+            try:
+                for event in self._source(self._stop):
+                    if not self.connected.is_set():
+                        self.connected.set()
+                        if not first:
+                            self.stats["reconnects"] += 1
+                            self.hub.publish({"event": RESYNC})
+                        first = False
+                    if event is not None:
+                        self.stats["events"] += 1
+                        self.hub.publish(event)
+                    if self._stop.is_set():
+                        break
+            except Exception as e:  # psycopg or http errors: retry, a down database must not kill the thread
+                self.stats["errors"] += 1
+                logger.warning("Session event listener lost its source: %s", e)
+            self.connected.clear()
+            if not self._stop.is_set():
+                time.sleep(self._retry_delay)
+
+SESSION_EVENTS = SessionEventHub()
+LISTENER = SessionEventListener(SESSION_EVENTS)
+
+def start_session_events():
+    """Start this process's Postgres listener. Returns the hub to subscribe to."""
+    LISTENER.start()
+    return SESSION_EVENTS
+
+def _session_events_metrics():
+    yield ("session_events_version", "Session events received by this process.", {}, SESSION_EVENTS.version)
+    yield ("session_events_listener_connected", "Whether the session event listener is connected.", {}, int(LISTENER.connected.is_set()))
+    for key, value in LISTENER.stats.items():
+        yield (f"session_events_listener_{key}", f"Session event listener {key}.", {}, value)
+
+register_collector(_session_events_metrics)
@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import time
+
+import httpx
+
+from db.connection import get_async_pool
+from db.schema import ensure_schema
+from core.runtime import OLLAMA_URLS, OLLAMA_NUM_CTX, keep_alive_value, blocking_executor
+from core.router import ROUTER, CHAT
+from core.metrics import register_collector
+from services.response_cache import RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_SEMANTIC
+
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+OLLAMA_PRELOAD = os.getenv("OLLAMA_PRELOAD", "1") == "1"
+OLLAMA_KEEP_WARM_INTERVAL = float(os.getenv("OLLAMA_KEEP_WARM_INTERVAL", "240"))  # seconds between pings, 0 disables
+OLLAMA_LOAD_TIMEOUT = float(os.getenv("OLLAMA_LOAD_TIMEOUT", "300"))  # loading a large model from disk is slow
+READINESS_TIMEOUT = float(os.getenv("READINESS_TIMEOUT", "2"))
+
+class Startup:
+    """Warms a process up for chat traffic and reports when it is ready.
+
+    run() creates the schema once, opens the async DB pool and preloads the
+    preferred chat model into the memory of every Ollama backend with
+    OLLAMA_KEEP_ALIVE and OLLAMA_NUM_CTX, then pings the model
+    every OLLAMA_KEEP_WARM_INTERVAL seconds so idle periods don't unload it.
+    Records how long each step took and how long the first chat request
+    waited after the process started.
+    """
+
+    def __init__(self, model=None, ollama_url=None, clock=time.monotonic, ollama_urls=None):
+        self.model = model or ROUTER.route(CHAT).models[0]
+        self.ollama_urls = [ollama_url] if ollama_url else list(ollama_urls or OLLAMA_URLS)
+        self._clock = clock
+        self.started_at = clock()
+        self.timings = {}  # step -> seconds
+        self.db_ready = False
+        self.model_ready = False
+        self.first_request_at = None
+        self._keep_warm = None
+
+    async def _step(self, name, step):
+        started = self._clock()
+        try:
+            await step()
+            return True
+        except Exception:
+            logger.warning("startup step %s failed", name, exc_info=True)
+            return False
+        finally:
+            self.timings[name] = self._clock() - started
+
+    async def warm_db(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(blocking_executor, lambda: ensure_schema(
+            response_cache=RESPONSE_CACHE_ENABLED and RESPONSE_CACHE_SEMANTIC
+        ))
+        async with (await get_async_pool()).connection() as conn:
+            await conn.execute("SELECT 1")
+        self.db_ready = True
+
+    async def _load_model(self, url):
+        async with httpx.AsyncClient(base_url=url, timeout=OLLAMA_LOAD_TIMEOUT) as client:
+            # the same keep_alive and num_ctx as chat requests, or the first one would load the model again
+            response = await client.post("/api/chat", json={
+                "model": self.model, "messages": [], "keep_alive": keep_alive_value(),
+                "options": {"num_ctx": ROUTER.route(CHAT).options.get("num_ctx", OLLAMA_NUM_CTX)},
+            })
+            response.raise_for_status()
+
+    async def load_model(self):
+        """Load the model on every backend without generating: ollama treats a chat request with no messages as a load."""
+        results = await asyncio.gather(*(self._load_model(url) for url in self.ollama_urls), return_exceptions=True)
+        for url, result in zip(self.ollama_urls, results):
+            if isinstance(result, Exception):
+                logger.warning("Could not load %s on %s: %s", self.model, url, result)
+        if all(isinstance(result, Exception) for result in results):
+            raise results[0]
+        self.model_ready = True
+
+    async def _keep_warm_loop(self):
+        while True:
+            await asyncio.sleep(OLLAMA_KEEP_WARM_INTERVAL)
+            if not await self._step("keep_warm", self.load_model):
+                self.model_ready = False
+
+    async def run(self):
+        steps = [self._step("db", self.warm_db)]
+        if OLLAMA_PRELOAD:
+            steps.append(self._step("model", self.load_model))
+        await asyncio.gather(*steps)
+        if OLLAMA_PRELOAD and OLLAMA_KEEP_WARM_INTERVAL > 0 and self._keep_warm is None:
+            self._keep_warm = asyncio.create_task(self._keep_warm_loop())
+        self.timings["startup"] = self._clock() - self.started_at
+        logger.info("startup finished in %.2fs (db ready: %s, model ready: %s, steps: %s)",
+                    self.timings["startup"], self.db_ready, self.model_ready, self.timings)
+
+    def stop(self):
+        if self._keep_warm is not None:
+            self._keep_warm.cancel()
+            self._keep_warm = None
+
+    def request_started(self):
+        """Mark a chat request; the first one records time-to-first-request."""
+        if self.first_request_at is None:
+            self.first_request_at = self._clock()
+            self.timings["first_request"] = self.first_request_at - self.started_at
+
+    async def _check_db(self):
+        if not self.db_ready:  # retry a warm-up that failed, e.g. because the DB started after us
+            await self.warm_db()
+            return
+        async with (await get_async_pool()).connection() as conn:
+            await conn.execute("SELECT 1")
+
+    async def _check_backend(self, url):
+        async with httpx.AsyncClient(base_url=url, timeout=READINESS_TIMEOUT) as client:
+            response = await client.get("/api/ps")
+            response.raise_for_status()
+        if not OLLAMA_PRELOAD:  # the model loads on first use, reachable is all that can be asked
+            return
+        loaded = {model.get("name") for model in response.json().get("models", [])}
+        if self.model not in loaded and f"{self.model}:latest" not in loaded:
+            raise LookupError(f"{self.model} is not loaded on {url}")
+
+    async def _check_model(self):
+        # ready while any backend can serve: sessions of one that is down move to the next (see core.router)
+        results = await asyncio.gather(*(self._check_backend(url) for url in self.ollama_urls), return_exceptions=True)
+        if all(isinstance(result, Exception) for result in results):
+            raise results[0]
+
+    async def readiness(self) -> dict:
+        """Check live that the DB answers and the model is loaded in Ollama."""
+        async def check(probe):
+            try:
+                await asyncio.wait_for(probe(), READINESS_TIMEOUT)
+                return True
+            except Exception:
+                return False
+
+        db, model = await asyncio.gather(check(self._check_db), check(self._check_model))
+        return {"ready": db and model, "db": db, "model": model, "timings": self.timings}
+
+STARTUP = Startup()
+
+def _startup_metrics():
+    yield ("startup_db_ready", "Whether the schema and DB pool are set up.", {}, int(STARTUP.db_ready))
+    yield ("startup_model_ready", "Whether the chat model was last loaded successfully.", {}, int(STARTUP.model_ready))
+    for step, seconds in STARTUP.timings.items():
+        yield ("startup_step_seconds", "Duration of startup steps, and time from start to the first chat request.",
+               {"step": step}, seconds)
+
+register_collector(_startup_metrics)
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import re
+import threading
+
+from services.chat_sessions import create_session_title, rename_session, astore_title_in_db
+from core.runtime import get_loop
+from core.metrics import register_collector
+
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+TITLE_WORKER_CONCURRENCY = int(os.getenv("TITLE_WORKER_CONCURRENCY", "2"))
+
+DEFAULT_TITLE = "New Chat"
+
+GREETINGS = {
+    "hi", "hello", "hey", "heya", "hiya", "yo", "sup", "howdy", "greetings", "hola",
+    "good morning", "good afternoon", "good evening", "morning", "evening",
+    "whats up", "what's up", "how are you", "how are you doing", "hows it going", "how's it going",
+    "thanks", "thank you", "thx", "ok", "okay", "cool", "test", "testing",
+}
+FILLER_WORDS = {"there", "assistant", "bot", "chatbot", "llama", "again", "all", "everyone", "friend", "buddy"}
+
+def is_greeting(message: str) -> bool:
+    """Cheap check for messages with no topic to title, such as "hi there!"."""
+    words = [word for word in re.sub(r"[^\w\s']", " ", message.lower()).split() if word not in FILLER_WORDS]
+    if len(words) > 4:
+        return False
+    return not words or " ".join(words) in GREETINGS
+
+class _Job:
+    __slots__ = ("message", "rename")
+
+    def __init__(self, message, rename):
+        self.message = message
+        self.rename = rename
+
+class TitleWorker:
+    """Long-lived background worker that generates session titles.
+
+    Jobs run as asyncio tasks on the shared runtime event loop, so submitting
+    never blocks the caller. At most one job per session is pending at a time:
+    a newer submission replaces the pending one, and a submission for a
+    session whose job is already running is picked up once that job finishes.
+    Greetings are titled "New Chat" without calling the LLM.
+    """
+
+    def __init__(self, concurrency=TITLE_WORKER_CONCURRENCY):
+        self._concurrency = concurrency
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._running = set()
+        self._idle = threading.Condition(self._lock)
+        self._loop = None
+        self._queue = None
+        self.stats = {"submitted": 0, "coalesced": 0, "skipped_greetings": 0, "completed": 0, "failed": 0}
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._loop is not None:
+                return
+            self._loop = get_loop()
+            self._queue = asyncio.Queue()
+            for _ in range(self._concurrency):
+                asyncio.run_coroutine_threadsafe(self._work(), self._loop)
+
+    def submit(self, session_id: str, message: str, rename: bool = False):
+        """Queue title generation for a session; returns immediately."""
+        self._ensure_started()
+        with self._lock:
+            self.stats["submitted"] += 1
+            already_queued = session_id in self._pending or session_id in self._running
+            if session_id in self._pending:
+                self.stats["coalesced"] += 1
+                rename = rename and self._pending[session_id].rename  # keep create semantics if one was pending
+            self._pending[session_id] = _Job(message, rename)
+        if not already_queued:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, session_id)
+
+    def cancel(self, session_id: str):
+        """Drop any pending (not yet running) job for the session."""
+        with self._lock:
+            self._pending.pop(session_id, None)
+            self._idle.notify_all()
+
+    async def _work(self):
+        while True:
+            session_id = await self._queue.get()
+            with self._lock:
+                job = self._pending.pop(session_id, None)
+                if job is None:
+                    continue
+                self._running.add(session_id)
+            try:
+                await self._generate(session_id, job)
+                self.stats["completed"] += 1
+            except Exception:
+                self.stats["failed"] += 1
+                logger.exception("Title generation failed for session %s", session_id)
+            finally:
+                with self._lock:
+                    self._running.discard(session_id)
+                    if session_id in self._pending:  # submitted while we were running
+                        self._queue.put_nowait(session_id)
+                    self._idle.notify_all()
+
+    async def _generate(self, session_id, job):
+        if is_greeting(job.message):
+            self.stats["skipped_greetings"] += 1
+            if not job.rename:
+                await astore_title_in_db(session_id, DEFAULT_TITLE)
+            return
+        if job.rename:
+            await rename_session(session_id, job.message)
+        else:
+            await create_session_title(session_id, job.message)
+
+    def wait_idle(self, timeout=None) -> bool:
+        """Block until no jobs are pending or running. Return False on timeout."""
+        with self._lock:
+            return self._idle.wait_for(lambda: not self._pending and not self._running, timeout)
+
+TITLE_WORKER = TitleWorker()
+
+register_collector(lambda: (
+    (f"title_worker_{key}", f"Title worker jobs {key}.", {}, value) for key, value in TITLE_WORKER.stats.items()
+))
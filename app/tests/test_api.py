@@ -0,0 +1,180 @@
+import asyncio
+import json
+import uuid
+from datetime import datetime, timezone
+from unittest.mock import patch, Mock, AsyncMock
+import pytest
+
+from tornado.testing import AsyncHTTPTestCase
+from tornado.simple_httpclient import HTTPTimeoutError
+
+from app.api import server
+
+SESSION_ID = "11111111-1111-1111-1111-111111111111"
+
+def _chunk(content, usage=None):
+    return Mock(content=content, usage_metadata=usage)
+
+async def _stream(chunks):
+    for chunk in chunks:
+        yield chunk
+
+async def _cancelled_stream():
+    yield _chunk("Hi")
+    asyncio.current_task().cancel()  # as GENERATIONS.cancel() does from the cancel endpoint
+    await asyncio.sleep(0)
+
+async def _busy_stream():
+    raise server.SchedulerOverloaded("full")
+    yield
+
+def _events(body):
+    events = []
+    for block in body.decode().strip().split("\n\n"):
+        event, data = block.split("\n")
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+class ApiTest(AsyncHTTPTestCase):
+    def get_app(self):
+        return server.make_app()
+
+    def test_ready(self):
+        readiness = {"ready": False, "db": True, "model": False, "timings": {}}
+        with patch.object(server.STARTUP, "readiness", new=AsyncMock(return_value=readiness)):
+            response = self.fetch("/api/ready")
+        assert response.code == 503
+        assert json.loads(response.body) == readiness
+
+    def test_create_session(self):
+        response = self.fetch("/api/sessions", method="POST", body="")
+        assert response.code == 201
+        uuid.UUID(json.loads(response.body)["session_id"])
+
+    def test_list_sessions_returns_next_cursor(self):
+        last_activity = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        page = [{"session_id": SESSION_ID, "title": "Title", "last_activity": last_activity, "message_count": 2}]
+        with patch("app.api.server.alist_session_catalog", new=AsyncMock(return_value=page)) as mock_list:
+            response = self.fetch("/api/sessions?limit=1")
+        body = json.loads(response.body)
+        assert body["sessions"][0]["last_activity"] == last_activity.isoformat()
+        assert body["next"] == {"before_ts": last_activity.isoformat(), "before_id": SESSION_ID}
+        mock_list.assert_called_once_with(limit=1, before=None)
+
+    def test_list_sessions_parses_cursor(self):
+        with patch("app.api.server.alist_session_catalog", new=AsyncMock(return_value=[])) as mock_list:
+            response = self.fetch(f"/api/sessions?before_ts=2025-01-01T00:00:00%2B00:00&before_id={SESSION_ID}")
+        assert json.loads(response.body) == {"sessions": [], "next": None}
+        before = mock_list.call_args.kwargs["before"]
+        assert before == (datetime(2025, 1, 1, tzinfo=timezone.utc), SESSION_ID)
+
+    def test_search_returns_results_and_cursor(self):
+        results = [{"session_id": SESSION_ID, "title": "Title", "rank": 0.5, "matches": 2,
+                    "snippets": [{"id": 3, "type": "ai", "text": "a **gin** index"}]}]
+        with patch("app.api.server.asearch_chats", new=AsyncMock(return_value=results)) as mock_search:
+            response = self.fetch("/api/search?q=gin&limit=1")
+        body = json.loads(response.body)
+        assert body["results"] == results
+        assert body["next"] == {"before_rank": 0.5, "before_id": SESSION_ID}
+        mock_search.assert_called_once_with("gin", limit=1, before=None)
+
+    def test_search_rejects_invalid_cursor(self):
+        response = self.fetch(f"/api/search?q=gin&before_rank=high&before_id={SESSION_ID}")
+        assert response.code == 400
+
+    def test_session_events_stream(self):
+        chunks = []
+        publish = lambda: server.SESSION_EVENTS.publish({"event": "deleted", "session_id": SESSION_ID})
+        self.io_loop.call_later(0.2, publish)
+        with pytest.raises(HTTPTimeoutError):  # the stream stays open until the client leaves
+            self.fetch("/api/sessions/events", streaming_callback=chunks.append, request_timeout=0.5)
+        body = b"".join(chunks).decode()
+        assert body.startswith(": connected")
+        assert "event: deleted" in body and SESSION_ID in body
+
+    def test_get_messages_page(self):
+        page = ([{"id": 7, "type": "human", "content": "Hi"}], 7)
+        with patch("app.api.server.aget_message_page", new=AsyncMock(return_value=page)) as mock_page:
+            response = self.fetch(f"/api/sessions/{SESSION_ID}/messages?before=10&limit=1")
+        assert json.loads(response.body) == {"messages": page[0], "next_before": 7}
+        mock_page.assert_called_once_with(SESSION_ID, 10, 1, None)
+
+    def test_invalid_session_id(self):
+        response = self.fetch("/api/sessions/not-a-uuid/messages")
+        assert response.code == 400
+        assert json.loads(response.body) == {"error": "Invalid session id"}
+
+    def test_delete_session(self):
+        with patch("app.api.server.adelete_chat", new=AsyncMock()) as mock_delete, \
+             patch.object(server.TITLE_WORKER, "cancel") as mock_cancel, \
+             patch.object(server.GENERATIONS, "cancel") as mock_cancel_generations:
+            response = self.fetch(f"/api/sessions/{SESSION_ID}", method="DELETE")
+        assert response.code == 204
+        mock_cancel_generations.assert_called_once_with(SESSION_ID, server.DELETED)
+        mock_cancel.assert_called_once_with(SESSION_ID)
+        mock_delete.assert_called_once_with(SESSION_ID)
+
+    def test_stream_reply_as_server_sent_events(self):
+        chunks = [_chunk("Hi"), _chunk(" there"), _chunk("", usage={"input_tokens": 3, "output_tokens": 2})]
+        with patch("app.api.server.aget_response_stream", return_value=_stream(chunks)), \
+             patch("app.api.server.get_session_title", new=AsyncMock(return_value=None)), \
+             patch.object(server.TITLE_WORKER, "submit") as mock_submit:
+            response = self.fetch(f"/api/sessions/{SESSION_ID}/messages", method="POST", body=json.dumps({"content": "Hello"}))
+        assert response.code == 200
+        assert response.headers["Content-Type"] == "text/event-stream"
+        assert _events(response.body) == [
+            ("token", {"content": "Hi"}),
+            ("token", {"content": " there"}),
+            ("done", {"usage": {"input_tokens": 3, "output_tokens": 2}}),
+        ]
+        mock_submit.assert_called_once_with(SESSION_ID, "Hello")
+
+    def test_stream_commits_the_turn_before_done_with_several_workers(self):
+        self._app.settings["commit_replies"] = True
+        writer = Mock(aflush=AsyncMock(return_value=True))
+        with patch("app.api.server.aget_response_stream", return_value=_stream([_chunk("Hi")])), \
+             patch("app.api.server.get_session_title", new=AsyncMock(return_value="Title")), \
+             patch("app.api.server.HISTORY_WRITER", writer):
+            response = self.fetch(f"/api/sessions/{SESSION_ID}/messages", method="POST", body=json.dumps({"content": "Hello"}))
+        assert _events(response.body)[-1][0] == "done"
+        writer.aflush.assert_awaited_once_with(server.WRITE_BEHIND_REPLY_TIMEOUT)
+
+    def test_stream_coalesces_tokens_into_fewer_events(self):
+        chunks = [_chunk(text) for text in ["a", "b", "c", "d"]]
+        with patch("app.api.server.aget_response_stream", return_value=_stream(chunks)), \
+             patch("app.api.server.get_session_title", new=AsyncMock(return_value="Title")):
+            response = self.fetch(f"/api/sessions/{SESSION_ID}/messages", method="POST", body=json.dumps({"content": "Hello"}))
+        assert _events(response.body) == [("token", {"content": "a"}), ("token", {"content": "bcd"}), ("done", {"usage": None})]
+
+    def test_stream_renames_default_titled_session(self):
+        history = ([{"type": "human", "content": "hi"}, {"type": "ai", "content": "hello"}], None)
+        with patch("app.api.server.aget_response_stream", return_value=_stream([_chunk("ok")])), \
+             patch("app.api.server.get_session_title", new=AsyncMock(return_value="New Chat")), \
+             patch("app.api.server.aget_message_page", new=AsyncMock(return_value=history)), \
+             patch.object(server.TITLE_WORKER, "submit") as mock_submit:
+            self.fetch(f"/api/sessions/{SESSION_ID}/messages", method="POST", body=json.dumps({"content": "Hello"}))
+        mock_submit.assert_called_once_with(SESSION_ID, "human: hi\nai: hello", rename=True)
+
+    def test_cancel_session_replies(self):
+        with patch.object(server.GENERATIONS, "cancel", return_value=1) as mock_cancel:
+            response = self.fetch(f"/api/sessions/{SESSION_ID}/cancel", method="POST", body="")
+        assert json.loads(response.body) == {"cancelled": 1}
+        mock_cancel.assert_called_once_with(SESSION_ID, server.USER)
+
+    def test_stream_reports_cancelled_reply(self):
+        with patch("app.api.server.aget_response_stream", return_value=_cancelled_stream()), \
+             patch("app.api.server.get_session_title", new=AsyncMock(return_value="Title")):
+            response = self.fetch(f"/api/sessions/{SESSION_ID}/messages", method="POST", body=json.dumps({"content": "Hello"}))
+        assert response.code == 200
+        assert _events(response.body) == [("token", {"content": "Hi"}), ("cancelled", {})]
+
+    def test_stream_reports_busy_before_streaming(self):
+        with patch("app.api.server.aget_response_stream", return_value=_busy_stream()), \
+             patch("app.api.server.get_session_title", new=AsyncMock(return_value="Title")):
+            response = self.fetch(f"/api/sessions/{SESSION_ID}/messages", method="POST", body=json.dumps({"content": "Hello"}))
+        assert response.code == 503
+        assert response.headers["Retry-After"] == str(server.BUSY_RETRY_AFTER)
+
+    def test_stream_requires_content(self):
+        response = self.fetch(f"/api/sessions/{SESSION_ID}/messages", method="POST", body=json.dumps({"content": " "}))
+        assert response.code == 400
@@ -0,0 +1,103 @@
+import json
+import httpx
+import pytest
+from app.services.api_client import ChatApiClient, ApiBusy, ApiError, iter_sse
+
+SESSION_ID = "11111111-1111-1111-1111-111111111111"
+
+def _sse(*events):
+    return "".join(f"event: {event}\ndata: {json.dumps(data)}\n\n" for event, data in events).encode()
+
+def _client(handler):
+    return ChatApiClient(base_url="http://api", transport=httpx.MockTransport(handler))
+
+def test_iter_sse():
+    lines = ["event: token", 'data: {"content": "Hi"}', "", ": comment", "event: done", "data: {}", ""]
+    assert list(iter_sse(lines)) == [("token", {"content": "Hi"}), ("done", {})]
+
+def test_stream_reply_yields_tokens():
+    def handler(request):
+        assert request.url.path == f"/api/sessions/{SESSION_ID}/messages"
+        assert json.loads(request.content) == {"content": "Hello"}
+        body = _sse(("token", {"content": "Hi"}), ("token", {"content": "!"}), ("done", {"usage": None}))
+        return httpx.Response(200, content=body, headers={"Content-Type": "text/event-stream"})
+
+    assert list(_client(handler).stream_reply(SESSION_ID, "Hello")) == ["Hi", "!"]
+
+def test_stream_reply_raises_busy():
+    client = _client(lambda request: httpx.Response(503, json={"error": "busy"}))
+    with pytest.raises(ApiBusy):
+        list(client.stream_reply(SESSION_ID, "Hello"))
+
+def test_stream_reply_raises_error_event():
+    client = _client(lambda request: httpx.Response(200, content=_sse(("token", {"content": "Hi"}), ("error", {"error": "boom"}))))
+    with pytest.raises(ApiError):
+        list(client.stream_reply(SESSION_ID, "Hello"))
+
+def test_stream_reply_raises_api_error_on_server_errors():
+    client = _client(lambda request: httpx.Response(500, text="Internal Server Error"))
+    with pytest.raises(ApiError):
+        list(client.stream_reply(SESSION_ID, "Hello"))
+
+def test_stream_reply_raises_api_error_when_the_connection_drops():
+    class DroppedStream(httpx.SyncByteStream):
+        def __iter__(self):
+            yield _sse(("token", {"content": "Hi"}))
+            raise httpx.ReadError("connection reset")
+
+    client = _client(lambda request: httpx.Response(200, stream=DroppedStream()))
+    stream = client.stream_reply(SESSION_ID, "Hello")
+    assert next(stream) == "Hi"
+    with pytest.raises(ApiError):
+        next(stream)
+
+def test_get_messages_sends_only_given_params():
+    def handler(request):
+        assert dict(request.url.params) == {"after": "5"}
+        return httpx.Response(200, json={"messages": [], "next_before": None})
+
+    assert _client(handler).get_messages(SESSION_ID, after=5) == {"messages": [], "next_before": None}
+
+def test_stream_reply_ends_on_cancelled_event():
+    client = _client(lambda request: httpx.Response(200, content=_sse(("token", {"content": "Hi"}), ("cancelled", {}))))
+    assert list(client.stream_reply(SESSION_ID, "Hello")) == ["Hi"]
+
+def test_cancel():
+    def handler(request):
+        assert request.method == "POST" and request.url.path == f"/api/sessions/{SESSION_ID}/cancel"
+        return httpx.Response(200, json={"cancelled": 1})
+
+    assert _client(handler).cancel(SESSION_ID) == 1
+
+def test_search_sends_query_and_cursor():
+    def handler(request):
+        assert request.url.path == "/api/search"
+        assert dict(request.url.params) == {"q": "gin index", "limit": "20", "before_rank": "0.5", "before_id": SESSION_ID}
+        return httpx.Response(200, json={"results": [], "next": None})
+
+    before = {"before_rank": 0.5, "before_id": SESSION_ID}
+    assert _client(handler).search("gin index", before=before) == {"results": [], "next": None}
+
+def test_session_events_yields_events_after_subscribing():
+    def handler(request):
+        assert request.url.path == "/api/sessions/events"
+        body = b": connected\n\n" + _sse(("deleted", {"event": "deleted", "session_id": SESSION_ID, "version": 1}))
+        return httpx.Response(200, content=body, headers={"Content-Type": "text/event-stream"})
+
+    events = list(_client(handler).session_events())
+    assert events == [None, {"event": "deleted", "session_id": SESSION_ID, "version": 1}]
+
+def test_busy_page_without_json_raises_busy():
+    client = _client(lambda request: httpx.Response(503, text="<html>Service Unavailable</html>"))
+    with pytest.raises(ApiBusy):
+        client.list_sessions()
+
+def test_refused_connection_raises_api_error():
+    def handler(request):
+        raise httpx.ConnectError("connection refused")
+
+    client = _client(handler)
+    for call in (client.list_sessions, lambda: client.get_session(SESSION_ID), lambda: client.get_messages(SESSION_ID),
+                 lambda: client.delete_session(SESSION_ID)):
+        with pytest.raises(ApiError):
+            call()
@@ -0,0 +1,118 @@
+import io
+import json
+from datetime import datetime, timezone
+from unittest.mock import MagicMock
+
+import pytest
+import zstandard
+
+from app.db import archive
+
+SESSION_A = "11111111-1111-1111-1111-111111111111"
+SESSION_B = "22222222-2222-2222-2222-222222222222"
+LAST_ACTIVITY = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+def _record(session_id, *contents):
+    return {
+        "session_id": session_id, "title": "Title", "created_at": "2025-01-01T00:00:00+00:00",
+        "last_activity": "2025-01-01T00:00:00+00:00", "message_count": len(contents), "prompt_tokens": 0,
+        "completion_tokens": 0, "summary": None, "summary_message_count": 0,
+        "messages": [{"role": "human", "content": content, "metadata": None, "created_at": "2025-01-01T00:00:00+00:00"}
+                     for content in contents],
+    }
+
+def _conn(batches, exported=(), deleted=None):
+    """Connection whose cursor returns `batches` of (session_id, last_activity, message_count) rows."""
+    cursor = MagicMock()
+    results = []
+    for batch in batches:
+        results.append(batch)
+        if deleted is not None:
+            results.append([(row[0],) for row in batch if row[0] in deleted])
+    results.append([])
+    cursor.fetchall.side_effect = results
+    copy = MagicMock()
+    copy.rows.side_effect = [iter([(json.dumps(record),) for record in records]) for records in exported]
+    cursor.copy.return_value.__enter__.return_value = copy
+    conn = MagicMock()
+    conn.cursor.return_value.__enter__.return_value = cursor
+    return conn, cursor, copy
+
+def test_export_writes_compressed_jsonl(tmp_path):
+    path = tmp_path / "sessions.jsonl.zst"
+    conn, cursor, _ = _conn(
+        [[(SESSION_A, LAST_ACTIVITY, 1)], [(SESSION_B, LAST_ACTIVITY, 2)]],
+        exported=[[_record(SESSION_A, "Hi")], [_record(SESSION_B, "Hello", "There")]],
+    )
+    progress = archive.Progress("export", out=None)
+
+    assert archive.archive_sessions(conn, str(path), batch_size=1, progress=progress) == 2
+
+    assert [record["session_id"] for record in archive.read_archive(path)] == [SESSION_A, SESSION_B]
+    assert (progress.sessions, progress.messages) == (2, 3)
+    assert progress.bytes > 0
+    batch_params = [call.args[1] for call in cursor.execute.call_args_list]
+    assert batch_params[1]["after_id"] == SESSION_A and batch_params[1]["cutoff"] is None
+    assert conn.commit.call_count == 3  # one transaction per batch
+
+def test_prune_deletes_only_still_inactive_sessions(tmp_path):
+    path = tmp_path / "old.jsonl.zst"
+    conn, cursor, _ = _conn(
+        [[(SESSION_A, LAST_ACTIVITY, 1), (SESSION_B, LAST_ACTIVITY, 2)]],
+        exported=[[_record(SESSION_A, "Hi"), _record(SESSION_B, "Hello", "There")]],
+        deleted={SESSION_A},
+    )
+
+    assert archive.archive_sessions(conn, str(path), inactive_days=30, delete=True) == 1
+
+    statements = [call.args[0].as_string(None) for call in cursor.execute.call_args_list]
+    assert "DELETE FROM \"sessions\"" in statements[1] and "last_activity <" in statements[1]
+    assert cursor.execute.call_args_list[2].args[1] == ([SESSION_A],)
+    assert len(list(archive.read_archive(path))) == 2
+
+def test_prune_requires_inactive_days():
+    with pytest.raises(ValueError):
+        archive.archive_sessions(MagicMock(), delete=True)
+
+def test_import_copies_new_sessions_and_skips_existing(tmp_path):
+    path = tmp_path / "sessions.jsonl.zst"
+    with open(path, "wb") as f:
+        writer = zstandard.ZstdCompressor().stream_writer(f)
+        for record in (_record(SESSION_A, "Hi"), _record(SESSION_B, "Hello"), _record(SESSION_B, "Hello", "There")):
+            writer.write(json.dumps(record).encode() + b"\n")
+        writer.close()
+    cursor = MagicMock()
+    cursor.fetchall.side_effect = [[], [(SESSION_B,)]]  # A already stored: its insert returns nothing
+    cursor.nextset.side_effect = [True, None]
+    copy = cursor.copy.return_value.__enter__.return_value
+    conn = MagicMock()
+    conn.cursor.return_value.__enter__.return_value = cursor
+
+    assert archive.import_sessions(conn, path) == 1
+
+    session_rows = cursor.executemany.call_args.args[1]
+    assert [row[0] for row in session_rows] == [SESSION_A, SESSION_B]  # B once, though the archive holds it twice
+    assert len(session_rows[0]) == len(archive.SESSION_FIELDS) + 1
+    assert "ON CONFLICT (session_id) DO NOTHING RETURNING" in cursor.executemany.call_args.args[0].as_string(None)
+    rows = [call.args[0] for call in copy.write_row.call_args_list]
+    assert [row[:3] for row in rows] == [(SESSION_B, "human", "Hello"), (SESSION_B, "human", "There")]
+
+def test_export_refuses_an_existing_file(tmp_path):
+    path = tmp_path / "sessions.jsonl.zst"
+    path.write_bytes(b"earlier export")
+    with pytest.raises(FileExistsError):
+        archive.archive_sessions(MagicMock(), str(path))
+    with pytest.raises(SystemExit):
+        archive.main(["export", str(path)])
+    assert path.read_bytes() == b"earlier export"
+
+def test_progress_reports_throughput():
+    now = [0.0]
+    out = io.StringIO()
+    progress = archive.Progress("export", out=out, interval=1.0, clock=lambda: now[0])
+    progress.add(sessions=10, messages=100, nbytes=2_000_000)
+    assert out.getvalue() == ""
+    now[0] = 2.0
+    progress.add(sessions=10, messages=100)
+    assert "20 sessions, 200 messages" in out.getvalue()
+    assert "10 sessions/s" in out.getvalue()
@@ -0,0 +1,93 @@
+import asyncio
+import time
+import pytest
+from langchain_ollama import ChatOllama
+from app.bench.fake_ollama import FakeOllamaServer, FakeOllamaConfig
+from app.bench.loadgen import percentile, summarize, compare
+from app.core.scheduler import OllamaScheduler
+from app.bench.render_cost import measure
+from app.bench.message_storage import make_messages, measure_encoding
+from app.bench.prompt_prefix import make_conversation, measure_reuse
+
+@pytest.fixture
+def fake_ollama():
+    server = FakeOllamaServer(config=FakeOllamaConfig(ttft=0.0, tokens_per_second=10000)).start()
+    yield server
+    server.stop()
+
+def test_fake_ollama_streams_chat(fake_ollama):
+    llm = ChatOllama(model="llama3.2", base_url=fake_ollama.url)
+    chunks = list(llm.stream("hello there"))
+    assert len(chunks) > 2
+    assert "".join(chunk.content for chunk in chunks).startswith("Sure!")
+    assert chunks[-1].usage_metadata["input_tokens"] == 2
+    assert fake_ollama.requests[0][0] == "/api/chat"
+
+def test_fake_ollama_respects_num_predict(fake_ollama):
+    llm = ChatOllama(model="llama3.2", base_url=fake_ollama.url, num_predict=3)
+    assert llm.invoke("hi").content == "Sure! Here is"
+
+def test_fake_ollama_injects_errors():
+    server = FakeOllamaServer(config=FakeOllamaConfig(error_rate=1.0)).start()
+    try:
+        with pytest.raises(Exception):
+            ChatOllama(model="llama3.2", base_url=server.url).invoke("hi")
+    finally:
+        server.stop()
+
+@pytest.mark.asyncio
+async def test_closing_stream_aborts_ollama_request():
+    server = FakeOllamaServer(config=FakeOllamaConfig(ttft=0.0, tokens_per_second=50)).start()
+    try:
+        llm = ChatOllama(model="llama3.2", base_url=server.url)
+        stream = OllamaScheduler().astream(llm, "hello")
+        await anext(stream)
+        await stream.aclose()
+        deadline = time.monotonic() + 2
+        while server.disconnects == 0 and time.monotonic() < deadline:
+            await asyncio.sleep(0.02)
+        assert server.disconnects == 1  # the fake model stopped generating mid-reply
+    finally:
+        server.stop()
+
+def test_percentile():
+    samples = list(range(1, 101))
+    assert percentile(samples, 50) == 50
+    assert percentile(samples, 95) == 95
+    assert percentile(samples, 99) == 99
+    assert percentile([], 50) is None
+    assert summarize([10.0])["p99_ms"] == 10.0
+
+def test_compare_flags_regressions():
+    baseline = {
+        "operations": {"chat_turn": {"p95_ms": 100.0}, "list_sessions": {"p95_ms": 5.0}},
+        "throughput_turns_per_s": 10.0,
+        "db_queries_per_turn": 8.0,
+    }
+    report = {
+        "operations": {"chat_turn": {"p95_ms": 150.0}, "list_sessions": {"p95_ms": 5.5}},
+        "throughput_turns_per_s": 9.5,
+        "db_queries_per_turn": 8.0,
+    }
+    regressions = compare(report, baseline, tolerance=0.2)
+    assert len(regressions) == 1
+    assert regressions[0].startswith("chat_turn")
+
+def test_render_cost_counts_stream_updates():
+    options = dict(messages=6, window=2, tokens=40, token_interval=0.0, flush_interval=10.0, flush_bytes=64, runs=1)
+    per_token = measure(coalesced=False, **options)
+    coalesced = measure(coalesced=True, **options)
+    assert per_token["stream_updates"] == 40
+    assert coalesced["stream_updates"] < per_token["stream_updates"]
+    assert coalesced["rendered_kchars"] < per_token["rendered_kchars"]
+    assert per_token["markdown_elements"] == 3  # the window and the streamed reply
+
+def test_message_storage_compact_format_is_smaller():
+    report = measure_encoding(make_messages(40, long_fraction=0.2, long_words=200), runs=1)
+    assert report["compact"]["bytes_per_message"] < report["legacy"]["bytes_per_message"]
+    assert report["compact"]["decoded_per_s"] > 0 and report["legacy"]["decoded_per_s"] > 0
+
+def test_stable_window_reuses_more_of_the_prompt():
+    report = measure_reuse(make_conversation(40))
+    assert report["stable"]["reused_token_share"] > report["sliding"]["reused_token_share"]
+    assert report["stable"]["evaluated_tokens_per_turn"] < report["sliding"]["evaluated_tokens_per_turn"]
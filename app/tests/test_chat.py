@@ -1,5 +1,7 @@
+import asyncio
 import pytest
-from unittest.mock import patch, Mock
+from datetime import datetime, timezone
+from unittest.mock import patch, Mock, MagicMock, AsyncMock
 from app.services import chat
 
 @pytest.fixture
@@ -26,34 +28,163 @@ def test_get_response_stream(mock_session_id):
         assert result == ["Hi", " there", "!"]
         mock_chain.stream.assert_called_once()
 
-def test_get_chat_history(mock_session_id):
-    mock_history = Mock()
-    mock_history.messages = [
-        Mock(type="human", content="Hello"),
-        Mock(type="ai", content="Hi!")
-    ]
-    with patch("app.services.chat.get_session_history", return_value=mock_history):
-        result = chat.get_chat_history(mock_session_id)
-        assert result == [{"type": "human", "content": "Hello"}, {"type": "ai", "content": "Hi!"}]
+def _async_pool(rows):
+    mock_cursor = Mock()
+    mock_cursor.fetchall = AsyncMock(return_value=rows)
+    mock_pool = MagicMock()
+    mock_conn = mock_pool.connection.return_value.__aenter__.return_value
+    mock_conn.execute = AsyncMock(return_value=mock_cursor)
+    return mock_pool, mock_conn
 
 def test_list_sessions():
-    mock_cursor = Mock()
-    mock_cursor.fetchall.return_value = [("session1",), ("session2",)]
-    mock_connection = Mock()
-    mock_connection.cursor.return_value = mock_cursor
+    mock_pool, mock_conn = _async_pool([("session1",), ("session2",)])
 
-    with patch("app.services.chat.SYNC_CONNECTION", mock_connection):
+    with patch("app.services.chat.get_async_pool", new=AsyncMock(return_value=mock_pool)):
         result = chat.list_sessions()
         assert result == ["session1", "session2"]
-        mock_cursor.execute.assert_called_once()
+        mock_conn.execute.assert_awaited_once()
 
 def test_delete_chat(mock_session_id):
     mock_history = Mock()
-    with patch("app.services.chat.get_session_history", return_value=mock_history):
+    mock_history.aclear = AsyncMock()
+    with patch("app.services.chat.get_session_history", return_value=mock_history), \
+         patch.object(chat.HISTORY_CACHE, "invalidate") as mock_invalidate, \
+         patch("app.services.chat.forget_session") as mock_forget:
         chat.delete_chat(mock_session_id)
-        mock_history.clear.assert_called_once()
+        mock_history.aclear.assert_awaited_once()
+        mock_invalidate.assert_called_once_with(mock_session_id)
+        mock_forget.assert_called_once_with(mock_session_id)
 
 def test_get_session_history(mock_session_id):
-    with patch("app.services.chat.PostgresChatMessageHistory") as mock_cls:
+    with patch("app.services.chat.PooledPostgresChatMessageHistory") as mock_cls, \
+         patch("app.services.chat.get_pool"):
         chat.get_session_history(mock_session_id)
         mock_cls.assert_called_once()
+
+def test_list_session_catalog():
+    last_activity = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    mock_pool, mock_conn = _async_pool([("session1", "Title", last_activity, 4)])
+
+    with patch("app.services.chat.get_async_pool", new=AsyncMock(return_value=mock_pool)):
+        result = chat.list_session_catalog(limit=10, before=(last_activity, "session0"))
+        assert result == [{"session_id": "session1", "title": "Title", "last_activity": last_activity, "message_count": 4}]
+        mock_conn.execute.assert_awaited_once()
+        params = mock_conn.execute.call_args.args[1]
+        assert params == {"before_ts": last_activity, "before_id": "session0", "limit": 10}
+
+def test_catalog_cursor():
+    last_activity = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    page = [{"session_id": "a", "last_activity": last_activity}, {"session_id": "b", "last_activity": last_activity}]
+    assert chat.catalog_cursor(page, limit=2) == (last_activity, "b")
+    assert chat.catalog_cursor(page, limit=3) is None
+
+def test_get_response_stream_records_prompt_tokens(mock_session_id):
+    final_chunk = Mock(content="!", usage_metadata={"input_tokens": 42, "output_tokens": 3})
+    mock_chain = Mock()
+    mock_chain.stream.return_value = [Mock(content="Hi", usage_metadata=None), final_chunk]
+    with patch("app.services.chat.CHAIN_WITH_HISTORY", mock_chain):
+        list(chat.get_response_stream(mock_session_id, "Hello"))
+    assert chat.get_context_stats(mock_session_id)["prompt_tokens"] == 42
+
+@pytest.mark.asyncio
+async def test_aget_response_stream(mock_session_id):
+    async def astream(*args, **kwargs):
+        for chunk in [Mock(content="Hi", usage_metadata=None), Mock(content="!", usage_metadata={"input_tokens": 7, "output_tokens": 2})]:
+            yield chunk
+
+    mock_chain = Mock()
+    mock_chain.astream = astream
+    with patch("app.services.chat.CHAIN_WITH_HISTORY", mock_chain):
+        chunks = [chunk.content async for chunk in chat.aget_response_stream(mock_session_id, "Hello")]
+    assert chunks == ["Hi", "!"]
+    assert chat.get_context_stats(mock_session_id)["prompt_tokens"] == 7
+
+@pytest.mark.asyncio
+async def test_aget_message_page(mock_session_id):
+    mock_history = Mock()
+    mock_history.aget_message_rows = AsyncMock(return_value=[(5, Mock(type="human", content="a")), (6, Mock(type="ai", content="b"))])
+    with patch("app.services.chat.get_session_history", return_value=mock_history):
+        messages, cursor = await chat.aget_message_page(mock_session_id, before_id=9, limit=2)
+    assert messages == [{"id": 5, "type": "human", "content": "a"}, {"id": 6, "type": "ai", "content": "b"}]
+    assert cursor == 5
+    mock_history.aget_message_rows.assert_awaited_once_with(before_id=9, limit=2)
+
+@pytest.mark.asyncio
+async def test_cancelled_reply_stores_partial_message(mock_session_id):
+    async def astream(*args, **kwargs):
+        yield Mock(content="Hi", usage_metadata=None)
+        await asyncio.Event().wait()  # the model is still generating
+
+    mock_chain = Mock()
+    mock_chain.astream = astream
+    mock_history = Mock()
+    mock_history.aadd_messages = AsyncMock()
+    received = []
+
+    async def consume():
+        async for chunk in chat.aget_response_stream(mock_session_id, "Hello"):
+            received.append(chunk.content)
+
+    with patch("app.services.chat.CHAIN_WITH_HISTORY", mock_chain), \
+         patch("app.services.chat.get_session_history", return_value=mock_history):
+        task = asyncio.create_task(consume())
+        while not received:
+            await asyncio.sleep(0)
+        assert chat.GENERATIONS.cancel(mock_session_id) == 1
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    human, ai = mock_history.aadd_messages.await_args.args[0]
+    assert (human.content, ai.content) == ("Hello", "Hi")
+    assert ai.response_metadata == {"cancelled": True, "cancel_reason": "user"}
+    assert chat.GENERATIONS.active(mock_session_id) == 0
+
+def test_abandoned_reply_stores_partial_message(mock_session_id):
+    mock_chain = Mock()
+    mock_chain.stream.return_value = iter([Mock(content="Hi", usage_metadata=None), Mock(content="!", usage_metadata=None)])
+    mock_history = Mock()
+    with patch("app.services.chat.CHAIN_WITH_HISTORY", mock_chain), \
+         patch("app.services.chat.get_session_history", return_value=mock_history):
+        stream = chat.get_response_stream(mock_session_id, "Hello")
+        next(stream)
+        stream.close()
+
+    human, ai = mock_history.add_messages.call_args.args[0]
+    assert ai.content == "Hi"
+    assert ai.response_metadata["cancel_reason"] == "disconnect"
+
+def test_search_chats_ignores_blank_queries():
+    with patch("app.services.chat.asearch_sessions", new=AsyncMock()) as mock_search:
+        assert chat.search_chats("   ") == []
+        mock_search.assert_not_awaited()
+
+def test_search_chats_strips_query():
+    results = [{"session_id": "a", "rank": 0.5}]
+    with patch("app.services.chat.asearch_sessions", new=AsyncMock(return_value=results)) as mock_search:
+        assert chat.search_chats(" indexes ", limit=5) == results
+        mock_search.assert_awaited_once_with("indexes", limit=5, before=None)
+
+def test_search_cursor():
+    results = [{"session_id": "a", "rank": 0.9}, {"session_id": "b", "rank": 0.4}]
+    assert chat.search_cursor(results, limit=2) == (0.4, "b")
+    assert chat.search_cursor(results, limit=3) is None
+
+def test_handle_session_event_stops_replies_and_titles_of_deleted_sessions():
+    generation = chat.GENERATIONS.start("s1")
+    with patch.object(chat.TITLE_WORKER, "cancel") as mock_cancel_title, \
+         patch("app.services.chat.forget_session"):
+        chat.handle_session_event({"event": "deleted", "session_id": "s1"})
+    assert generation.cancelled and not generation.persist_partial
+    mock_cancel_title.assert_called_once_with("s1")
+    chat.GENERATIONS.finish(generation)
+
+def test_handle_session_event_forgets_deleted_sessions():
+    with patch.object(chat.HISTORY_CACHE, "invalidate") as mock_invalidate, \
+         patch.object(chat.HISTORY_CACHE, "clear") as mock_clear, \
+         patch("app.services.chat.forget_session") as mock_forget:
+        chat.handle_session_event({"event": "deleted", "session_id": "s1"})
+        chat.handle_session_event({"event": "title", "session_id": "s2", "title": "Hi"})
+        chat.handle_session_event({"event": "resync"})
+    mock_invalidate.assert_called_once_with("s1")
+    mock_forget.assert_called_once_with("s1")
+    mock_clear.assert_called_once()
@@ -1,5 +1,5 @@
 import pytest
-from unittest.mock import patch, Mock, AsyncMock
+from unittest.mock import patch, Mock, AsyncMock, MagicMock
 from app.services import chat_sessions
 
 @pytest.fixture
@@ -16,98 +16,94 @@ def mock_llm_response():
     mock_response.content = "Generated Title"
     return mock_response
 
+@pytest.fixture
+def mock_async_pool():
+    pool = MagicMock()
+    conn = MagicMock()
+    conn.execute = AsyncMock()
+    pool.connection.return_value.__aenter__.return_value = conn
+    return pool
+
 @pytest.mark.asyncio
 async def test_create_session_title(mock_session_id, mock_llm_response):
-    with patch("app.services.chat_sessions.ChatOllama") as mock_llm_class, \
-         patch("app.services.chat_sessions.get_session_title_prompt") as mock_prompt, \
-         patch("app.services.chat_sessions.run_in_thread", new=AsyncMock()) as mock_run:
-
-        # Simulate LLM instance
-        mock_llm = Mock()
-        mock_llm_class.return_value = mock_llm
-
-        # Simulate prompt and chain
-        mock_prompt_obj = Mock()
-        mock_prompt.return_value = mock_prompt_obj
-
-        mock_chain = Mock()
-        mock_prompt_obj.__or__ = lambda self, other: mock_chain  # simulate prompt | llm
-
-        mock_run.side_effect = [mock_llm_response, None]
+    mock_chain = Mock()
+    with patch("app.services.chat_sessions.get_session_title_chain", return_value=mock_chain), \
+         patch.object(chat_sessions.SCHEDULER, "ainvoke", new=AsyncMock(return_value=mock_llm_response)) as mock_run, \
+         patch("app.services.chat_sessions.astore_title_in_db", new=AsyncMock()) as mock_store:
 
         title = await chat_sessions.create_session_title(mock_session_id, "Hello")
         assert title == "Generated Title"
+        assert mock_run.call_args_list[0].args[0] is mock_chain  # shared chain, not rebuilt per call
+        mock_store.assert_awaited_once_with(mock_session_id, "Generated Title")
 
 
 @pytest.mark.asyncio
 async def test_rename_session(mock_session_id, mock_llm_response):
-    with patch("app.services.chat_sessions.ChatOllama") as mock_llm_class, \
-         patch("app.services.chat_sessions.get_session_title_prompt") as mock_prompt, \
-         patch("app.services.chat_sessions.run_in_thread", new=AsyncMock()) as mock_run:
-
-        # Simulate LLM instance
-        mock_llm = Mock()
-        mock_llm_class.return_value = mock_llm
-
-        # Simulate prompt and chain
-        mock_prompt_obj = Mock()
-        mock_prompt.return_value = mock_prompt_obj
-
-        mock_chain = Mock()
-        mock_prompt_obj.__or__ = lambda self, other: mock_chain  # simulate prompt | llm
-
-        mock_run.side_effect = [mock_llm_response, None]
+    mock_chain = Mock()
+    with patch("app.services.chat_sessions.get_session_title_chain", return_value=mock_chain), \
+         patch.object(chat_sessions.SCHEDULER, "ainvoke", new=AsyncMock(return_value=mock_llm_response)), \
+         patch("app.services.chat_sessions.aupdate_title_in_db", new=AsyncMock()) as mock_update:
 
         new_title = await chat_sessions.rename_session(mock_session_id, "Some messages")
         assert new_title == "Generated Title"
+        mock_update.assert_awaited_once_with(mock_session_id, "Generated Title")
 
 
-def test_store_title_in_db(mock_session_id, mock_title):
-    with patch("app.services.chat_sessions.get_connection") as mock_conn:
-        mock_cursor = Mock()
-        mock_conn.return_value.cursor.return_value = mock_cursor
+def test_store_title_in_db(mock_session_id, mock_title, mock_async_pool):
+    with patch("app.services.chat_sessions.get_async_pool", new=AsyncMock(return_value=mock_async_pool)):
+        mock_conn = mock_async_pool.connection.return_value.__aenter__.return_value
 
         chat_sessions.store_title_in_db(mock_session_id, mock_title)
 
-        mock_cursor.execute.assert_called_once()
-        mock_conn.return_value.commit.assert_called_once()
-        mock_cursor.close.assert_called_once()
+        mock_conn.execute.assert_awaited_once()
+        assert mock_conn.execute.call_args.args[1] == (mock_title, mock_session_id)
+        # an UPDATE, never an upsert: must not re-create a deleted session
+        assert mock_conn.execute.call_args.args[0].as_string(None) == 'UPDATE "sessions" SET title = %s WHERE session_id = %s'
+        mock_async_pool.connection.assert_called_once()
 
-def test_update_title_in_db(mock_session_id, mock_title):
-    with patch("app.services.chat_sessions.get_connection") as mock_conn:
-        mock_cursor = Mock()
-        mock_conn.return_value.cursor.return_value = mock_cursor
+def test_store_title_commits_a_queued_first_turn_first(mock_session_id, mock_title, mock_async_pool):
+    writer = Mock(pending=Mock(return_value=["queued"]), aflush=AsyncMock(return_value=True))
+    with patch("app.services.chat_sessions.get_async_pool", new=AsyncMock(return_value=mock_async_pool)), \
+         patch("app.services.chat_sessions.MESSAGE_WRITER", writer):
+        chat_sessions.store_title_in_db(mock_session_id, mock_title)
+    writer.aflush.assert_awaited_once()
+
+def test_update_title_in_db(mock_session_id, mock_title, mock_async_pool):
+    with patch("app.services.chat_sessions.get_async_pool", new=AsyncMock(return_value=mock_async_pool)):
+        mock_conn = mock_async_pool.connection.return_value.__aenter__.return_value
 
         chat_sessions.update_title_in_db(mock_session_id, mock_title)
 
-        mock_cursor.execute.assert_called_once()
-        mock_conn.return_value.commit.assert_called_once()
-        mock_cursor.close.assert_called_once()
+        mock_conn.execute.assert_awaited_once()
+        assert mock_conn.execute.call_args.args[1] == (mock_title, mock_session_id)
 
-def test_get_title_from_db(mock_session_id, mock_title):
-    with patch("app.services.chat_sessions.get_connection") as mock_conn:
+def test_get_title_from_db(mock_session_id, mock_title, mock_async_pool):
+    with patch("app.services.chat_sessions.get_async_pool", new=AsyncMock(return_value=mock_async_pool)):
         mock_cursor = Mock()
-        mock_cursor.fetchone.return_value = (mock_title,)
-        mock_conn.return_value.cursor.return_value = mock_cursor
+        mock_cursor.fetchone = AsyncMock(return_value=(mock_title,))
+        mock_async_pool.connection.return_value.__aenter__.return_value.execute.return_value = mock_cursor
 
         title = chat_sessions.get_title_from_db(mock_session_id)
         assert title == mock_title
 
 @pytest.mark.asyncio
-async def test_get_session_title(mock_session_id, mock_title):
-    with patch("app.services.chat_sessions.get_title_from_db", return_value=mock_title):
-        title = await chat_sessions.get_session_title(mock_session_id)
-        assert title == mock_title
+async def test_get_session_title(mock_session_id, mock_title, mock_async_pool):
+    with patch("app.services.chat_sessions.get_async_pool", new=AsyncMock(return_value=mock_async_pool)):
+        mock_cursor = Mock()
+        mock_cursor.fetchone = AsyncMock(return_value=None)
+        mock_async_pool.connection.return_value.__aenter__.return_value.execute.return_value = mock_cursor
+
+        assert await chat_sessions.get_session_title(mock_session_id) is None
 
 @pytest.mark.asyncio
-async def test_delete_session_title(mock_session_id):
-    with patch("app.services.chat_sessions._delete_session_title_sync") as mock_del:
+async def test_delete_session_title(mock_session_id, mock_async_pool):
+    with patch("app.services.chat_sessions.get_async_pool", new=AsyncMock(return_value=mock_async_pool)):
         await chat_sessions.delete_session_title(mock_session_id)
-        mock_del.assert_called_once_with(mock_session_id)
+        mock_conn = mock_async_pool.connection.return_value.__aenter__.return_value
+        mock_conn.execute.assert_awaited_once()
+        assert mock_conn.execute.call_args.args[1] == (mock_session_id,)
 
 def test_get_session_title_sync(mock_session_id, mock_title):
-    with patch("app.services.chat_sessions.get_title_from_db", return_value=mock_title):
+    with patch("app.services.chat_sessions.get_session_title", new=AsyncMock(return_value=mock_title)):
         title = chat_sessions.get_session_title_sync(mock_session_id)
         assert title == mock_title
-
-
@@ -0,0 +1,46 @@
+import pytest
+from unittest.mock import patch, Mock, MagicMock
+from app.db import connection
+from app.db.history import PooledPostgresChatMessageHistory
+
+@pytest.fixture
+def mock_session_id():
+    return "11111111-1111-1111-1111-111111111111"
+
+def test_get_pool_is_shared():
+    with patch("app.db.connection.ConnectionPool") as mock_pool_cls, \
+         patch("app.db.connection._pool", None):
+        first = connection.get_pool()
+        second = connection.get_pool()
+        assert first is second
+        mock_pool_cls.assert_called_once()
+        kwargs = mock_pool_cls.call_args.kwargs
+        assert kwargs["min_size"] == connection.DB_POOL_MIN_SIZE
+        assert kwargs["max_size"] == connection.DB_POOL_MAX_SIZE
+        assert kwargs["max_idle"] == connection.DB_POOL_MAX_IDLE
+        assert kwargs["check"] is not None
+
+def test_get_pool_stats():
+    mock_pool = Mock()
+    mock_pool.get_stats.return_value = {"requests_num": 3, "requests_wait_ms": 12}
+    with patch("app.db.connection._pool", mock_pool), \
+         patch("app.db.connection._async_pools", {}):
+        assert connection.get_pool_stats() == {"sync": {"requests_num": 3, "requests_wait_ms": 12}}
+
+def test_pooled_history_borrows_connection_per_call(mock_session_id):
+    mock_pool = MagicMock()
+    mock_cursor = MagicMock()
+    mock_cursor.fetchall.return_value = []
+    mock_conn = mock_pool.connection.return_value.__enter__.return_value
+    mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+
+    history = PooledPostgresChatMessageHistory("chat_history", mock_session_id, pool=mock_pool)
+    assert history.messages == []
+    history.clear()
+
+    assert mock_pool.connection.call_count == 2
+    assert history._connection is None
+
+def test_pooled_history_rejects_invalid_session_id():
+    with pytest.raises(ValueError):
+        PooledPostgresChatMessageHistory("chat_history", "not-a-uuid", pool=Mock())
@@ -0,0 +1,99 @@
+import pytest
+from unittest.mock import patch, Mock
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from app.core import context
+
+@pytest.fixture
+def history():
+    messages = []
+    for i in range(10):
+        messages.append(HumanMessage(content=f"question {i} " + "word " * 40))
+        messages.append(AIMessage(content=f"answer {i} " + "word " * 40))
+    return messages
+
+def test_full_keeps_everything(history):
+    assert context.select_context("s1", history, strategy="full") == history
+
+def test_last_n_turns(history):
+    with patch("app.core.context.CONTEXT_LAST_N_TURNS", 2):
+        result = context.select_context("s1", history, strategy="last_n")
+    assert result == history[-4:]
+
+def test_token_budget_starts_on_user_message(history):
+    with patch("app.core.context.CONTEXT_TOKEN_BUDGET", 150):
+        result = context.select_context("s1", history, strategy="token_budget")
+    assert result
+    assert result[0].type == "human"
+    assert result == history[-len(result):]
+    assert sum(context.count_message_tokens(m) for m in result) <= 150
+
+def test_summary_reuses_stored_summary_and_schedules_refresh(history):
+    with patch("app.core.context.CONTEXT_LAST_N_TURNS", 2), \
+         patch("app.core.context.get_session_summary", return_value=("They talked about words.", 4)), \
+         patch.object(context.summary_pool, "submit") as mock_submit:
+        context.forget_session("s1")
+        result = context.select_context("s1", history, strategy="summary")
+
+    assert isinstance(result[0], SystemMessage)
+    assert "They talked about words." in result[0].content
+    assert result[1:] == history[-4:]
+    mock_submit.assert_called_once()
+    _, session_id, previous, messages, covered = mock_submit.call_args.args
+    assert previous == "They talked about words."
+    assert messages == history[4:16]
+    assert covered == 16
+    context.forget_session("s1")
+
+def test_apply_context_strategy_records_stats(history):
+    with patch("app.core.context.CONTEXT_STRATEGY", "last_n"), \
+         patch("app.core.context.CONTEXT_LAST_N_TURNS", 1):
+        result = context.apply_context_strategy({"history": history, "user_input": "hi"}, {"configurable": {"session_id": "s2"}})
+    assert result["history"] == history[-2:]
+    assert result["user_input"] == "hi"
+    stats = context.context_stats["s2"]
+    assert stats["history_messages"] == 20 and stats["context_messages"] == 2
+    assert stats["context_tokens"] < stats["history_tokens"]
+
+def test_window_start_stays_put_until_the_window_overflows(history):
+    context.forget_session("s3")
+    with patch("app.core.context.CONTEXT_LAST_N_TURNS", 4), patch("app.core.context.CONTEXT_PREFIX_SLACK", 0.5):
+        windows = [context.select_context("s3", history[:end], strategy="last_n") for end in (12, 14, 16, 18, 20)]
+    assert windows[0] == history[4:12]
+    assert windows[1] == history[10:14]  # overflowing jumps ahead by the slack, not by one turn
+    assert windows[2] == history[10:16] and windows[3] == history[10:18]  # so the next turns keep the same start
+    assert windows[4] == history[16:20]
+    context.forget_session("s3")
+
+def test_stable_token_budget_window_stays_within_budget(history):
+    context.forget_session("s3")
+    starts = []
+    with patch("app.core.context.CONTEXT_TOKEN_BUDGET", 600), patch("app.core.context.CONTEXT_PREFIX_SLACK", 0.5):
+        for end in range(2, len(history) + 1, 2):
+            window = context.select_context("s3", history[:end], strategy="token_budget")
+            assert sum(context.count_message_tokens(m) for m in window) <= 600 and window[0].type == "human"
+            starts.append(end - len(window))
+    assert len(set(starts)) < len(starts) // 2  # the start moved on far fewer turns than it would sliding
+    context.forget_session("s3")
+
+def test_record_prompt_measures_the_prefix_shared_with_the_last_prompt():
+    context.forget_session("s4")
+    system = SystemMessage(content="You are helpful.")
+    turn = [system, HumanMessage(content="question 1")]
+    assert context.record_prompt("s4", turn)[0] == 0
+    sent_before = dict(context.prefix_stats)
+
+    prefix_tokens, prompt_tokens = context.record_prompt("s4", turn + [AIMessage(content="answer 1"), HumanMessage(content="question 2")])
+    assert prefix_tokens == sum(context.count_message_tokens(m) for m in turn) < prompt_tokens
+    assert context.prefix_stats["prefix_kept"] == sent_before["prefix_kept"] + 1
+    assert context.record_prompt("s4", [system, HumanMessage(content="question 2")])[0] == context.count_message_tokens(system)
+    assert context.context_stats["s4"]["prefix_messages"] == 1
+    context.forget_session("s4")
+
+def test_session_state_keeps_only_the_most_recently_used_sessions():
+    sessions = context.SessionLRU(max_sessions=2)
+    sessions["a"] = 1
+    sessions["b"] = 2
+    assert sessions["a"] == 1  # a is now the most recently used
+    sessions.setdefault("c", {})["tokens"] = 3
+    assert "b" not in sessions and len(sessions) == 2
+    assert sessions.get("c") == {"tokens": 3} and sessions.pop("a") == 1
@@ -0,0 +1,58 @@
+import asyncio
+import pytest
+from app.services.generations import GenerationTracker, USER, DISCONNECT, DELETED
+
+def test_cancel_marks_session_generations():
+    tracker = GenerationTracker()
+    first, second = tracker.start("s1"), tracker.start("s1")
+    other = tracker.start("s2")
+    assert tracker.cancel("s1", USER) == 2
+    assert first.cancelled and second.cancelled and not other.cancelled
+    assert first.reason == USER
+    assert tracker.cancel("s1") == 0  # already cancelled
+
+def test_aborted_records_reason_and_seconds_saved():
+    tracker = GenerationTracker()
+    tracker._avg_tokens, tracker._avg_rate = 100.0, 10.0
+    generation = tracker.start("s1")
+    generation.cancel(USER)
+    assert tracker.aborted(generation, completion_tokens=40) == pytest.approx(6.0)
+    assert tracker.stats["cancelled"] == 1
+    assert tracker.stats["seconds_saved"] == pytest.approx(6.0)
+    assert tracker.cancel_reasons == {USER: 1}
+    assert tracker.active() == 0
+
+def test_abandoned_generation_counts_as_disconnect():
+    tracker = GenerationTracker()
+    tracker._avg_tokens = 10.0
+    generation = tracker.start("s1")
+    assert tracker.aborted(generation, completion_tokens=50) == 0.0  # longer than average, nothing saved
+    assert tracker.cancel_reasons == {DISCONNECT: 1}
+
+def test_finish_updates_running_averages():
+    tracker = GenerationTracker()
+    tracker._avg_tokens, tracker._avg_rate = 100.0, 10.0
+    tracker.finish(tracker.start("s1"), completion_tokens=200, seconds=10.0)
+    assert tracker._avg_tokens == pytest.approx(110.0)
+    assert tracker._avg_rate == pytest.approx(11.0)
+    assert tracker.stats["finished"] == 1
+    assert tracker.active("s1") == 0
+
+def test_deleted_session_drops_partial():
+    generation = GenerationTracker().start("s1")
+    generation.cancel(DELETED)
+    assert not generation.persist_partial
+
+@pytest.mark.asyncio
+async def test_cancel_task_cancels_consumer():
+    tracker = GenerationTracker()
+
+    async def consume():
+        tracker.start("s1")
+        await asyncio.sleep(10)
+
+    task = asyncio.create_task(consume())
+    await asyncio.sleep(0)
+    assert tracker.cancel_task(task) == 1
+    with pytest.raises(asyncio.CancelledError):
+        await task
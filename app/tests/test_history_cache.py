@@ -0,0 +1,60 @@
+import asyncio
+from unittest.mock import AsyncMock, Mock
+from app.services.history_cache import HistoryCache
+
+def make_rows(start, end):
+    return [(i, Mock(type="human", content=f"message {i}")) for i in range(start, end)]
+
+def contents(messages):
+    return [message.content for message in messages]
+
+def test_first_read_loads_the_session_then_only_new_rows():
+    history = Mock()
+    history.get_message_rows.side_effect = [make_rows(1, 10), make_rows(10, 11)]
+    cache = HistoryCache()
+
+    assert len(cache.get("s1", history)) == 9
+    assert contents(cache.get("s1", history))[-2:] == ["message 9", "message 10"]
+
+    first, second = history.get_message_rows.call_args_list
+    assert first.kwargs == {"after_id": None}
+    assert second.kwargs == {"after_id": 9}
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+def test_async_read_is_incremental():
+    history = Mock()
+    history.aget_message_rows = AsyncMock(side_effect=[make_rows(1, 3), []])
+    cache = HistoryCache()
+
+    asyncio.run(cache.aget("s1", history))
+    assert contents(asyncio.run(cache.aget("s1", history))) == ["message 1", "message 2"]
+    assert history.aget_message_rows.await_args.kwargs == {"after_id": 2}
+
+def test_queued_messages_are_returned_but_not_cached():
+    history = Mock()
+    queued = (None, Mock(type="ai", content="queued"))
+    history.get_message_rows.side_effect = [make_rows(1, 2) + [queued], make_rows(2, 3)]
+    cache = HistoryCache()
+
+    assert contents(cache.get("s1", history)) == ["message 1", "queued"]
+    assert contents(cache.get("s1", history)) == ["message 1", "message 2"]
+    assert history.get_message_rows.call_args.kwargs == {"after_id": 1}
+
+def test_invalidate_forces_a_full_read():
+    history = Mock()
+    history.get_message_rows.return_value = make_rows(1, 2)
+    cache = HistoryCache()
+    cache.get("s1", history)
+    cache.invalidate("s1")
+    cache.get("s1", history)
+    assert history.get_message_rows.call_args.kwargs == {"after_id": None}
+    assert cache.stats()["bytes"] == 209
+
+def test_evicts_least_recently_used_over_budget():
+    history = Mock()
+    history.get_message_rows.return_value = make_rows(1, 2)
+    cache = HistoryCache(max_bytes=250)
+    cache.get("s1", history)
+    cache.get("s2", history)
+    assert cache.stats()["sessions"] == 1
+    assert cache.stats()["bytes"] <= 250
@@ -0,0 +1,28 @@
+import os
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+from services.api_client import API_CLIENT, ApiError
+
+MAIN = os.path.join(os.path.dirname(__file__), "..", "main.py")
+
+def test_first_load_with_an_empty_cache(monkeypatch):
+    monkeypatch.setattr(API_CLIENT, "list_sessions", lambda limit=20, before=None: {"sessions": [], "next": None})
+    monkeypatch.setattr(API_CLIENT, "session_events", lambda stop=None: iter([None]))
+    st.cache_resource.clear()  # the first run after the UI starts builds the event hub
+
+    app = AppTest.from_file(MAIN).run()
+
+    assert not app.exception
+    assert app.title[0].value == "Hi! How can I help you today?"
+
+def test_shows_an_error_when_the_api_is_down(monkeypatch):
+    def list_sessions(limit=20, before=None):
+        raise ApiError("GET /api/sessions failed: connection refused")
+
+    monkeypatch.setattr(API_CLIENT, "list_sessions", list_sessions)
+    monkeypatch.setattr(API_CLIENT, "session_events", lambda stop=None: iter([None]))
+
+    app = AppTest.from_file(MAIN).run()
+
+    assert not app.exception
+    assert "unavailable" in app.error[0].value
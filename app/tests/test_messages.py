@@ -0,0 +1,116 @@
+import json
+from unittest.mock import MagicMock, patch
+
+import psycopg
+import pytest
+from langchain_core.messages import AIMessageChunk, HumanMessage
+
+from app.db import messages
+from app.db.history import PooledPostgresChatMessageHistory
+
+@pytest.fixture
+def mock_session_id():
+    return "11111111-1111-1111-1111-111111111111"
+
+def test_message_to_row_keeps_only_what_is_read_back():
+    chunk = AIMessageChunk(
+        content="Hi!",
+        id="run-1234",
+        response_metadata={"model": "llama3.2", "created_at": "2025-01-01T00:00:00Z", "done": True,
+                           "total_duration": 123456789, "eval_duration": 1234567, "eval_count": 4},
+        usage_metadata={"input_tokens": 12, "output_tokens": 4, "total_tokens": 16},
+    )
+    role, content, metadata = messages.message_to_row(chunk)
+    assert (role, content) == ("ai", "Hi!")
+    assert json.loads(metadata) == {"usage": {"input_tokens": 12, "output_tokens": 4}, "model": "llama3.2"}
+
+def test_human_message_has_no_metadata():
+    assert messages.message_to_row(HumanMessage(content="Hello")) == ("human", "Hello", None)
+
+def test_row_to_message_round_trip():
+    chunk = AIMessageChunk(content="Hi!", response_metadata={"model": "llama3.2", "cancelled": True},
+                           usage_metadata={"input_tokens": 12, "output_tokens": 4, "total_tokens": 16})
+    role, content, metadata = messages.message_to_row(chunk)
+    message = messages.row_to_message(role, content, json.loads(metadata))
+    assert message.type == "ai" and message.content == "Hi!"
+    assert message.usage_metadata == {"input_tokens": 12, "output_tokens": 4, "total_tokens": 16}
+    assert message.response_metadata == {"model": "llama3.2", "cancelled": True}
+
+def test_non_text_content_round_trips_as_json():
+    parts = [{"type": "text", "text": "Hello"}]
+    role, content, metadata = messages.message_to_row(HumanMessage(content=parts))
+    assert messages.row_to_message(role, content, json.loads(metadata)).content == parts
+
+def test_create_messages_table_survives_missing_lz4():
+    def execute(statement, *args):
+        if not isinstance(statement, str) and "COMPRESSION lz4" in statement.as_string(None):
+            raise psycopg.errors.FeatureNotSupported("compression method lz4 not supported")
+        return MagicMock(fetchone=MagicMock(return_value=(None,)))  # no legacy table
+
+    conn = MagicMock()
+    conn.execute.side_effect = execute
+    messages.create_messages_table(conn)
+    statements = [call.args[0] for call in conn.execute.call_args_list]
+    assert "CREATE TABLE IF NOT EXISTS" in statements[0].as_string(None)
+    assert "COMPRESSION lz4" in statements[-1].as_string(None)
+
+def test_migrate_messages_copies_in_batches():
+    cursor = MagicMock()
+    cursor.fetchone.side_effect = [(100,), (150,), (None,)]
+    type(cursor).rowcount = property(lambda self: 50)
+    conn = MagicMock()
+    conn.cursor.return_value.__enter__.return_value = cursor
+    conn.execute.return_value.fetchone.return_value = ("chat_history",)
+
+    assert messages.migrate_messages(conn, batch_size=100) == 200
+
+    copies = [call.args[1] for call in cursor.execute.call_args_list if "ON CONFLICT" in call.args[0].as_string(None)]
+    assert copies == [(0, 100), (100, 150)]
+    statements = [call.args[0].as_string(None) for call in cursor.execute.call_args_list]
+    assert "ON CONFLICT (id) DO NOTHING" in statements[1]
+    assert "'AIMessageChunk' THEN 'ai'" in statements[1]
+
+def test_migrate_messages_copies_rows_whose_id_was_taken_under_a_new_id():
+    cursor = MagicMock()
+    cursor.fetchone.side_effect = [(100,), (None,)]
+    type(cursor).rowcount = property(lambda self: 3 if "NOT EXISTS" in self.execute.call_args.args[0].as_string(None) else 97)
+    conn = MagicMock()
+    conn.cursor.return_value.__enter__.return_value = cursor
+
+    with patch.object(messages.logger, "warning") as mock_warning:
+        assert messages.migrate_messages(conn, batch_size=100) == 100
+
+    collided = cursor.execute.call_args_list[2].args
+    assert collided[1] == (0, 100)
+    assert "INSERT INTO \"chat_messages\" (session_id, role, content, metadata, created_at)" in collided[0].as_string(None)
+    assert mock_warning.call_args.args[1] == 3
+
+def test_reserve_legacy_ids_never_moves_the_sequence_back():
+    conn = MagicMock()
+    conn.execute.return_value.fetchone.return_value = ("chat_history",)
+    messages.reserve_legacy_ids(conn)
+    assert "pg_sequence_last_value(seq::regclass)" in conn.execute.call_args.args[0].as_string(None)
+
+def test_history_reads_compact_rows(mock_session_id):
+    pool = MagicMock()
+    cursor = pool.connection.return_value.__enter__.return_value.cursor.return_value.__enter__.return_value
+    cursor.fetchall.return_value = [
+        (1, "human", "Hello", None),
+        (2, "ai", "Hi!", {"usage": {"input_tokens": 3, "output_tokens": 2}}),
+    ]
+    history = PooledPostgresChatMessageHistory("chat_messages", mock_session_id, pool=pool)
+
+    rows = history.get_message_rows()
+
+    assert [(message_id, message.type, message.content) for message_id, message in rows] == [(1, "human", "Hello"), (2, "ai", "Hi!")]
+    assert rows[1][1].usage_metadata["total_tokens"] == 5
+    assert "SELECT id, role, content, metadata" in cursor.execute.call_args.args[0].as_string(None)
+
+def test_history_inserts_typed_columns(mock_session_id):
+    pool = MagicMock()
+    cursor = pool.connection.return_value.__enter__.return_value.cursor.return_value.__enter__.return_value
+    with patch("app.db.history.record_messages"):
+        PooledPostgresChatMessageHistory("chat_messages", mock_session_id, pool=pool).add_messages([HumanMessage(content="Hello")])
+    query, values = cursor.executemany.call_args.args
+    assert "(session_id, role, content, metadata)" in query.as_string(None)
+    assert values == [(mock_session_id, "human", "Hello", None)]
@@ -0,0 +1,76 @@
+import time
+import urllib.request
+import pytest
+from unittest.mock import patch
+from app.core import metrics
+
+@pytest.fixture
+def enabled():
+    with patch("app.core.metrics.METRICS_ENABLED", True):
+        yield
+
+def test_histogram_renders_cumulative_buckets(enabled):
+    hist = metrics.Histogram("test_latency_seconds", "Test latency.", buckets=(0.1, 1))
+    hist.observe(0.05, op="a")
+    hist.observe(0.5, op="a")
+    hist.observe(5, op="a")
+    lines = hist.render()
+    assert 'test_latency_seconds_bucket{op="a",le="0.1"} 1' in lines
+    assert 'test_latency_seconds_bucket{op="a",le="1.0"} 2' in lines
+    assert 'test_latency_seconds_bucket{op="a",le="+Inf"} 3' in lines
+    assert 'test_latency_seconds_count{op="a"} 3' in lines
+
+def test_disabled_records_nothing():
+    hist = metrics.Histogram("test_disabled_seconds", "Test.")
+
+    @metrics.timed(hist, op="noop")
+    def noop():
+        return 1
+
+    with patch("app.core.metrics.METRICS_ENABLED", False):
+        assert noop() == 1
+    assert hist.samples({"op": "noop"}) == (0, 0.0)
+
+@pytest.mark.asyncio
+async def test_timed_supports_async(enabled):
+    hist = metrics.Histogram("test_async_seconds", "Test.")
+
+    @metrics.timed(hist, kind="create")
+    async def work():
+        return "done"
+
+    assert await work() == "done"
+    assert hist.samples({"kind": "create"})[0] == 1
+
+def test_observe_llm_response_prefers_ollama_timings(enabled):
+    result = metrics.observe_llm_response(
+        "chat", started=0.0, first_token_at=0.2, finished=1.2,
+        usage={"input_tokens": 30, "output_tokens": 50},
+        response_metadata={"eval_count": 50, "eval_duration": 500_000_000},
+    )
+    assert result["ttft_s"] == pytest.approx(0.2)
+    assert result["tokens_per_s"] == pytest.approx(100)
+    assert result["prompt_tokens"] == 30
+
+def test_metrics_endpoint_serves_collectors(enabled):
+    metrics.register_collector(lambda: [("test_queue_depth", "Test gauge.", {"pool": "sync"}, 3)])
+    with patch("app.core.metrics._server", None):
+        server = metrics.start_metrics_server(host="127.0.0.1", port=0)
+        try:
+            port = server.server_address[1]
+            body = urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics").read().decode()
+        finally:
+            server.shutdown()
+            server.server_close()
+    assert "# TYPE test_queue_depth gauge" in body
+    assert 'test_queue_depth{pool="sync"} 3' in body
+    assert "# TYPE llm_time_to_first_token_seconds histogram" in body
+
+def test_prompt_eval_time_and_reuse_are_recorded(enabled):
+    metadata = {"prompt_eval_count": 25, "prompt_eval_duration": 40_000_000}
+    result = metrics.observe_llm_response("chat", started=0.0, first_token_at=0.1, finished=1.0, response_metadata=metadata)
+    assert result["prompt_eval_s"] == pytest.approx(0.04)
+    assert metrics.PROMPT_EVAL_SECONDS.samples({"task": "chat"})[0] >= 1
+    assert metrics.observe_prompt_reuse("chat", 100, metadata) == pytest.approx(0.75)
+    assert metrics.observe_prompt_reuse("chat", 10, metadata) == 0.0  # estimates can undershoot ollama's count
+    assert metrics.observe_prompt_reuse("chat", None, metadata) is None
@@ -0,0 +1,150 @@
+import pytest
+from unittest.mock import patch, Mock, AsyncMock
+from langchain_core.messages import HumanMessage, AIMessage
+from app.services import chat
+from app.services.response_cache import ResponseCache, normalize_prompt, cache_key, replay
+
+SESSION_ID = "11111111-1111-1111-1111-111111111111"
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_normalize_prompt():
+    assert normalize_prompt("  What is   Python?? ") == "what is python"
+
+def test_cache_key_depends_on_history_and_namespace():
+    history = [HumanMessage(content="hi"), AIMessage(content="hello")]
+    assert cache_key("ns", "What is Python?") == cache_key("ns", "what is python")
+    assert cache_key("ns", "What is Python?") != cache_key("ns", "What is Python?", history)
+    assert cache_key("ns", "What is Python?") != cache_key("other", "What is Python?")
+
+def test_exact_hit_after_store():
+    cache = ResponseCache(max_entries=10, ttl=60, semantic=False)
+    lookup = cache.lookup("What is Python?")
+    assert lookup.response is None
+    cache.store(lookup, "A programming language.")
+
+    hit = cache.lookup("what is python")
+    assert (hit.response, hit.tier) == ("A programming language.", "exact")
+    assert cache.stats["exact_hits"] == 1 and cache.stats["misses"] == 1
+    assert cache.hit_rate() == 0.5
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = ResponseCache(max_entries=10, ttl=60, semantic=False, clock=clock)
+    cache.store(cache.lookup("question"), "answer")
+    clock.now = 61
+    assert cache.lookup("question").response is None
+    assert cache.stats["expired"] == 1
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(max_entries=2, ttl=60, semantic=False)
+    for question in ("a", "b"):
+        cache.store(cache.lookup(question), question.upper())
+    cache.lookup("a")  # refresh a
+    cache.store(cache.lookup("c"), "C")
+    assert cache.lookup("b").response is None
+    assert cache.lookup("a").response == "A"
+    assert cache.stats["evictions"] == 1
+
+def test_semantic_tier_used_for_first_messages_only():
+    cache = ResponseCache(max_entries=10, ttl=60, semantic=True, similarity=0.9, max_history=2)
+    embeddings = Mock()
+    embeddings.embed_query.return_value = [0.1, 0.2]
+    with patch("app.services.response_cache.get_embeddings", return_value=embeddings), \
+         patch("app.services.response_cache.find_similar", return_value=("Cached answer", 0.95)) as mock_find:
+        hit = cache.lookup("How do I reverse a list?")
+        assert (hit.response, hit.tier) == ("Cached answer", "semantic")
+        assert mock_find.call_args.args[2] == 0.9
+
+        miss = cache.lookup("And sort it?", [HumanMessage(content="hi"), AIMessage(content="hello")])
+        assert miss.response is None
+        mock_find.assert_called_once()
+
+    # the semantic hit was promoted to the exact tier
+    assert cache.lookup("how do i reverse a list").tier == "exact"
+
+def test_semantic_store_keeps_embedding():
+    cache = ResponseCache(max_entries=10, ttl=60, semantic=True)
+    embeddings = Mock()
+    embeddings.embed_query.return_value = [0.1, 0.2]
+    with patch("app.services.response_cache.get_embeddings", return_value=embeddings), \
+         patch("app.services.response_cache.find_similar", return_value=None), \
+         patch("app.services.response_cache.store_response") as mock_store:
+        lookup = cache.lookup("question")
+        cache.store(lookup, "answer")
+    assert mock_store.call_args.args[1:4] == ("question", [0.1, 0.2], "answer")
+    embeddings.embed_query.assert_called_once()
+
+def test_replay_reassembles_answer():
+    answer = "Python is a  programming\nlanguage.\n"
+    chunks = list(replay(answer))
+    assert len(chunks) == 5
+    assert "".join(chunk.content for chunk in chunks) == answer
+
+def test_get_response_stream_replays_cache_hit():
+    cache = ResponseCache(max_entries=10, ttl=60, semantic=False)
+    cache.store(cache.lookup("What is Python?"), "A language.")
+    mock_history = Mock()
+    mock_history.get_message_rows.return_value = []
+    mock_chain = Mock()
+    with patch("app.services.chat.RESPONSE_CACHE_ENABLED", True), \
+         patch("app.services.chat.RESPONSE_CACHE", cache), \
+         patch("app.services.chat.get_session_history", return_value=mock_history), \
+         patch("app.services.chat.CHAIN_WITH_HISTORY", mock_chain):
+        chunks = list(chat.get_response_stream(SESSION_ID, "what is python"))
+
+    assert "".join(chunk.content for chunk in chunks) == "A language."
+    mock_chain.stream.assert_not_called()
+    stored = mock_history.add_messages.call_args.args[0]
+    assert [(msg.type, msg.content) for msg in stored] == [("human", "what is python"), ("ai", "A language.")]
+    assert stored[1].response_metadata == {"cached": True}  # told apart from generated replies in history
+
+def test_get_response_stream_stores_miss():
+    cache = ResponseCache(max_entries=10, ttl=60, semantic=False)
+    mock_history = Mock()
+    mock_history.get_message_rows.return_value = []
+    mock_chain = Mock()
+    mock_chain.stream.return_value = [Mock(content="Hi", usage_metadata=None), Mock(content="!", usage_metadata=None)]
+    with patch("app.services.chat.RESPONSE_CACHE_ENABLED", True), \
+         patch("app.services.chat.RESPONSE_CACHE", cache), \
+         patch("app.services.chat.get_session_history", return_value=mock_history), \
+         patch("app.services.chat.CHAIN_WITH_HISTORY", mock_chain):
+        list(chat.get_response_stream(SESSION_ID, "Hello there"))
+
+    assert cache.lookup("hello there").response == "Hi!"
+
+def test_long_history_bypasses_cache():
+    cache = ResponseCache(max_entries=10, ttl=60, semantic=False, max_history=0)
+    mock_history = Mock()
+    mock_history.get_message_rows.return_value = [(1, HumanMessage(content="hi"))]
+    mock_chain = Mock()
+    mock_chain.stream.return_value = [Mock(content="ok", usage_metadata=None)]
+    with patch("app.services.chat.RESPONSE_CACHE_ENABLED", True), \
+         patch("app.services.chat.RESPONSE_CACHE", cache), \
+         patch("app.services.chat.get_session_history", return_value=mock_history), \
+         patch("app.services.chat.CHAIN_WITH_HISTORY", mock_chain):
+        list(chat.get_response_stream(SESSION_ID, "Hello"))
+
+    assert cache.stats["lookups"] == 0
+    assert cache.stats["stores"] == 0
+
+@pytest.mark.asyncio
+async def test_aget_response_stream_replays_cache_hit():
+    cache = ResponseCache(max_entries=10, ttl=60, semantic=False)
+    cache.store(cache.lookup("What is Python?"), "A language.")
+    mock_history = Mock()
+    mock_history.aget_message_rows = AsyncMock(return_value=[])
+    mock_history.aadd_messages = AsyncMock()
+    with patch("app.services.chat.RESPONSE_CACHE_ENABLED", True), \
+         patch("app.services.chat.RESPONSE_CACHE", cache), \
+         patch("app.services.chat.get_session_history", return_value=mock_history):
+        chunks = [chunk.content async for chunk in chat.aget_response_stream(SESSION_ID, "What is Python?")]
+
+    assert "".join(chunks) == "A language."
+    mock_history.aadd_messages.assert_awaited_once()
+    assert mock_history.aadd_messages.call_args.args[0][1].response_metadata == {"cached": True}
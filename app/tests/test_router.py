@@ -0,0 +1,70 @@
+import pytest
+from unittest.mock import Mock
+from langchain_ollama import ChatOllama
+from app.bench.fake_ollama import FakeOllamaServer, FakeOllamaConfig
+from app.core.router import ModelRouter, ModelRoute, route_from_env, TITLE, CHAT
+
+@pytest.fixture
+def fake_ollama():
+    server = FakeOllamaServer(config=FakeOllamaConfig(ttft=0.0, tokens_per_second=10000), strict_models=True).start()
+    yield server
+    server.stop()
+
+def test_route_from_env(monkeypatch):
+    monkeypatch.setenv("TITLE_MODELS", "qwen2.5:0.5b, llama3.2")
+    monkeypatch.setenv("TITLE_NUM_PREDICT", "12")
+    monkeypatch.setenv("TITLE_NUM_CTX", "1024")
+    route = route_from_env(TITLE, "llama3.2", {"num_predict": 24, "temperature": 0.2})
+    assert route.models == ["qwen2.5:0.5b", "llama3.2"]
+    assert route.options == {"num_predict": 12, "temperature": 0.2, "num_ctx": 1024}
+
+def test_route_defaults_without_env():
+    route = route_from_env("unknown_task", "llama3.2", {"temperature": 0.1})
+    assert route.models == ["llama3.2"] and route.options == {"temperature": 0.1}
+
+def test_llm_uses_route_options():
+    factory = Mock()
+    router = ModelRouter([ModelRoute(TITLE, ["tiny"], {"num_predict": 8})], llm_factory=factory)
+    assert router.llm(TITLE) is factory.return_value
+    factory.assert_called_once_with("tiny", num_predict=8)
+
+def test_falls_back_when_preferred_model_is_missing(fake_ollama):
+    router = ModelRouter(
+        [ModelRoute(TITLE, ["not-pulled", "llama3.2"], {"num_predict": 3})],
+        llm_factory=lambda model, **options: ChatOllama(model=model, base_url=fake_ollama.url, **options),
+    )
+    response = router.llm(TITLE).invoke("hi")
+    assert response.content == "Sure! Here is"
+    assert [request["model"] for _, request in fake_ollama.requests] == ["not-pulled", "llama3.2"]
+    router.served(TITLE, response.response_metadata)
+    assert router.stats[TITLE] == {"requests": 1, "fallbacks": 1}
+
+def test_sessions_stick_to_one_backend():
+    backends = ["http://a:11434", "http://b:11434", "http://c:11434"]
+    router = ModelRouter([ModelRoute(CHAT, ["llama3.2"])], llm_factory=Mock(), backends=backends)
+    sessions = [f"session-{i}" for i in range(300)]
+    first = {session: router.backends_for(session)[0] for session in sessions}
+    assert first == {session: router.backends_for(session)[0] for session in sessions}
+    assert set(first.values()) == set(backends)  # spread over all of them
+
+    # removing a backend only moves the sessions that were on it
+    fewer = ModelRouter([ModelRoute(CHAT, ["llama3.2"])], llm_factory=Mock(), backends=backends[:2])
+    moved = [session for session in sessions if fewer.backends_for(session)[0] != first[session]]
+    assert moved and all(first[session] == backends[2] for session in moved)
+
+def test_session_llm_uses_its_backend_and_fails_over(fake_ollama):
+    router = ModelRouter(
+        [ModelRoute(CHAT, ["llama3.2"], {"num_predict": 3})],
+        llm_factory=lambda model, base_url=None, **options: ChatOllama(model=model, base_url=base_url, **options),
+        backends=["http://127.0.0.1:9", fake_ollama.url],  # nothing listens on the first
+    )
+    session = next(s for s in (f"s{i}" for i in range(100)) if router.backends_for(s)[0] == "http://127.0.0.1:9")
+    assert router.llm(CHAT, session_id=session).invoke("hi").content == "Sure! Here is"
+    assert router.llm(CHAT, session_id=session) is router.llm(CHAT, session_id=session)
+    assert router.backend_stats["http://127.0.0.1:9"] == 3
+
+def test_single_backend_keeps_the_default_url():
+    factory = Mock()
+    router = ModelRouter([ModelRoute(CHAT, ["llama3.2"])], llm_factory=factory, backends=["http://ollama:11434"])
+    router.llm(CHAT, session_id="s1")
+    factory.assert_called_once_with("llama3.2")
@@ -0,0 +1,43 @@
+import asyncio
+import threading
+from unittest.mock import patch, Mock
+from app.core import runtime
+
+def test_run_coroutine_uses_one_persistent_loop():
+    async def current_loop():
+        return asyncio.get_running_loop(), threading.current_thread().name
+
+    first_loop, thread_name = runtime.run_coroutine(current_loop())
+    second_loop, _ = runtime.run_coroutine(current_loop())
+    assert first_loop is second_loop
+    assert thread_name == "runtime-loop"
+    assert first_loop is runtime.get_loop()
+
+def test_get_llm_is_shared_per_model_and_options():
+    with patch("app.core.runtime.ChatOllama", side_effect=lambda **kwargs: Mock()) as mock_cls, \
+         patch.dict(runtime._llms, clear=True):
+        assert runtime.get_llm() is runtime.get_llm()
+        assert runtime.get_llm(num_predict=16) is not runtime.get_llm()
+        assert mock_cls.call_count == 2
+        limits = mock_cls.call_args.kwargs["client_kwargs"]["limits"]
+        assert limits.max_keepalive_connections == runtime.OLLAMA_MAX_CONNECTIONS
+
+def test_get_llm_sends_keep_alive():
+    with patch("app.core.runtime.ChatOllama", side_effect=lambda **kwargs: Mock()) as mock_cls, \
+         patch.dict(runtime._llms, clear=True):
+        runtime.get_llm()
+    assert mock_cls.call_args.kwargs["keep_alive"] == runtime.keep_alive_value()
+
+def test_keep_alive_value():
+    assert runtime.keep_alive_value("30m") == "30m"
+    assert runtime.keep_alive_value("-1") == -1
+    assert runtime.keep_alive_value("600") == 600
+
+def test_get_llm_sends_the_same_num_ctx_to_every_backend():
+    with patch("app.core.runtime.ChatOllama", side_effect=lambda **kwargs: Mock()) as mock_cls, \
+         patch.dict(runtime._llms, clear=True):
+        runtime.get_llm()
+        runtime.get_llm(base_url="http://other:11434")
+    first, second = mock_cls.call_args_list
+    assert first.kwargs["num_ctx"] == second.kwargs["num_ctx"] == runtime.OLLAMA_NUM_CTX
+    assert second.kwargs["base_url"] == "http://other:11434"
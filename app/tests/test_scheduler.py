@@ -0,0 +1,158 @@
+import asyncio
+import threading
+import time
+import pytest
+from unittest.mock import Mock
+from app.core.scheduler import OllamaScheduler, SchedulerOverloaded, SchedulerTimeout, INTERACTIVE, BACKGROUND
+
+def wait_for_queue(scheduler, depth):
+    deadline = time.monotonic() + 2
+    while scheduler.stats()["queue_depth"] < depth:
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+def test_runs_immediately_when_slot_free():
+    scheduler = OllamaScheduler(max_in_flight=1, max_queue=1)
+    runnable = Mock()
+    runnable.invoke.return_value = "ok"
+    assert scheduler.invoke(runnable, {"message": "hi"}) == "ok"
+    assert scheduler.stats()["in_flight"] == 0
+
+def test_interactive_is_admitted_before_background():
+    scheduler = OllamaScheduler(max_in_flight=1, max_queue=5)
+    scheduler.acquire(INTERACTIVE)
+    order = []
+
+    def worker(priority, name):
+        with scheduler.slot(priority):
+            order.append(name)
+
+    background = threading.Thread(target=worker, args=(BACKGROUND, "title"))
+    background.start()
+    wait_for_queue(scheduler, 1)
+    interactive = threading.Thread(target=worker, args=(INTERACTIVE, "chat"))
+    interactive.start()
+    wait_for_queue(scheduler, 2)
+
+    scheduler.release()
+    background.join(2)
+    interactive.join(2)
+    assert order == ["chat", "title"]
+    assert scheduler.stats()["priorities"]["background"]["wait_seconds_total"] > 0
+
+def test_full_queue_sheds_background_for_interactive():
+    scheduler = OllamaScheduler(max_in_flight=1, max_queue=1)
+    scheduler.acquire(INTERACTIVE)
+    errors = []
+
+    def background():
+        try:
+            scheduler.acquire(BACKGROUND)
+        except SchedulerOverloaded as exc:
+            errors.append(exc)
+
+    thread = threading.Thread(target=background)
+    thread.start()
+    wait_for_queue(scheduler, 1)
+
+    # queue is full of lower priority work, so a second background request is rejected outright
+    with pytest.raises(SchedulerOverloaded):
+        scheduler.acquire(BACKGROUND)
+
+    admitted = threading.Event()
+    interactive = threading.Thread(target=lambda: (scheduler.acquire(INTERACTIVE), admitted.set()))
+    interactive.start()
+    thread.join(2)
+    assert len(errors) == 1
+
+    scheduler.release()
+    interactive.join(2)
+    assert admitted.is_set()
+    assert scheduler.stats()["priorities"]["background"]["shed"] == 2
+
+def test_queue_timeout():
+    scheduler = OllamaScheduler(max_in_flight=1, max_queue=1)
+    scheduler.acquire(INTERACTIVE)
+    with pytest.raises(SchedulerTimeout):
+        scheduler.acquire(INTERACTIVE, timeout=0.01)
+    assert scheduler.stats()["queue_depth"] == 0
+    assert scheduler.stats()["priorities"]["interactive"]["timeouts"] == 1
+
+def test_stream_releases_slot_when_closed_early():
+    scheduler = OllamaScheduler(max_in_flight=1, max_queue=1)
+    runnable = Mock()
+    runnable.stream.return_value = iter(["a", "b", "c"])
+    stream = scheduler.stream(runnable, {})
+    assert next(stream) == "a"
+    assert scheduler.stats()["in_flight"] == 1
+    stream.close()
+    assert scheduler.stats()["in_flight"] == 0
+
+@pytest.mark.asyncio
+async def test_async_waiter_is_admitted_on_release():
+    scheduler = OllamaScheduler(max_in_flight=1, max_queue=2)
+    scheduler.acquire(INTERACTIVE)
+    waiter = asyncio.create_task(scheduler.aacquire(INTERACTIVE))
+    await asyncio.sleep(0.01)
+    assert scheduler.stats()["queue_depth"] == 1
+
+    threading.Thread(target=scheduler.release).start()
+    await asyncio.wait_for(waiter, 2)
+    assert scheduler.stats()["in_flight"] == 1
+    scheduler.release()
+
+@pytest.mark.asyncio
+async def test_async_waiter_times_out():
+    scheduler = OllamaScheduler(max_in_flight=1, max_queue=2)
+    scheduler.acquire(INTERACTIVE)
+    with pytest.raises(SchedulerTimeout):
+        await scheduler.aacquire(INTERACTIVE, timeout=0.01)
+    assert scheduler.stats()["queue_depth"] == 0
+    assert scheduler.stats()["priorities"]["interactive"]["timeouts"] == 1
+
+@pytest.mark.asyncio
+async def test_cancelled_async_waiter_leaves_the_queue():
+    scheduler = OllamaScheduler(max_in_flight=1, max_queue=2)
+    scheduler.acquire(INTERACTIVE)
+    waiter = asyncio.create_task(scheduler.aacquire(BACKGROUND))
+    await asyncio.sleep(0.01)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    assert scheduler.stats()["queue_depth"] == 0
+    scheduler.release()
+    assert scheduler.stats()["in_flight"] == 0
+
+@pytest.mark.asyncio
+async def test_astream_holds_slot_until_exhausted():
+    scheduler = OllamaScheduler(max_in_flight=1, max_queue=1)
+
+    async def astream(inputs, **kwargs):
+        assert scheduler.stats()["in_flight"] == 1
+        yield "a"
+        yield "b"
+
+    runnable = Mock()
+    runnable.astream = astream
+    assert [chunk async for chunk in scheduler.astream(runnable, {})] == ["a", "b"]
+    assert scheduler.stats()["in_flight"] == 0
+
+@pytest.mark.asyncio
+async def test_astream_closes_model_stream_when_closed_early():
+    closed = []
+
+    async def astream(*args, **kwargs):
+        try:
+            for chunk in ["a", "b"]:
+                yield chunk
+        finally:
+            closed.append(True)  # where the http request to ollama is aborted
+
+    scheduler = OllamaScheduler(max_in_flight=1, max_queue=1)
+    runnable = Mock()
+    runnable.astream = astream
+    stream = scheduler.astream(runnable, {})
+    assert await anext(stream) == "a"
+    await stream.aclose()
+    assert closed == [True]
+    assert scheduler.stats()["in_flight"] == 0
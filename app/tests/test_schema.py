@@ -0,0 +1,61 @@
+from unittest.mock import patch, MagicMock
+from app.db import schema
+
+def test_create_schema_runs_under_advisory_lock():
+    conn = MagicMock()
+    with patch("app.db.schema.create_messages_table") as mock_messages_table, \
+         patch("app.db.schema.create_response_cache_table") as mock_cache_table:
+        schema.create_schema(conn)
+    statements = [str(call.args[0]) for call in conn.execute.call_args_list]
+    assert "pg_advisory_lock" in statements[0]
+    assert "pg_advisory_unlock" in statements[-1]
+    assert any("CREATE TABLE IF NOT EXISTS" in statement for statement in statements)
+    mock_messages_table.assert_called_once_with(conn)
+    mock_cache_table.assert_not_called()
+
+def test_ensure_schema_runs_once_per_process():
+    with patch("app.db.schema.get_connection") as mock_connect, \
+         patch("app.db.schema.create_schema") as mock_create, \
+         patch("app.db.schema._schema_ready", False):
+        assert schema.ensure_schema() is True
+        assert schema.ensure_schema() is False
+        assert schema.schema_ready()
+    mock_connect.assert_called_once_with(autocommit=True)
+    mock_create.assert_called_once()
+
+def test_ensure_schema_runs_no_ddl_when_the_catalog_is_complete():
+    with patch("app.db.schema.get_connection"), \
+         patch("app.db.schema.missing_schema", return_value=set()), \
+         patch("app.db.schema.create_schema") as mock_create, \
+         patch("app.db.schema._schema_ready", False):
+        assert schema.ensure_schema() is True
+    mock_create.assert_not_called()
+
+def test_create_schema_only_adds_what_is_missing():
+    conn = MagicMock()
+    with patch("app.db.schema.missing_schema", return_value={"trg_chat_messages_content_tsv"}), \
+         patch("app.db.schema.create_messages_table") as mock_messages_table, \
+         patch("app.db.schema.create_sessions_table") as mock_sessions_table, \
+         patch("app.db.schema.create_search_columns") as mock_columns, \
+         patch("app.db.schema.create_search_indexes") as mock_indexes:
+        schema.create_schema(conn)
+    mock_messages_table.assert_not_called()
+    mock_sessions_table.assert_not_called()
+    mock_columns.assert_called_once_with(conn)
+    mock_indexes.assert_not_called()  # existing messages: left to python -m db.search
+
+def test_create_schema_adds_summary_columns_to_an_existing_sessions_table():
+    conn = MagicMock()
+    with patch("app.db.schema.missing_schema", return_value={"sessions.summary", "sessions.summary_message_count"}), \
+         patch("app.db.schema.create_sessions_table") as mock_sessions_table, \
+         patch("app.db.schema.add_summary_columns") as mock_add_columns:
+        schema.create_schema(conn)
+    mock_sessions_table.assert_not_called()
+    mock_add_columns.assert_called_once_with(conn)
+
+def test_missing_schema_reports_missing_columns():
+    conn = MagicMock()
+    conn.execute.return_value.fetchall.return_value = [
+        ("chat_messages",), ("sessions",), ("sessions.summary",), ("trg_sessions_notify",), ("trg_chat_messages_content_tsv",),
+    ]
+    assert schema.missing_schema(conn) == {"sessions.summary_message_count"}
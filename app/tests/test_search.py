@@ -0,0 +1,87 @@
+import asyncio
+from datetime import datetime, timezone
+from unittest.mock import patch, MagicMock, AsyncMock
+from app.db import search
+
+SESSION_A = "11111111-1111-1111-1111-111111111111"
+SESSION_B = "22222222-2222-2222-2222-222222222222"
+
+def _statements(conn):
+    return [call.args[0].as_string(None) if hasattr(call.args[0], "as_string") else call.args[0]
+            for call in conn.execute.call_args_list]
+
+def test_create_search_columns_adds_column_and_trigger():
+    conn = MagicMock()
+    search.create_search_columns(conn)
+    statements = _statements(conn)
+    assert "ADD COLUMN IF NOT EXISTS content_tsv tsvector" in statements[0]
+    assert "GENERATED" not in statements[0]  # a stored generated column would rewrite the table
+    assert "BEFORE INSERT OR UPDATE OF content" in statements[2]
+    assert len(statements) == 3
+
+def test_create_search_indexes_rebuilds_invalid_ones_concurrently():
+    conn = MagicMock()
+    conn.execute.return_value.fetchall.return_value = [("idx_chat_messages_content_tsv",)]
+    search.create_search_indexes(conn)
+    statements = _statements(conn)
+    assert "indisvalid" in statements[0]
+    assert statements[1] == 'DROP INDEX CONCURRENTLY IF EXISTS "idx_chat_messages_content_tsv"'
+    assert all("CREATE INDEX CONCURRENTLY" in statement and "gin" in statement for statement in statements[2:])
+    assert len(statements) == 4
+
+def test_new_tables_get_plain_search_indexes():
+    conn = MagicMock()
+    search.create_search_indexes(conn, concurrently=False)
+    statements = _statements(conn)
+    assert len(statements) == 2 and not any("CONCURRENTLY" in statement for statement in statements)
+
+def test_backfill_search_walks_batches_by_id():
+    conn = MagicMock()
+    conn.execute.return_value.fetchall.side_effect = [[(1,), (2,)], [(5,)], []]
+    progress = []
+    assert search.backfill_search(conn, batch_size=2, progress=progress.append) == 3
+    params = [call.args[1] for call in conn.execute.call_args_list]
+    assert [p["after_id"] for p in params] == [0, 2, 5]
+    assert all(p["batch_size"] == 2 for p in params)
+    assert progress == [2, 3]
+
+def test_asearch_sessions_groups_snippets_by_session():
+    last_activity = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    conn = MagicMock()
+    sessions_cursor, snippets_cursor = MagicMock(), MagicMock()
+    sessions_cursor.fetchall = AsyncMock(return_value=[
+        (SESSION_A, "Postgres tips", last_activity, 0.9, 3),
+        (SESSION_B, None, last_activity, 0.4, 1),
+    ])
+    snippets_cursor.fetchall = AsyncMock(return_value=[
+        (SESSION_A, 10, "human", "how do **indexes** work"),
+        (SESSION_A, 11, "ai", "**indexes** speed up reads"),
+        (SESSION_B, 20, "ai", "a GIN **index**"),
+    ])
+    conn.execute = AsyncMock(side_effect=[sessions_cursor, snippets_cursor])
+    pool = MagicMock()
+    pool.connection.return_value.__aenter__.return_value = conn
+
+    with patch("app.db.search.get_async_pool", new=AsyncMock(return_value=pool)):
+        results = asyncio.run(search.asearch_sessions("indexes", limit=2, before=(1.0, SESSION_B)))
+
+    assert [r["session_id"] for r in results] == [SESSION_A, SESSION_B]
+    assert [s["id"] for s in results[0]["snippets"]] == [10, 11]
+    assert results[1]["snippets"] == [{"id": 20, "type": "ai", "text": "a GIN **index**"}]
+    search_params = conn.execute.call_args_list[0].args[1]
+    assert search_params["query"] == "indexes"
+    assert (search_params["before_rank"], search_params["before_id"], search_params["limit"]) == (1.0, SESSION_B, 2)
+    snippet_params = conn.execute.call_args_list[1].args[1]
+    assert snippet_params["session_ids"] == [SESSION_A, SESSION_B]
+
+def test_asearch_sessions_skips_snippets_without_results():
+    conn = MagicMock()
+    cursor = MagicMock()
+    cursor.fetchall = AsyncMock(return_value=[])
+    conn.execute = AsyncMock(return_value=cursor)
+    pool = MagicMock()
+    pool.connection.return_value.__aenter__.return_value = conn
+
+    with patch("app.db.search.get_async_pool", new=AsyncMock(return_value=pool)):
+        assert asyncio.run(search.asearch_sessions("nothing")) == []
+    conn.execute.assert_awaited_once()
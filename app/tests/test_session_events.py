@@ -0,0 +1,140 @@
+import multiprocessing
+import queue
+import threading
+import uuid
+from unittest.mock import MagicMock
+
+import psycopg
+import pytest
+
+from app.db import notify
+from app.db.connection import get_conninfo
+from app.services import session_events
+from app.services.session_events import SessionEventHub, SessionEventListener, RESYNC
+
+SESSION_ID = "11111111-1111-1111-1111-111111111111"
+
+def test_hub_fans_out_and_versions_events():
+    hub = SessionEventHub()
+    received = []
+    unsubscribe = hub.subscribe(received.append)
+    hub.publish({"event": notify.CREATED, "session_id": SESSION_ID})
+    unsubscribe()
+    hub.publish({"event": notify.DELETED, "session_id": SESSION_ID})
+
+    assert [event["version"] for event in received] == [1]
+    events, complete = hub.since(1)
+    assert complete and [event["event"] for event in events] == [notify.DELETED]
+    assert hub.since(2) == ([], True)
+
+def test_hub_reports_dropped_events():
+    hub = SessionEventHub(max_events=2)
+    for _ in range(3):
+        hub.publish({"event": notify.TITLED, "session_id": SESSION_ID})
+    events, complete = hub.since(0)
+    assert [event["version"] for event in events] == [2, 3]
+    assert not complete
+    assert hub.since(1)[1]
+
+def test_failing_subscriber_does_not_stop_fan_out():
+    hub = SessionEventHub()
+    received = []
+    hub.subscribe(lambda event: 1 / 0)
+    hub.subscribe(received.append)
+    hub.publish({"event": notify.CREATED, "session_id": SESSION_ID})
+    assert len(received) == 1
+
+def test_listener_publishes_resync_after_reconnect():
+    hub = SessionEventHub()
+    received = []
+    done = threading.Event()
+    hub.subscribe(received.append)
+    connections = []
+
+    def source(stop):
+        connections.append(1)
+        yield None
+        if len(connections) == 1:
+            yield {"event": notify.CREATED, "session_id": SESSION_ID}
+            raise psycopg.OperationalError("server closed the connection")
+        yield {"event": notify.DELETED, "session_id": SESSION_ID}
+        done.set()
+        stop.wait()
+
+    listener = SessionEventListener(hub, source, retry_delay=0.01).start()
+    assert done.wait(5)
+    listener.stop()
+    assert [event["event"] for event in received] == [notify.CREATED, RESYNC, notify.DELETED]
+    assert listener.stats == {"events": 2, "reconnects": 1, "errors": 1}
+
+def test_postgres_events_listens_and_parses_notifications():
+    conn = MagicMock()
+    conn.__enter__.return_value = conn
+    notification = MagicMock(payload=f'{{"event": "title", "session_id": "{SESSION_ID}", "title": "Hi"}}')
+    conn.notifies.return_value = iter([notification])
+    stop = threading.Event()
+
+    events = session_events.postgres_events(stop, connect=lambda: conn)
+    assert next(events) is None
+    assert next(events) == {"event": "title", "session_id": SESSION_ID, "title": "Hi"}
+    assert "LISTEN" in conn.execute.call_args.args[0].as_string(None)
+
+def test_notify_trigger_covers_create_title_and_delete():
+    conn = MagicMock()
+    notify.create_session_notify_trigger(conn)
+    function, trigger = (call.args[0].as_string(None) for call in conn.execute.call_args_list)
+    assert "pg_notify('chat_session_events'" in function
+    assert "AFTER INSERT OR DELETE OR UPDATE OF title" in trigger
+
+def _listen_in_process(index, ready, received):
+    from app.services.session_events import SessionEventHub, SessionEventListener
+
+    hub = SessionEventHub()
+    hub.subscribe(lambda event: received.put((index, event["event"], event.get("session_id"))))
+    listener = SessionEventListener(hub).start()
+    listener.connected.wait(10)
+    ready.set()
+    threading.Event().wait(30)  # the parent terminates us
+
+def _postgres_available():
+    try:
+        psycopg.connect(get_conninfo(), connect_timeout=2).close()
+        return True
+    except psycopg.Error:
+        return False
+
+@pytest.mark.skipif(not _postgres_available(), reason="needs a local Postgres (DB_* variables)")
+def test_session_events_reach_every_process():
+    from app.db.sessions import SESSIONS_TABLE, create_sessions_table
+
+    context = multiprocessing.get_context("spawn")
+    received = context.Queue()
+    readies, processes = [], []
+    for index in range(2):
+        ready = context.Event()
+        process = context.Process(target=_listen_in_process, args=(index, ready, received), daemon=True)
+        process.start()
+        readies.append(ready)
+        processes.append(process)
+    try:
+        with psycopg.connect(get_conninfo(), autocommit=True) as conn:
+            create_sessions_table(conn)
+            notify.create_session_notify_trigger(conn)
+            assert all(ready.wait(20) for ready in readies)
+            session_id = str(uuid.uuid4())
+            conn.execute(f"INSERT INTO {SESSIONS_TABLE} (session_id) VALUES (%s)", (session_id,))
+            conn.execute(f"UPDATE {SESSIONS_TABLE} SET message_count = 2 WHERE session_id = %s", (session_id,))  # no event
+            conn.execute(f"UPDATE {SESSIONS_TABLE} SET title = 'Hello' WHERE session_id = %s", (session_id,))
+            conn.execute(f"DELETE FROM {SESSIONS_TABLE} WHERE session_id = %s", (session_id,))
+
+        seen = {0: [], 1: []}
+        while len(seen[0]) < 3 or len(seen[1]) < 3:
+            index, event, event_session = received.get(timeout=10)
+            if event_session == session_id:
+                seen[index].append(event)
+        assert seen[0] == seen[1] == [notify.CREATED, notify.TITLED, notify.DELETED]
+    except queue.Empty:
+        pytest.fail("a process missed session events")
+    finally:
+        for process in processes:
+            process.terminate()
@@ -0,0 +1,76 @@
+import pytest
+from unittest.mock import patch, Mock, MagicMock, AsyncMock
+from langchain_core.messages import HumanMessage, AIMessage
+from app.db import sessions
+from app.db.history import PooledPostgresChatMessageHistory
+
+@pytest.fixture
+def mock_session_id():
+    return "11111111-1111-1111-1111-111111111111"
+
+def test_token_totals():
+    messages = [
+        HumanMessage(content="Hello"),
+        AIMessage(content="Hi!", usage_metadata={"input_tokens": 12, "output_tokens": 3, "total_tokens": 15}),
+    ]
+    assert sessions.token_totals(messages) == (12, 3)
+
+def test_record_messages(mock_session_id):
+    mock_cursor = Mock()
+    messages = [HumanMessage(content="Hello"), AIMessage(content="Hi!")]
+    sessions.record_messages(mock_cursor, mock_session_id, messages)
+    mock_cursor.execute.assert_called_once()
+    assert mock_cursor.execute.call_args.args[1] == (mock_session_id, 2, 0, 0)
+
+def test_backfill_sessions_copies_legacy_titles():
+    mock_cursor = Mock()
+    mock_cursor.fetchone.return_value = ("session_titles",)
+    mock_cursor.rowcount = 5
+    mock_conn = Mock()
+    mock_conn.cursor.return_value = mock_cursor
+
+    assert sessions.backfill_sessions(mock_conn) == 5
+    assert mock_cursor.execute.call_count == 3  # legacy check, aggregate upsert, title copy
+    mock_conn.commit.assert_called_once()
+
+def test_backfill_sessions_without_legacy_titles():
+    mock_cursor = Mock()
+    mock_cursor.fetchone.return_value = (None,)
+    mock_cursor.rowcount = 0
+    mock_conn = Mock()
+    mock_conn.cursor.return_value = mock_cursor
+
+    sessions.backfill_sessions(mock_conn)
+    assert mock_cursor.execute.call_count == 2
+
+def test_history_append_updates_sessions_in_same_transaction(mock_session_id):
+    mock_pool = MagicMock()
+    mock_conn = mock_pool.connection.return_value.__enter__.return_value
+    mock_cursor = mock_conn.cursor.return_value.__enter__.return_value
+
+    with patch("app.db.history.record_messages") as mock_record:
+        history = PooledPostgresChatMessageHistory("chat_history", mock_session_id, pool=mock_pool)
+        history.add_messages([HumanMessage(content="Hello")])
+
+        mock_cursor.executemany.assert_called_once()
+        mock_record.assert_called_once()
+        assert mock_record.call_args.args[0] is mock_cursor
+        mock_conn.commit.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_async_history_append_updates_sessions_in_same_transaction(mock_session_id):
+    mock_pool = MagicMock()
+    mock_conn = MagicMock()
+    mock_pool.connection.return_value.__aenter__.return_value = mock_conn
+    mock_conn.commit = AsyncMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value.__aenter__.return_value = mock_cursor
+    mock_cursor.executemany = AsyncMock()
+
+    with patch("app.db.history.arecord_messages", new=AsyncMock()) as mock_record:
+        history = PooledPostgresChatMessageHistory("chat_history", mock_session_id, pool=Mock(), async_pool=mock_pool)
+        await history.aadd_messages([HumanMessage(content="Hello")])
+
+        mock_cursor.executemany.assert_awaited_once()
+        assert mock_record.call_args.args[0] is mock_cursor
+        mock_conn.commit.assert_awaited_once()
@@ -0,0 +1,64 @@
+import pytest
+from unittest.mock import patch, AsyncMock
+from app.bench.fake_ollama import FakeOllamaServer, FakeOllamaConfig
+from app.services import startup
+from app.services.startup import Startup
+from app.core.runtime import keep_alive_value
+
+@pytest.fixture
+def fake_ollama():
+    server = FakeOllamaServer(config=FakeOllamaConfig(ttft=0.0)).start()
+    yield server
+    server.stop()
+
+@pytest.mark.asyncio
+async def test_load_model_preloads_with_keep_alive(fake_ollama):
+    warm_up = Startup(model="llama3.2", ollama_url=fake_ollama.url)
+    await warm_up.load_model()
+    path, request = fake_ollama.requests[0]
+    assert path == "/api/chat"
+    assert request["messages"] == [] and request["keep_alive"] == keep_alive_value()
+    assert warm_up.model_ready
+
+@pytest.mark.asyncio
+async def test_readiness_reports_db_and_model(fake_ollama):
+    warm_up = Startup(model="llama3.2", ollama_url=fake_ollama.url)
+    with patch.object(warm_up, "_check_db", new=AsyncMock()):
+        assert (await warm_up.readiness())["model"] is False  # reachable but not loaded yet
+        await warm_up.load_model()
+        readiness = await warm_up.readiness()
+    assert readiness["ready"] and readiness["db"] and readiness["model"]
+
+@pytest.mark.asyncio
+async def test_run_times_steps_and_survives_failures(fake_ollama):
+    warm_up = Startup(model="llama3.2", ollama_url=fake_ollama.url)
+    with patch.object(warm_up, "warm_db", new=AsyncMock(side_effect=OSError("db down"))), \
+         patch.object(startup, "OLLAMA_KEEP_WARM_INTERVAL", 0):
+        await warm_up.run()
+    assert not warm_up.db_ready and warm_up.model_ready
+    assert set(warm_up.timings) == {"db", "model", "startup"}
+
+@pytest.mark.asyncio
+async def test_failed_db_warm_up_is_retried_by_readiness(fake_ollama):
+    warm_up = Startup(model="llama3.2", ollama_url=fake_ollama.url)
+    with patch.object(warm_up, "warm_db", new=AsyncMock()) as mock_warm_db:
+        assert (await warm_up.readiness())["db"]
+    mock_warm_db.assert_awaited_once()
+
+def test_request_started_records_time_to_first_request():
+    now = [10.0]
+    warm_up = Startup(clock=lambda: now[0])
+    now[0] = 12.5
+    warm_up.request_started()
+    now[0] = 20.0
+    warm_up.request_started()
+    assert warm_up.timings["first_request"] == 2.5
+
+@pytest.mark.asyncio
+async def test_load_model_uses_chat_num_ctx_on_every_backend(fake_ollama):
+    warm_up = Startup(model="llama3.2", ollama_urls=[fake_ollama.url, "http://127.0.0.1:9"])
+    await warm_up.load_model()  # one backend down is not fatal
+    _, request = fake_ollama.requests[0]
+    assert request["options"] == {"num_ctx": startup.OLLAMA_NUM_CTX}
+    with patch.object(warm_up, "_check_db", new=AsyncMock()):
+        assert (await warm_up.readiness())["model"]
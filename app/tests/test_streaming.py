@@ -0,0 +1,34 @@
+from app.core.streaming import ChunkCoalescer, coalesce
+
+def test_first_piece_is_released_at_once():
+    coalescer = ChunkCoalescer(interval=1.0, max_bytes=100, clock=lambda: 0.0)
+    assert coalescer.add("Hi") == "Hi"
+    assert coalescer.add(" there") is None
+    assert coalescer.flush() == " there"
+    assert coalescer.flush() == ""
+
+def test_flushes_after_interval():
+    now = [0.0]
+    coalescer = ChunkCoalescer(interval=0.05, max_bytes=100, clock=lambda: now[0])
+    coalescer.add("a")
+    assert coalescer.add("b") is None
+    now[0] = 0.06
+    assert coalescer.add("c") == "bc"
+    assert (coalescer.pieces, coalescer.flushes) == (3, 2)
+
+def test_flushes_on_size():
+    coalescer = ChunkCoalescer(interval=10.0, max_bytes=4, clock=lambda: 0.0)
+    coalescer.add("a")
+    assert coalescer.add("bb") is None
+    assert coalescer.add("cc") == "bbcc"
+
+def test_empty_pieces_are_ignored():
+    coalescer = ChunkCoalescer(clock=lambda: 0.0)
+    assert coalescer.add("") is None
+    assert coalescer.pieces == 0
+
+def test_coalesce_keeps_all_text():
+    pieces = [f" t{index}" for index in range(100)]
+    batches = list(coalesce(pieces, interval=10.0, max_bytes=64))
+    assert "".join(batches) == "".join(pieces)
+    assert len(batches) < len(pieces)
@@ -0,0 +1,64 @@
+import asyncio
+import threading
+import pytest
+from unittest.mock import patch, AsyncMock
+from app.services import title_worker
+from app.services.title_worker import TitleWorker, is_greeting
+
+@pytest.fixture
+def mock_session_id():
+    return "11111111-1111-1111-1111-111111111111"
+
+@pytest.mark.parametrize("message", ["hi", "Hello there!", "hey assistant", "good morning", "thanks!", "  "])
+def test_is_greeting(message):
+    assert is_greeting(message)
+
+@pytest.mark.parametrize("message", ["hi, how do I reverse a list in python?", "What is the capital of France", "explain kubernetes"])
+def test_is_not_greeting(message):
+    assert not is_greeting(message)
+
+def test_greeting_skips_llm(mock_session_id):
+    with patch("app.services.title_worker.create_session_title", new=AsyncMock()) as mock_create, \
+         patch("app.services.title_worker.astore_title_in_db", new=AsyncMock()) as mock_store:
+        worker = TitleWorker()
+        worker.submit(mock_session_id, "hello!")
+        assert worker.wait_idle(timeout=2)
+
+        mock_create.assert_not_called()
+        mock_store.assert_awaited_once_with(mock_session_id, "New Chat")
+        assert worker.stats["skipped_greetings"] == 1
+
+def test_pending_jobs_for_a_session_are_coalesced(mock_session_id):
+    release = threading.Event()
+    started = threading.Event()
+    calls = []
+
+    async def slow_create(session_id, message):
+        calls.append(message)
+        started.set()
+        await asyncio.to_thread(release.wait, 2)
+
+    with patch("app.services.title_worker.create_session_title", new=slow_create):
+        worker = TitleWorker(concurrency=2)
+        worker.submit(mock_session_id, "first question about python")
+        assert started.wait(2)
+        worker.submit(mock_session_id, "second question about python")
+        worker.submit(mock_session_id, "third question about python")
+        release.set()
+        assert worker.wait_idle(timeout=2)
+
+    assert calls == ["first question about python", "third question about python"]
+    assert worker.stats["coalesced"] == 1
+
+def test_rename_job(mock_session_id):
+    with patch("app.services.title_worker.rename_session", new=AsyncMock()) as mock_rename:
+        worker = TitleWorker()
+        worker.submit(mock_session_id, "human: what is rust\nai: A systems language", rename=True)
+        assert worker.wait_idle(timeout=2)
+        mock_rename.assert_called_once()
+
+def test_cancel_drops_pending_job(mock_session_id):
+    worker = TitleWorker()
+    worker._pending[mock_session_id] = title_worker._Job("question", False)
+    worker.cancel(mock_session_id)
+    assert worker.wait_idle(timeout=0)
@@ -0,0 +1,159 @@
+import json
+import threading
+import uuid
+from unittest.mock import MagicMock, Mock
+
+import psycopg
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+from app.db.history import PooledPostgresChatMessageHistory
+from app.db.write_behind import MessageWriter, PendingMessage
+
+S1 = "11111111-1111-1111-1111-111111111111"
+S2 = "22222222-2222-2222-2222-222222222222"
+
+def mock_pool(first_id=101, fail=0, gate=None, entered=None):
+    """A pool whose connections reserve ids from `first_id`; the first `fail` checkouts raise."""
+    pool = MagicMock()
+    conn = MagicMock()
+    cursor = conn.cursor.return_value.__enter__.return_value
+    copy = cursor.copy.return_value.__enter__.return_value
+    attempts = []
+
+    def connection():
+        attempts.append(1)
+        if entered is not None:
+            entered.set()
+        if gate is not None:
+            gate.wait(5)
+        if len(attempts) <= fail:
+            raise psycopg.OperationalError("connection refused")
+        return MagicMock(__enter__=Mock(return_value=conn), __exit__=Mock(return_value=False))
+
+    pool.connection.side_effect = connection
+    cursor.fetchall.side_effect = lambda: [(first_id + i,) for i in range(cursor.execute.call_args.args[1][1])]
+    return pool, conn, cursor, copy
+
+def test_messages_of_several_sessions_are_written_in_one_batch():
+    pool, conn, cursor, copy = mock_pool()
+    writer = MessageWriter(pool=pool, interval=10)
+    writer.put(S1, [HumanMessage(content="hi"), AIMessage(content="hello")])
+    writer.put(S2, [HumanMessage(content="hey")])
+
+    assert writer.flush(timeout=5)
+    rows = [call.args[0] for call in copy.write_row.call_args_list]
+    assert [(row[0], row[1], row[2], row[3]) for row in rows] == [
+        (101, S1, "human", "hi"), (102, S1, "ai", "hello"), (103, S2, "human", "hey"),
+    ]
+    counters = cursor.executemany.call_args.args[1]
+    assert [(params[0], params[1]) for params in counters] == [(S1, 2), (S2, 1)]
+    conn.commit.assert_called_once()
+    assert writer.stats["batches"] == 1 and writer.stats["written"] == 3
+    assert writer.pending(S1) == [] and writer.backlog() == 0
+    writer.close()
+
+def test_failed_batches_are_retried_in_order():
+    pool, conn, cursor, copy = mock_pool(fail=1)
+    writer = MessageWriter(pool=pool, interval=0, retry_delay=0)
+    writer.put(S1, [HumanMessage(content="hi")])
+
+    assert writer.flush(timeout=5)
+    assert writer.stats["errors"] == 1 and writer.stats["written"] == 1
+    assert copy.write_row.call_args.args[0][:3] == (101, S1, "human")
+    writer.close()
+
+def test_batch_committed_before_a_lost_reply_is_not_written_twice():
+    pool, conn, cursor, copy = mock_pool()
+    cursor.fetchone.return_value = (1,)
+    pending = PendingMessage(S1, HumanMessage(content="hi"), 1)
+    pending.reserved_id = 7
+
+    MessageWriter(pool=pool)._write([pending])
+    copy.write_row.assert_not_called()
+    assert "id = ANY" in cursor.execute.call_args.args[0].as_string(None)
+
+def test_history_reads_its_queued_messages_back():
+    gate = threading.Event()
+    pool, conn, cursor, copy = mock_pool(gate=gate)
+    writer = MessageWriter(pool=pool, interval=0)
+    db_pool = MagicMock()
+    db_cursor = db_pool.connection.return_value.__enter__.return_value.cursor.return_value.__enter__.return_value
+    db_cursor.fetchall.return_value = [(5, "human", "earlier", None)]
+    history = PooledPostgresChatMessageHistory("chat_messages", S1, pool=db_pool, writer=writer)
+
+    history.add_messages([HumanMessage(content="hi"), AIMessage(content="hello")])
+    rows = history.get_message_rows(after_id=4)
+    assert [(message_id, message.content) for message_id, message in rows] == [(5, "earlier"), (None, "hi"), (None, "hello")]
+    assert history.get_message_rows(before_id=5, limit=2) == [(5, rows[0][1])]  # older pages have no queued messages
+
+    gate.set()
+    assert writer.flush(timeout=5)
+    assert [message_id for message_id, _ in history.get_message_rows(after_id=4)] == [5]
+    writer.close()
+
+def test_messages_committed_during_a_read_keep_their_ids():
+    writer = Mock()
+    committed = PendingMessage(S1, HumanMessage(content="hi"), 1)
+    committed.id = 6
+    writer.pending.return_value = [committed, PendingMessage(S1, AIMessage(content="hello"), 2)]
+    db_pool = MagicMock()
+    db_cursor = db_pool.connection.return_value.__enter__.return_value.cursor.return_value.__enter__.return_value
+    db_cursor.fetchall.return_value = [(5, "human", "earlier", None)]
+    history = PooledPostgresChatMessageHistory("chat_messages", S1, pool=db_pool, writer=writer)
+
+    assert [message_id for message_id, _ in history.get_message_rows()] == [5, 6, None]
+    db_cursor.fetchall.return_value = [(5, "human", "earlier", None), (6, "human", "hi", None)]
+    assert [message_id for message_id, _ in history.get_message_rows()] == [5, 6, None]
+
+def test_clear_flushes_queued_messages_first():
+    writer = Mock()
+    history = PooledPostgresChatMessageHistory("chat_messages", S1, pool=MagicMock(), writer=writer)
+    history.clear()
+    writer.flush.assert_called_once()
+
+def test_writers_wait_while_the_queue_is_full():
+    gate, entered = threading.Event(), threading.Event()
+    pool, conn, cursor, copy = mock_pool(gate=gate, entered=entered)
+    writer = MessageWriter(pool=pool, interval=0, max_pending=1)
+    writer.put(S1, [HumanMessage(content="one")])
+    assert entered.wait(5)
+    writer.put(S1, [HumanMessage(content="two")])  # the first is in flight, so the queue has room again
+    done = threading.Event()
+    threading.Thread(target=lambda: (writer.put(S2, [HumanMessage(content="three")]), done.set()), daemon=True).start()
+
+    assert not done.wait(0.2)
+    gate.set()
+    assert done.wait(5)
+    assert writer.flush(timeout=5)
+    assert writer.stats["waits"] == 1 and writer.stats["written"] == 3
+    writer.close()
+
+def test_rejected_messages_are_dead_lettered_and_the_rest_is_written(tmp_path):
+    pool, conn, cursor, copy = mock_pool()
+
+    def write_row(row):
+        if "\x00" in row[3]:
+            raise psycopg.DataError("invalid byte sequence for encoding \"UTF8\": 0x00")
+    copy.write_row.side_effect = write_row
+    dead_letter = tmp_path / "dead.jsonl"
+    writer = MessageWriter(pool=pool, interval=10, dead_letter=str(dead_letter))
+    writer.put(S1, [HumanMessage(content="hi"), HumanMessage(content="bad\x00")])
+    writer.put(S2, [HumanMessage(content="hey")])
+
+    assert writer.flush(timeout=5)
+    assert writer.stats["written"] == 2 and writer.stats["dead_letters"] == 1
+    assert writer.pending(S1) == [] and writer.backlog() == 0
+    assert [json.loads(line)["content"] for line in dead_letter.read_text().splitlines()] == ["bad\x00"]
+    writer.put(S2, [AIMessage(content="later")])  # the writer keeps going
+    assert writer.flush(timeout=5) and writer.stats["written"] == 3
+    writer.close()
+
+def test_batches_are_dead_lettered_after_max_retries():
+    pool, conn, cursor, copy = mock_pool(fail=100)
+    writer = MessageWriter(pool=pool, interval=0, retry_delay=0, max_retries=2, dead_letter="")
+    writer.put(S1, [HumanMessage(content="hi")])
+
+    assert writer.flush(timeout=5)
+    assert writer.stats["errors"] == 3 and writer.stats["dead_letters"] == 1 and writer.stats["written"] == 0
+    writer.close()
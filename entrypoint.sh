@@ -1,13 +1,19 @@
 #!/bin/bash
 
+MODEL="${OLLAMA_MODEL:-llama3.2}"
+
 echo 'Starting ollama server...'
 ollama serve &
 
 sleep 3
 
-echo '⬇️ Pulling llama3.2... This may take a few minutes ⏳'
-ollama pull llama3.2
+echo "⬇️ Pulling ${MODEL}... This may take a few minutes ⏳"
+ollama pull "${MODEL}"
+
+# load the model into memory now so the first chat doesn't pay for it (the API keeps it warm from here)
+echo "🔥 Loading ${MODEL} into memory..."
+ollama run "${MODEL}" "" --keepalive "${OLLAMA_KEEP_ALIVE:-30m}"
 
-echo '✅ Model llama3.2 is ready to use! Try running the app now: localhost:8501'
+echo "✅ Model ${MODEL} is ready to use! Try running the app now: localhost:8501"
 
-wait -n
\ No newline at end of file
+wait -n